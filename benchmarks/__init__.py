@@ -0,0 +1 @@
+"""Benchmarks for the collector and the normalization engines."""
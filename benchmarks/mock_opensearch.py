@@ -0,0 +1,257 @@
+"""In-memory OpenSearch stand-in answering the queries issued by the collector."""
+
+import copy
+import time
+import itertools
+from datetime import datetime, timezone
+from typing import Dict, List
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def _field(doc: Dict, path: str):
+    """Returns the value of a dotted field, keyword sub-fields map to the field itself"""
+    value = doc
+    for part in path.replace(".keyword", "").split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _as_list(clauses) -> List:
+    return clauses if isinstance(clauses, list) else [clauses]
+
+
+def matches(doc: Dict, query: Dict) -> bool:
+    """Evaluates the subset of the query DSL used by the collector"""
+    if not query:
+        return True
+    (kind, body), = query.items()
+    if kind == "match_all":
+        return True
+    if kind == "term":
+        (field, value), = body.items()
+        if isinstance(value, dict) and value.get("case_insensitive"):
+            actual = _field(doc, field)
+            return isinstance(actual, str) and actual.lower() == value["value"].lower()
+        return _field(doc, field) == (value["value"] if isinstance(value, dict) else value)
+    if kind == "terms":
+        (field, values), = ((k, v) for k, v in body.items() if k != "boost")
+        return _field(doc, field) in values
+    if kind == "exists":
+        return _field(doc, body["field"]) is not None
+    if kind == "range":
+        (field, bounds), = body.items()
+        value = _field(doc, field)
+        if value is None:
+            return False
+        checks = {"gte": value >= bounds.get("gte", value), "lte": value <= bounds.get("lte", value)}
+        if "gt" in bounds:
+            checks["gt"] = value > bounds["gt"]
+        if "lt" in bounds:
+            checks["lt"] = value < bounds["lt"]
+        return all(checks.values())
+    if kind == "bool":
+        if not all(matches(doc, clause) for key in ("must", "filter") for clause in _as_list(body.get(key, []))):
+            return False
+        if any(matches(doc, clause) for clause in _as_list(body.get("must_not", []))):
+            return False
+        should = _as_list(body.get("should", []))
+        if should:
+            minimum = body.get("minimum_should_match", 0 if ("must" in body or "filter" in body) else 1)
+            if sum(matches(doc, clause) for clause in should) < minimum:
+                return False
+        return True
+    raise NotImplementedError(f"Unsupported query {kind}")
+
+
+def _uuids(query: Dict):
+    """Returns the uuids a query is restricted to by its filters, or None when it isn't"""
+    if not query:
+        return None
+    (kind, body), = query.items()
+    if kind == "term" and "uuid.keyword" in body:
+        value = body["uuid.keyword"]
+        return {value["value"] if isinstance(value, dict) else value}
+    if kind == "terms" and "uuid.keyword" in body:
+        return set(body["uuid.keyword"])
+    if kind == "bool":
+        for key in ("must", "filter"):
+            for clause in _as_list(body.get(key, [])):
+                uuids = _uuids(clause)
+                if uuids is not None:
+                    return uuids
+    return None
+
+
+def _project(doc: Dict, source) -> Dict:
+    """Applies _source filtering to a document"""
+    if source in (None, True):
+        # Top level keys are popped by the normalization, nested values are never modified
+        return dict(doc)
+    if isinstance(source, list):
+        source = {"includes": source}
+    projected = copy.deepcopy(doc)
+    for field in source.get("excludes", []):
+        projected.pop(field, None)
+    if source.get("includes"):
+        included = {}
+        for field in source["includes"]:
+            value = _field(projected, field)
+            if value is not None:
+                target = included
+                parts = field.split(".")
+                for part in parts[:-1]:
+                    target = target.setdefault(part, {})
+                target[parts[-1]] = copy.deepcopy(value)
+        projected = included
+    return projected
+
+
+class MockOpenSearch:
+    """Answers search, scroll and composite aggregation requests from a list of documents
+
+    latency adds a fixed delay, in seconds, to every request to emulate a remote cluster.
+    """
+
+    def __init__(self, docs: List[Dict], latency: float = 0.0):
+        """Init method for instance variables"""
+        self.docs = docs
+        self.by_uuid = {}
+        for doc in docs:
+            self.by_uuid.setdefault(doc.get("uuid"), []).append(doc)
+        self.latency = latency
+        self.requests = 0
+        self.scrolls = {}
+        self.pits = {}
+        self.ids = itertools.count()
+
+    def _request(self) -> None:
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def search(self, index=None, body=None, params=None, **kwargs):
+        """Handles plain, sorted, scrolled, sliced, point in time and aggregation searches"""
+        self._request()
+        body = body or {}
+        params = dict(params or {}, **kwargs)
+        uuids = _uuids(body.get("query"))
+        if body.get("pit"):
+            # A point in time searches the documents indexed when it was created
+            candidates = [doc for doc in self.pits[body["pit"]["id"]] if uuids is None or doc.get("uuid") in uuids]
+        else:
+            candidates = self.docs if uuids is None else [doc for uuid in uuids for doc in self.by_uuid.get(uuid, [])]
+        docs = [doc for doc in candidates if matches(doc, body.get("query"))]
+        if body.get("slice"):
+            docs = [doc for idx, doc in enumerate(docs) if idx % body["slice"]["max"] == body["slice"]["id"]]
+        if body.get("aggs") or body.get("aggregations"):
+            aggregations = self._aggregations(docs, body.get("aggs") or body.get("aggregations"))
+            return {"took": 1, "timed_out": False, "hits": {"hits": []}, "aggregations": aggregations}
+        sort_fields = [next(iter(field)) if isinstance(field, dict) else field for field in body.get("sort", [])]
+        if sort_fields:
+            docs.sort(key=lambda doc: [_field(doc, field) for field in sort_fields])
+            if body.get("search_after"):
+                after = list(body["search_after"])
+                docs = [doc for doc in docs if [_field(doc, field) for field in sort_fields] > after]
+        hits = []
+        for doc in docs:
+            hit = {"_index": index, "_id": str(id(doc)), "_source": _project(doc, body.get("_source"))}
+            if sort_fields:
+                hit["sort"] = [_field(doc, field) for field in sort_fields]
+            hits.append(hit)
+        size = int(body.get("size", params.get("size", 10)))
+        response = {"took": 1, "timed_out": False, "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0}}
+        if body.get("pit"):
+            response["pit_id"] = body["pit"]["id"]
+        if "scroll" in params:
+            scroll_id = str(next(self.ids))
+            self.scrolls[scroll_id] = (hits[size:], size)
+            response["_scroll_id"] = scroll_id
+        response["hits"] = {"total": {"value": len(hits), "relation": "eq"}, "hits": hits[:size]}
+        return response
+
+    def scroll(self, body=None, scroll_id=None, params=None, **kwargs):
+        """Returns the next page of a scroll"""
+        self._request()
+        scroll_id = (body or {}).get("scroll_id", scroll_id)
+        hits, size = self.scrolls[scroll_id]
+        self.scrolls[scroll_id] = (hits[size:], size)
+        return {
+            "_scroll_id": scroll_id,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"hits": hits[:size]},
+        }
+
+    def clear_scroll(self, body=None, scroll_id=None, params=None, **kwargs):
+        """Releases a scroll"""
+        scroll_ids = (body or {}).get("scroll_id", scroll_id)
+        for scroll_id in scroll_ids if isinstance(scroll_ids, list) else [scroll_ids]:
+            self.scrolls.pop(scroll_id, None)
+        return {"succeeded": True}
+
+    def _date_histogram(self, docs: List[Dict], spec: Dict) -> Dict:
+        """Counts documents in fixed interval buckets, keyed by their start in epoch milliseconds"""
+        interval = int(spec["fixed_interval"].rstrip("s"))
+        counts = {}
+        for doc in docs:
+            epoch = datetime.strptime(_field(doc, spec["field"]), TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+            start = int(epoch // interval * interval)
+            counts[start] = counts.get(start, 0) + 1
+        buckets = [{"key": start * 1000, "doc_count": counts[start]} for start in sorted(counts)]
+        return {"buckets": [bucket for bucket in buckets if bucket["doc_count"] >= spec.get("min_doc_count", 0)]}
+
+    def create_pit(self, index=None, params=None, **kwargs):
+        """Creates a point in time over the current documents"""
+        self._request()
+        pit_id = str(next(self.ids))
+        self.pits[pit_id] = list(self.docs)
+        return {"pit_id": pit_id, "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0}}
+
+    def delete_pit(self, body=None, params=None, **kwargs):
+        """Releases points in time"""
+        pits = [{"pit_id": pit_id, "successful": self.pits.pop(pit_id, None) is not None} for pit_id in body["pit_id"]]
+        return {"pits": pits}
+
+    def _aggregations(self, docs: List[Dict], aggregations: Dict) -> Dict:
+        """Computes composite aggregations with metric sub aggregations, and date histograms"""
+        # Documents without value are ignored, reductions of no value are null but their sum
+        reducers = {
+            "avg": lambda v: sum(v) / len(v) if v else None,
+            "max": lambda v: max(v) if v else None,
+            "min": lambda v: min(v) if v else None,
+            "sum": lambda v: float(sum(v)),
+            "value_count": len,
+        }
+        results = {}
+        for name, spec in aggregations.items():
+            if "date_histogram" in spec:
+                results[name] = self._date_histogram(docs, spec["date_histogram"])
+                continue
+            composite = spec["composite"]
+            sources = [(next(iter(source)), next(iter(source.values()))["terms"]["field"]) for source in composite["sources"]]
+            groups = {}
+            for doc in docs:
+                key = tuple(_field(doc, field) for _, field in sources)
+                groups.setdefault(key, []).append(doc.get("value"))
+
+            def order(key):
+                # Missing buckets sort first, as in OpenSearch
+                return [(value is not None, value) for value in key]
+
+            keys = sorted(groups, key=order)
+            if composite.get("after"):
+                after = order(tuple(composite["after"][source] for source, _ in sources))
+                keys = [key for key in keys if order(key) > after]
+            buckets = []
+            for key in keys[:composite.get("size", 10)]:
+                bucket = {"key": {source: value for (source, _), value in zip(sources, key)}, "doc_count": len(groups[key])}
+                for sub_name, sub_spec in spec.get("aggs", {}).items():
+                    (function, _), = sub_spec.items()
+                    bucket[sub_name] = {"value": reducers[function]([value for value in groups[key] if value is not None])}
+                buckets.append(bucket)
+            results[name] = {"buckets": buckets}
+            if buckets:
+                results[name]["after_key"] = buckets[-1]["key"]
+        return results
@@ -0,0 +1,339 @@
+"""Benchmark harness for the collector and the normalization stages.
+
+Usage: python -m benchmarks.run --runs 50 --metrics 20 --cardinality 100 --output results.json
+       python -m benchmarks.run --compare results.json
+"""
+
+import os
+import sys
+import copy
+import gzip
+import json
+import math
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+from benchmarks import synthetic
+from benchmarks.mock_opensearch import MockOpenSearch
+from data_collector import collector
+from data_collector.local import LocalSource
+from data_collector.normalize import MetricSeries, normalize_metrics, process_json
+from data_collector.pipeline import ENGINES
+from data_collector.utils import compile_exclude_patterns, flatten_json, recursively_flatten_values, strhash
+
+logger = logging.getLogger(__name__)
+
+# Engines computing every value with the same float operations as the reference, their rows must be equal
+EXACT_ENGINES = ("python", "fused")
+
+
+def measure(func: Callable, prepare: Callable) -> Dict:
+    """Times a stage and measures its peak allocations in a second, traced, execution
+
+    prepare builds the input of the stage outside of the measured section, as stages may mutate it.
+    """
+    inputs = prepare()
+    start = time.perf_counter()
+    func(inputs)
+    seconds = time.perf_counter() - start
+    inputs = prepare()
+    tracemalloc.start()
+    func(inputs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds": round(seconds, 6), "peak_bytes": peak}
+
+
+def group_runs(docs: List[Dict], config: Dict) -> List[Dict]:
+    """Groups a corpus in the run format yielded by the collector"""
+    runs = {}
+    for doc in docs:
+        if doc["metricName"] == "jobSummary":
+            metadata = {field: doc[field] for field in config["metadata"] if field in doc}
+            metadata["jobConfig"] = {field: doc["jobConfig"][field] for field in config["metadata"] if field in doc["jobConfig"]}
+            runs[doc["uuid"]] = {"metadata": metadata, "metrics": {}}
+    for doc in docs:
+        if doc["metricName"] != "jobSummary":
+            runs[doc["uuid"]]["metrics"].setdefault(doc["metricName"], []).append(doc)
+    return list(runs.values())
+
+
+def normalization_stages(runs: List[Dict], exclude_metrics: str) -> Dict:
+    """Measures each step of normalize() separately and every normalization engine end to end"""
+    skip_patterns = compile_exclude_patterns(exclude_metrics)
+
+    def merged(run_list):
+        outputs = []
+        for run in run_list:
+            output = {"metrics": {}}
+            for metric, entries in run["metrics"].items():
+                process_json(metric, entries, skip_patterns, output)
+            outputs.append(output)
+        return outputs
+
+    def nested(run_list):
+        return [normalize_metrics(output["metrics"].items()) for output in merged(run_list)]
+
+    def flattened_values(run_list):
+        return [recursively_flatten_values(tree) for tree in nested(run_list)]
+
+    def flatten_all(trees):
+        for tree in trees:
+            flatten_json({}, tree)
+
+    def labels(run_list):
+        return [entry["labels"] for run in run_list for entries in run["metrics"].values() for entry in entries if entry.get("labels")]
+
+    stages = {
+        "strhash": measure(lambda label_sets: [strhash(label_set) for label_set in label_sets], lambda: labels(runs)),
+        "process_json": measure(merged, lambda: copy.deepcopy(runs)),
+        "normalize_metrics": measure(
+            lambda outputs: [normalize_metrics(output["metrics"].items()) for output in outputs],
+            lambda: merged(copy.deepcopy(runs)),
+        ),
+        "recursively_flatten_values": measure(
+            lambda trees: [recursively_flatten_values(tree) for tree in trees], lambda: nested(copy.deepcopy(runs))
+        ),
+        "flatten_json": measure(flatten_all, lambda: flattened_values(copy.deepcopy(runs))),
+    }
+    for engine, normalize in ENGINES.items():
+        try:
+            # Rows aren't kept, so the peak is the one of the largest run
+            stages[f"normalize[{engine}]"] = measure(
+                lambda run_list: [normalize(run, exclude_metrics) and None for run in run_list], lambda: copy.deepcopy(runs)
+            )
+            stages[f"normalize[{engine},series]"] = measure(
+                lambda run_list: [normalize(run, exclude_metrics) and None for run in run_list],
+                lambda: [compact(run) for run in runs],
+            )
+        except ImportError as e:
+            logger.warning(f"Skipping engine {engine}: {e}")
+    return stages
+
+
+def compact(run: Dict) -> Dict:
+    """Stores the metrics of a run as series, as the collector does"""
+    metrics = {name: MetricSeries.from_documents(name, entries) for name, entries in run["metrics"].items()}
+    return {"metadata": run["metadata"], "metrics": metrics}
+
+
+def store_stages(docs: List[Dict]) -> Dict:
+    """Measures the memory held by the metrics of the corpus, as documents and as series"""
+    # Documents are decoded from JSON, as the client does with the responses
+    encoded = [json.dumps(doc) for doc in docs if doc["metricName"] != "jobSummary"]
+
+    def documents(lines):
+        runs = {}
+        for line in lines:
+            doc = json.loads(line)
+            runs.setdefault(doc["uuid"], {}).setdefault(doc["metricName"], []).append(doc)
+        return runs
+
+    def series(lines):
+        runs = {}
+        for line in lines:
+            doc = json.loads(line)
+            run_metrics = runs.setdefault(doc["uuid"], {})
+            if doc["metricName"] not in run_metrics:
+                run_metrics[doc["metricName"]] = MetricSeries(doc["metricName"])
+            run_metrics[doc["metricName"]].append(doc)
+        return runs
+
+    return {
+        "store[documents]": measure(documents, lambda: encoded),
+        "store[series]": measure(series, lambda: encoded),
+    }
+
+
+def conformance(runs: List[Dict], exclude_metrics: str) -> Dict:
+    """Compares the rows of every engine, on documents and on series, with the reference python engine"""
+    reference = [ENGINES["python"](run, exclude_metrics) for run in copy.deepcopy(runs)]
+    results = {}
+    for engine, normalize in ENGINES.items():
+        for variant, prepare in (("", copy.deepcopy), ("[series]", compact)):
+            try:
+                rows = [normalize(prepare(run), exclude_metrics) for run in runs]
+            except ImportError:
+                continue
+            if engine in EXACT_ENGINES:
+                results[engine + variant] = rows == reference
+            else:
+                results[engine + variant] = all(_same_row(expected, row) for expected, row in zip(reference, rows))
+    return results
+
+
+def _same_row(expected: Dict, row: Dict) -> bool:
+    """Rows must have the same columns, floats may differ by rounding"""
+    if expected.keys() != row.keys():
+        return False
+    for key, value in expected.items():
+        if isinstance(value, float) and isinstance(row[key], float):
+            if not math.isclose(value, row[key], rel_tol=1e-9, abs_tol=1e-12):
+                return False
+        elif value != row[key]:
+            return False
+    return True
+
+
+def collection_stages(docs: List[Dict], config: Dict, latency: float, concurrency: int) -> Dict:
+    """Measures a full collection against the mock cluster with every fetch mode"""
+    modes = {
+        "collect[per-uuid]": {},
+        "collect[batch]": {"batch_metrics": True},
+        f"collect[per-uuid,concurrency={concurrency}]": {"concurrency": concurrency},
+        f"collect[batch,concurrency={concurrency}]": {"batch_metrics": True, "concurrency": concurrency},
+        f"collect[batch,concurrency={concurrency},slices=4]": {"batch_metrics": True, "concurrency": concurrency, "slices": 4},
+        "collect[pit]": {"pit": True},
+    }
+    from_date = synthetic.START
+    to = synthetic.START + timedelta(days=365)
+    stages = {}
+    for name, options in modes.items():
+        mock = MockOpenSearch(docs, latency)
+
+        def collect(instance):
+            for _ in instance.collect(from_date, to):
+                pass
+
+        def prepare():
+            instance = collector.Collector("http://localhost:9200", "kube-burner", config, **options)
+            instance.os_client = mock
+            return instance
+
+        stages[name] = measure(collect, prepare)
+        stages[name]["requests"] = mock.requests // 2
+    return stages
+
+
+def write_layouts(docs: List[Dict], directory: str) -> Dict[str, str]:
+    """Writes the corpus as kube-burner local indexer output, one directory of metric files per
+    uuid, and as _search exports of one hit per line, plain and gzip compressed"""
+    layouts = {
+        "indexer": os.path.join(directory, "indexer"),
+        "ndjson": os.path.join(directory, "export.ndjson"),
+        "ndjson.gz": os.path.join(directory, "export.ndjson.gz"),
+    }
+    files = {}
+    for doc in docs:
+        files.setdefault((doc["uuid"], doc["metricName"]), []).append(doc)
+    for (uuid, metric_name), metric_docs in files.items():
+        os.makedirs(os.path.join(layouts["indexer"], uuid), exist_ok=True)
+        with open(os.path.join(layouts["indexer"], uuid, f"{metric_name}.json"), "w") as f:
+            json.dump(metric_docs, f, indent=2)
+    with open(layouts["ndjson"], "w") as plain, gzip.open(layouts["ndjson.gz"], "wt") as compressed:
+        for idx, doc in enumerate(docs):
+            line = json.dumps({"_index": "kube-burner", "_id": str(idx), "_source": doc}) + "\n"
+            plain.write(line)
+            compressed.write(line)
+    return layouts
+
+
+def local_stages(config: Dict, layouts: Dict[str, str]) -> Dict:
+    """Measures a full collection, indexing included, from every local layout"""
+    from_date = synthetic.START
+    to = synthetic.START + timedelta(days=365)
+    stages = {}
+    for name, path in layouts.items():
+
+        def collect(instance):
+            for _ in instance.collect(from_date, to):
+                pass
+            instance.close()
+
+        stages[f"collect[local,{name}]"] = measure(collect, lambda: LocalSource([path], config))
+    return stages
+
+
+def local_conformance(docs: List[Dict], config: Dict, exclude_metrics: str, layouts: Dict[str, str]) -> Dict:
+    """Compares the rows collected from every local layout with the ones collected from the mock cluster"""
+    from_date = synthetic.START
+    to = synthetic.START + timedelta(days=365)
+
+    def rows(source):
+        normalize = ENGINES["python"]
+        return [(uuid, normalize(run, exclude_metrics)) for each_run in source.collect(from_date, to) for uuid, run in each_run.items()]
+
+    instance = collector.Collector("http://localhost:9200", "kube-burner", config)
+    instance.os_client = MockOpenSearch(docs)
+    reference = rows(instance)
+    results = {}
+    for name, path in layouts.items():
+        source = LocalSource([path], config)
+        results[f"collect[local,{name}]"] = rows(source) == reference
+        source.close()
+    return results
+
+
+def compare(baseline: Dict, current: Dict) -> None:
+    """Prints the time and memory ratio of every stage against a baseline"""
+    for stage, result in current["stages"].items():
+        previous = baseline["stages"].get(stage)
+        if not previous:
+            continue
+        speed = previous["seconds"] / result["seconds"] if result["seconds"] else float("inf")
+        memory = result["peak_bytes"] / previous["peak_bytes"] if previous["peak_bytes"] else float("inf")
+        print(f"{stage:45} {speed:6.2f}x faster  {memory:6.2f}x memory")
+
+
+def main():
+    """Runs the benchmarks and writes the results as JSON"""
+    parser = argparse.ArgumentParser(description="Kube-burner data collector benchmarks")
+    parser.add_argument("--runs", type=int, default=20, help="Number of runs in the corpus")
+    parser.add_argument("--metrics", type=int, default=10, help="Number of metrics per run")
+    parser.add_argument("--cardinality", type=int, default=50, help="Number of label series per metric")
+    parser.add_argument("--datapoints", type=int, default=10, help="Number of datapoints per label series")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpus")
+    parser.add_argument("--latency", type=float, default=0.005, help="Mock cluster latency per request, in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrency of the concurrent collection modes")
+    parser.add_argument("--skip-collection", action="store_true", help="Only benchmark the normalization stages")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare the results with a previous JSON result file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    parameters = {
+        "runs": args.runs,
+        "metrics": args.metrics,
+        "cardinality": args.cardinality,
+        "datapoints": args.datapoints,
+        "seed": args.seed,
+    }
+    docs = synthetic.generate(**parameters)
+    config = synthetic.config(args.metrics)
+    exclude_metrics = ",".join(config["exclude_normalization"])
+    runs = group_runs(docs, config)
+
+    stages = normalization_stages(runs, exclude_metrics)
+    stages.update(store_stages(docs))
+    checks = conformance(runs, exclude_metrics)
+    if not args.skip_collection:
+        stages.update(collection_stages(docs, config, args.latency, args.concurrency))
+        with tempfile.TemporaryDirectory() as directory:
+            layouts = write_layouts(docs, directory)
+            stages.update(local_stages(config, layouts))
+            checks.update(local_conformance(docs, config, exclude_metrics, layouts))
+    results = {
+        "date": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": dict(parameters, documents=len(docs), latency=args.latency, concurrency=args.concurrency),
+        "conformance": checks,
+        "stages": stages,
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    return 0 if all(results["conformance"].values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""Seeded generator of synthetic kube-burner jobSummary and metric documents."""
+
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+BENCHMARK = "cluster-density-v2"
+START = datetime(2025, 1, 1)
+MODES = ["user", "system", "idle", "iowait", "irq", "softirq", "steal"]
+VERBS = ["GET", "LIST", "WATCH", "POST", "PUT", "PATCH", "DELETE"]
+QUANTILES = ["PodScheduled", "Initialized", "ContainersReady", "Ready"]
+METADATA = ["passed", "elapsedTime", "ocpVersion", "platform", "totalNodes", "uuid", "jobIterations", "qps", "burst"]
+
+
+def metric_names(count: int) -> List[str]:
+    """Returns the metric names of a corpus, alert and a quantile metric are always included"""
+    names = ["alert", "podLatencyQuantilesMeasurement"]
+    return names + [f"{('cpu', 'memory')[idx % 2]}-component-{idx}" for idx in range(count - len(names))]
+
+
+def config(metrics: int) -> Dict:
+    """Returns the collector configuration matching a corpus"""
+    return {
+        "benchmark": BENCHMARK,
+        "metadata": METADATA,
+        "metrics": metric_names(metrics),
+        "exclude_normalization": ["jobSummary", "alert", "-start"],
+        "output_prefix": "bench",
+    }
+
+
+def generate(runs: int = 10, metrics: int = 10, cardinality: int = 50, datapoints: int = 10, seed: int = 0) -> List[Dict]:
+    """Generates the documents of a corpus
+
+    runs: number of jobSummary documents, one per uuid
+    metrics: number of metrics per run
+    cardinality: number of label series per metric
+    datapoints: number of datapoints per label series
+    """
+    rnd = random.Random(seed)
+    docs = []
+    for run in range(runs):
+        uuid = f"{rnd.getrandbits(128):032x}"
+        timestamp = (START + timedelta(minutes=run)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        docs.append({
+            "uuid": uuid,
+            "metricName": "jobSummary",
+            "timestamp": timestamp,
+            "passed": rnd.random() > 0.1,
+            "elapsedTime": rnd.randint(300, 3600),
+            "ocpVersion": rnd.choice(["4.17.1", "4.18.3", "4.19.0"]),
+            "platform": rnd.choice(["AWS", "GCP", "Azure"]),
+            "totalNodes": rnd.choice([24, 120, 252]),
+            "version": "1.15.0",
+            "jobConfig": {"name": BENCHMARK, "jobIterations": rnd.choice([100, 500]), "qps": 20, "burst": 20},
+        })
+        for name in metric_names(metrics):
+            docs.extend(_metric_documents(rnd, uuid, name, timestamp, cardinality, datapoints))
+    return docs
+
+
+def _metric_documents(rnd: random.Random, uuid: str, name: str, timestamp: str, cardinality: int, datapoints: int):
+    """Generates the documents of one metric of a run"""
+    base = {"uuid": uuid, "metricName": name, "timestamp": timestamp, "jobName": BENCHMARK}
+    if name == "alert":
+        return [
+            dict(base, severity=rnd.choice(["warning", "error", "info"]), description="synthetic alert")
+            for _ in range(rnd.randint(0, 3))
+        ]
+    if name == "podLatencyQuantilesMeasurement":
+        return [
+            dict(base, quantileName=quantile, P99=rnd.randint(1, 9999), P95=rnd.randint(1, 999),
+                 P50=rnd.randint(1, 99), avg=rnd.random() * 100, max=rnd.randint(1, 99999), metadata={})
+            for quantile in QUANTILES
+        ]
+    docs = []
+    for series in range(cardinality):
+        labels = {"mode": MODES[series % len(MODES)], "node": f"node-{series}", "instance": f"10.0.0.{series % 255}"}
+        if series % 3:
+            labels["namespace"] = f"namespace-{series % 17}"
+        if series % 5 == 0:
+            labels["verb"] = VERBS[series % len(VERBS)]
+        for point in range(datapoints):
+            doc = dict(base, labels=labels, value=rnd.random() * 100, query=f"rate({name}[2m])", metadata={})
+            if point == 0 and series % 10 == 0:
+                doc["churnMetric"] = True
+            docs.append(doc)
+    return docs
@@ -0,0 +1,76 @@
+"""Local on-disk cache of raw metric documents."""
+
+import os
+import gzip
+import json
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_SUFFIX = ".json.gz"
+
+
+class MetricCache:
+    def __init__(self, directory: str, max_bytes: int):
+        """Init method for instance variables"""
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(os.path.getsize(path) for path in self._entries())
+
+    def key(self, index: str, uuid: str, metrics: List[str]) -> str:
+        """Content address of the metrics of a run, any change in the metric set produces a different key"""
+        identity = json.dumps([index, uuid, sorted(metrics)])
+        return hashlib.sha256(identity.encode()).hexdigest()
+
+    def get(self, index: str, uuid: str, metrics: List[str]) -> Optional[Dict[str, list]]:
+        """Returns the cached datapoints of a run, or None on a cache miss"""
+        path = self._path(self.key(index, uuid, metrics))
+        try:
+            with gzip.open(path, "rt") as f:
+                datapoints = json.load(f)
+        except FileNotFoundError:
+            return None
+        # Entries are evicted by modification time, so touching them on read makes the cache LRU
+        os.utime(path)
+        logger.debug(f"Cache hit for UUID {uuid}")
+        return datapoints
+
+    def put(self, index: str, uuid: str, metrics: List[str], datapoints: Dict[str, list]) -> None:
+        """Stores the datapoints of a run and evicts the least recently used entries over the size limit"""
+        path = self._path(self.key(index, uuid, metrics))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp, "wt") as f:
+            json.dump(datapoints, f, separators=(",", ":"))
+        with self.lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp, path)
+            self.size += os.path.getsize(path) - previous
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _path(self, key: str) -> str:
+        """Entries are spread in subdirectories to keep directory listings short"""
+        return os.path.join(self.directory, key[:2], f"{key}{CACHE_SUFFIX}")
+
+    def _entries(self) -> List[str]:
+        """Lists the paths of every cache entry"""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            entries.extend(os.path.join(root, name) for name in files if name.endswith(CACHE_SUFFIX))
+        return entries
+
+    def _evict(self) -> None:
+        """Removes the least recently used entries until the cache fits in max_bytes"""
+        entries = sorted((os.stat(path).st_mtime, os.path.getsize(path), path) for path in self._entries())
+        for _, size, path in entries:
+            if self.size <= self.max_bytes:
+                break
+            os.remove(path)
+            self.size -= size
+            logger.debug(f"Evicted cache entry {path}")
@@ -0,0 +1,55 @@
+"""Checkpoint store for incremental collections."""
+
+import logging
+from typing import Iterable, List, Optional
+from data_collector.storage import read_json, write_json
+
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint:
+    def __init__(self, location: str, client=None):
+        """Init method for instance variables, location is a local path or an s3:// URI read and written with client"""
+        self.location = location
+        self.client = client
+        self.search_after: Optional[List] = None
+        self.uuids = set()
+        self.chunks = 0
+        # Epoch seconds up to which every run was exported, only kept by watch collections
+        self.watermark: Optional[float] = None
+
+    def load(self):
+        """Loads the persisted state, an absent checkpoint means a fresh start"""
+        state = read_json(self.location, self.client)
+        if state:
+            self.search_after = state.get("search_after")
+            self.uuids = set(state.get("uuids", []))
+            self.chunks = state.get("chunks", 0)
+            self.watermark = state.get("watermark")
+            logger.info(
+                f"Resuming from checkpoint {self.location}: {len(self.uuids)} exported UUIDs, "
+                f"search_after={self.search_after}"
+            )
+        return self
+
+    def update(self, uuids: Iterable[str], search_after: Optional[List]) -> None:
+        """Records an exported chunk and persists the new state"""
+        self.uuids.update(uuids)
+        if search_after:
+            self.search_after = search_after
+        self.chunks += 1
+        self.save()
+
+    def advance(self, watermark: float, forget: Iterable[str] = ()) -> None:
+        """Moves the watermark, drops the UUIDs no later collection can match again and persists the new state"""
+        self.watermark = watermark
+        self.uuids.difference_update(forget)
+        self.save()
+
+    def save(self) -> None:
+        """Persists the state"""
+        state = {"search_after": self.search_after, "uuids": sorted(self.uuids), "chunks": self.chunks}
+        if self.watermark is not None:
+            state["watermark"] = self.watermark
+        write_json(self.location, state, self.client)
+        logger.debug(f"Checkpoint saved to {self.location}")
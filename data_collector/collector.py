@@ -1,118 +1,455 @@
+import json
 import logging
+import math
 import time
-from opensearchpy import OpenSearch
+from concurrent.futures import ThreadPoolExecutor
+from opensearchpy import OpenSearch, helpers
 from opensearch_dsl import Search, Q
 from datetime import datetime
+from typing import Tuple
+from data_collector.cache import MetricCache
+from data_collector.constants import (
+    AGGREGATION_PAGE_SIZE,
+    PAGE_SIZE,
+    PAGE_SIZE_RANGE,
+    PIT_KEEP_ALIVE,
+    PIT_KEEP_ALIVE_FACTOR,
+    SCAN_SIZE,
+    SCAN_SIZE_RANGE,
+    TARGET_BYTES,
+    TARGET_LATENCY,
+)
+from data_collector.fetch import AdaptiveSize, get_serializer, is_context_missing, retry
+from data_collector.instrumentation import SIZE_BUCKETS, recorder
+from data_collector.normalize import AGGREGATION, DROP_LIST, LABELS_LIST, REQUIRED_FIELDS, MetricSeries
+from data_collector.source import Source
+from data_collector.utils import split_list_into_chunks
 
 logger = logging.getLogger(__name__)
 
-class Collector:
-    def __init__(self, es_server: str, es_index: str, config: dict):
-        """Init method for instance variables"""
-        self.config = config
+# Name of the sub aggregation counting the values of a bucket
+VALUE_COUNT = "values"
+
+class Collector(Source):
+    """Collects the runs of a benchmark from an OpenSearch index"""
+
+    def __init__(
+        self,
+        es_server: str,
+        es_index: str,
+        config: dict,
+        batch_metrics: bool = False,
+        concurrency: int = 1,
+        cache: MetricCache = None,
+        pit: bool = False,
+        slices: int = 1,
+        skip_excluded: bool = False,
+        pit_keep_alive: int = PIT_KEEP_ALIVE,
+    ):
+        """Init method for instance variables, pit_keep_alive is in seconds"""
+        super().__init__(config, skip_excluded)
         self.es_index = es_index
-        self.os_client = OpenSearch(es_server, verify_certs=False, http_compress=True, timeout=30)
+        self.batch_metrics = batch_metrics
+        self.concurrency = max(1, concurrency)
+        self.cache = cache
+        self.pit = pit
+        self.pit_keep_alive = pit_keep_alive
+        self.slices = max(1, slices)
+        # The metrics of a jobSummary page are fetched and held for this many runs at once, whatever the page size
+        self.metrics_batch = PAGE_SIZE if batch_metrics else self.concurrency
+        # The client is shared by every worker thread, so its connection pool must fit all of them
+        self.os_client = OpenSearch(
+            es_server,
+            verify_certs=False,
+            http_compress=True,
+            timeout=30,
+            pool_maxsize=max(10, self.concurrency),
+            serializer=get_serializer(),
+        )
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency) if self.concurrency > 1 else None
+        # Slices get their own pool, a batch waiting for its slices must not hold a slot they need
+        self.slice_executor = ThreadPoolExecutor(max_workers=self.concurrency * self.slices) if self.slices > 1 else None
+        self.page_size = AdaptiveSize(PAGE_SIZE, *PAGE_SIZE_RANGE, TARGET_LATENCY, TARGET_BYTES)
+        self.scan_size = AdaptiveSize(SCAN_SIZE, *SCAN_SIZE_RANGE, TARGET_LATENCY, TARGET_BYTES)
+        # Only the configured metadata is read from jobSummary documents
+        self.jobsummary_source = ["uuid"]
+        for field in config["metadata"]:
+            self.jobsummary_source += [field, f"jobConfig.{field}"]
+        # Metric fields dropped by the normalization are never transferred
+        self.metrics_source_excludes = [field for field in DROP_LIST if field not in REQUIRED_FIELDS]
         logging.getLogger("opensearch").setLevel(logging.WARNING)
 
-    def collect(self, from_date: datetime, to: datetime):
-        """Collects data from the elastic search using search_after"""
-        start_time = time.time()
-        data = []
+    def _jobsummary_query(self, from_date: datetime, to: datetime, include_end: bool = True) -> Q:
+        """Builds the query matching the jobSummary documents of the benchmark within a time range"""
         from_timestamp = from_date.strftime("%Y-%m-%dT%H:%M:%SZ")
         to_timestamp = to.strftime("%Y-%m-%dT%H:%M:%SZ")
-
-        logger.info(f"Elasticsearch index: {self.es_index}, benchmark: {self.config['benchmark']}")
-        
-        query = Q(
+        return Q(
             "bool",
             must_not=[Q("term", **{"jobConfig.name.keyword": "garbage-collection"})],
             must=[
                 Q("term", **{"jobConfig.name.keyword": self.config["benchmark"]}),
-                Q("range", **{"timestamp": {"gte": from_timestamp, "lte": to_timestamp}}),
+                Q("range", **{"timestamp": {"gte": from_timestamp, "lte" if include_end else "lt": to_timestamp}}),
             ],
         )
 
+    def histogram(self, from_date: datetime, to: datetime, interval: int) -> list:
+        """Counts the jobSummary documents of a time range in buckets of interval seconds
+
+        Returns the (bucket start, count) pairs of the non empty buckets, in time order.
+        """
+        s = (
+            Search(using=self.os_client, index=self.es_index)
+            .filter("term", **{"metricName.keyword": "jobSummary"})
+            .query(self._jobsummary_query(from_date, to))
+            .extra(size=0)
+        )
+        s.aggs.bucket("runs", "date_histogram", field="timestamp", fixed_interval=f"{interval}s", min_doc_count=1)
+        logger.info(f"Running histogram query: {s.to_dict()}")
+        buckets = retry(self.os_client.search, index=self.es_index, body=s.to_dict())["aggregations"]["runs"]["buckets"]
+        return [(datetime.utcfromtimestamp(bucket["key"] / 1000), bucket["doc_count"]) for bucket in buckets]
+
+    def collect(
+        self,
+        from_date: datetime,
+        to: datetime,
+        search_after: list = None,
+        skip_uuids: set = frozenset(),
+        include_end: bool = True,
+    ):
+        """Collects data from the elastic search using search_after, yielding one run at a time
+
+        search_after and skip_uuids allow resuming a previous collection from its checkpoint.
+        include_end=False excludes the runs at the end of the range, so adjacent ranges never share a run.
+        """
+        start_time = time.time()
+
+        logger.info(f"Elasticsearch index: {self.es_index}, benchmark: {self.config['benchmark']}")
+
+        query = self._jobsummary_query(from_date, to, include_end)
+
         logger.debug(f"Constructed Elasticsearch query: {query.to_dict()}")
 
-        page_size = 100
-        sort_field = "timestamp"
-        search_after = None
-        total_hits = 0
+        # uuid breaks timestamp ties, so runs sharing a timestamp are neither skipped nor repeated across pages
+        sort_fields = ["timestamp", "uuid.keyword"]
+        search_after = self._resume_key(search_after)
+        pit_id = None
+        if self.pit:
+            params = {"keep_alive": f"{self.pit_keep_alive}s"}
+            pit_id = retry(self.os_client.create_pit, index=self.es_index, params=params)["pit_id"]
+
+        try:
+            yield from self._jobsummary_pages(query, sort_fields, search_after, skip_uuids, pit_id)
+        finally:
+            if pit_id:
+                self._delete_pit(pit_id)
+
+        elapsed = time.time() - start_time
+        logger.info(f"Data collection completed in {elapsed:.2f} seconds.")
+
+    def _delete_pit(self, pit_id: str) -> None:
+        """Releases a point in time, failing to do so only delays its expiration"""
+        try:
+            self.os_client.delete_pit(body={"pit_id": [pit_id]})
+        except Exception as e:
+            logger.warning(f"Failed to delete point in time: {e}")
+
+    def _jobsummary_pages(self, query: Q, sort_fields: list, search_after: list, skip_uuids: set, pit_id: str):
+        """Pages through the jobSummary documents, yielding the runs with verified metrics
 
+        With a point in time every page is read from the same snapshot of the index. Each request
+        keeps it alive until the next one, for PIT_KEEP_ALIVE_FACTOR times the longest time a page
+        took to be consumed, pit_keep_alive at least. An expired point in time, like any error left
+        after the retries, fails the collection instead of truncating it.
+        """
+        total_hits = 0
+        keep_alive = self.pit_keep_alive
+        page_start = None
         while True:
+            if page_start is not None:
+                # The metrics of the page were fetched and its runs consumed since the previous request
+                keep_alive = max(keep_alive, math.ceil(PIT_KEEP_ALIVE_FACTOR * (time.monotonic() - page_start)))
+            page_start = time.monotonic()
             s = (
-                Search(using=self.os_client, index=self.es_index)
+                Search(using=self.os_client, index=None if pit_id else self.es_index)
                 .filter("term", **{"metricName.keyword": "jobSummary"})
                 .query(query)
-                .sort({sort_field: "asc"})
-                .extra(size=page_size)
+                .sort(*[{field: "asc"} for field in sort_fields])
+                .source(includes=self.jobsummary_source)
+                .extra(size=self.page_size.value)
             )
 
+            if pit_id:
+                s = s.extra(pit={"id": pit_id, "keep_alive": f"{keep_alive}s"})
+
             if search_after:
                 s = s.extra(search_after=search_after)
 
             try:
-                response = s.execute()
-                hits = response.hits
+                request_start = time.perf_counter()
+                with recorder.span("jobsummary_page"):
+                    response = retry(self.os_client.search, index=None if pit_id else self.es_index, body=s.to_dict())
+                hits = response["hits"]["hits"]
 
                 if not hits:
                     break
+                self.page_size.update(
+                    time.perf_counter() - request_start, len(json.dumps(hits[0].get("_source", {}))) * len(hits)
+                )
 
+                page = []
                 for hit in hits:
-                    run_data = {}
-                    jobSummary = hit.to_dict()
+                    jobSummary = hit.get("_source", {})
                     uuid = jobSummary.get("uuid")
 
                     if not uuid:
                         logger.warning("Missing UUID in jobSummary, skipping entry.")
                         continue
 
-                    logger.debug(f"Processing UUID: {uuid}")
-
-                    if uuid not in run_data:
-                        logger.debug("UUID not present in run data, adding it")
-                        run_data[uuid] = {"metadata": {}, "metrics": {}}
+                    if uuid in skip_uuids:
+                        logger.debug(f"UUID {uuid} already exported, skipping.")
+                        continue
 
-                    for field in self.config["metadata"]:
-                        if field in jobSummary:
-                            run_data[uuid]["metadata"][field] = jobSummary[field]
-                        elif "jobConfig" in jobSummary and field in jobSummary["jobConfig"]:
-                            run_data[uuid]["metadata"].setdefault("jobConfig", {})[field] = jobSummary["jobConfig"][field]
+                    logger.debug(f"Processing UUID: {uuid}")
+                    page.append((uuid, self._metadata(jobSummary), hit["sort"]))
 
-                    metrics, count_verified = self._metrics_by_uuid(uuid)
-                    if count_verified:
-                        run_data[uuid]["metrics"] = metrics
-                    else:
-                        logger.debug(f"No verified metrics for UUID {uuid}, skipping.")
-                        continue
+                for batch in split_list_into_chunks(page, self.metrics_batch):
+                    page_metrics = self._page_metrics([uuid for uuid, _, _ in batch])
+                    for uuid, metadata, sort in batch:
+                        metrics, count_verified = page_metrics.pop(uuid)
+                        if not count_verified:
+                            logger.debug(f"No verified metrics for UUID {uuid}, skipping.")
+                            continue
 
-                    data.append(run_data)
-                    total_hits += 1
+                        total_hits += 1
+                        yield {uuid: {"metadata": metadata, "metrics": metrics, "sort": sort}}
 
                 # Prepare for next page
-                search_after = hits[-1].meta.sort
+                search_after = hits[-1]["sort"]
+                # The point in time id may change between requests
+                pit_id = response.get("pit_id") or pit_id
 
             except Exception as e:
-                logger.warning(f"Search failed: {e}, continuing with partial results.")
-                break
+                if pit_id and is_context_missing(e):
+                    logger.error(
+                        f"Point in time expired: {e}, a page took longer to be consumed than its {keep_alive}s keep alive, "
+                        f"increase --pit-keep-alive"
+                    )
+                else:
+                    # Requests were already retried, going on would silently truncate the export
+                    logger.error(f"Collection failed: {e}")
+                raise
 
-        elapsed = time.time() - start_time
-        logger.info(f"Data collection completed in {elapsed:.2f} seconds. Retrieved {total_hits} documents.")
-        return data
+        logger.info(f"Retrieved {total_hits} documents.")
+
+    def _page_metrics(self, uuids: list) -> dict:
+        """Fetches the metrics of every uuid in a jobSummary page, reading the local cache first"""
+        if not self.cache:
+            return self._fetch_metrics(uuids)
+        # Aggregated metrics hold different datapoints than raw ones, so they're part of the cache key,
+        # which also tells apart the entries cached before aggregated datapoints carried their reduction
+        input_list = [
+            f"{metric}:{AGGREGATION}={self.aggregate_metrics[metric]}" if metric in self.aggregate_metrics else metric
+            for metric in self.metrics
+        ]
+        page_metrics = {}
+        for uuid in uuids:
+            metrics = self.cache.get(self.es_index, uuid, input_list)
+            if metrics is not None:
+                metrics = {name: MetricSeries.from_documents(name, datapoints) for name, datapoints in metrics.items()}
+                page_metrics[uuid] = (metrics, True)
+        missing = [uuid for uuid in uuids if uuid not in page_metrics]
+        for uuid, (metrics, count_verified) in self._fetch_metrics(missing).items():
+            # Only complete runs are cached, as the metrics of a partial one may still be indexed
+            if count_verified:
+                self.cache.put(self.es_index, uuid, input_list, {name: list(series) for name, series in metrics.items()})
+            page_metrics[uuid] = (metrics, count_verified)
+        return page_metrics
+
+    def _fetch_metrics(self, uuids: list) -> dict:
+        """Fetches the metrics of the given uuids from OpenSearch, using up to concurrency parallel queries"""
+        if not uuids:
+            return {}
+        if self.batch_metrics:
+            # Split the page in one batch per worker
+            batch_size = math.ceil(len(uuids) / self.concurrency)
+            batches = list(split_list_into_chunks(uuids, batch_size))
+        else:
+            batches = [[uuid] for uuid in uuids]
+        # map() returns the results in submission order, so runs keep the jobSummary order
+        mapper = self.executor.map if self.executor else map
+        page_metrics = {}
+        for batch_metrics in mapper(self._batch_metrics, batches):
+            page_metrics.update(batch_metrics)
+        return page_metrics
+
+    def _batch_metrics(self, uuids: list) -> dict:
+        """Fetches the metrics of a batch of uuids and verifies every configured metric is present"""
+        # Scans are restarted from scratch on failure, so they never return partial metrics
+        metrics = retry(self._metrics_by_uuids, uuids)
+        if self.aggregate_metrics:
+            raw = {}
+            for uuid, aggregated in retry(self._aggregated_metrics_by_uuids, uuids).items():
+                for metric_name, series in aggregated.items():
+                    if len(series):
+                        metrics[uuid][metric_name] = series
+                    else:
+                        # Quantile metrics have no value to reduce, they keep their raw datapoints
+                        raw.setdefault(uuid, set()).add(metric_name)
+            if raw:
+                metric_names = sorted(set().union(*raw.values()))
+                for uuid, raw_metrics in retry(self._metrics_by_uuids, list(raw), metric_names).items():
+                    metrics[uuid].update({name: series for name, series in raw_metrics.items() if name in raw[uuid]})
+        expected = len(self.metrics)
+        return {uuid: (run_metrics, len(run_metrics) == expected) for uuid, run_metrics in metrics.items()}
+
+    def _uuid_filter(self, uuids: list) -> Q:
+        """Builds the filter matching the documents of the given uuids"""
+        if len(uuids) == 1:
+            return Q("term", **{"uuid.keyword": uuids[0]})
+        return Q("terms", **{"uuid.keyword": list(uuids)})
 
-    def _metrics_by_uuid(self, uuid: str):
-        """Collects the list of metrics for an uuid"""
-        metrics = {}
-        input_list = self.config.get("metrics", {})
+    def _metrics_by_uuids(self, uuids: list, metric_names: list = None) -> dict:
+        """Collects the raw datapoints of one or several uuids with a single scan and demultiplexes them by uuid"""
+        metrics = {uuid: {} for uuid in uuids}
+        input_list = metric_names or [metric for metric in self.metrics if metric not in self.aggregate_metrics]
+        if not input_list:
+            return metrics
         metric_filter = [Q("term", **{"metricName.keyword": metric}) for metric in input_list]
         should_query = Q("bool", should=metric_filter)
         query = Q("bool", must_not=[Q("term", **{"jobConfig.name.keyword": "garbage-collection"})], should=should_query)
-        s = Search(using=self.os_client, index=self.es_index).filter("term", **{"uuid.keyword": uuid}).query(query)
-        logger.info(f"Running query: {s.to_dict()}")
-        for hit in s.scan():
-            datapoint = hit.to_dict()
-            if datapoint["metricName"] not in metrics:
-                metrics[datapoint["metricName"]] = [datapoint]
-            else:
-                metrics[datapoint["metricName"]].append(datapoint)
-        return metrics, len(metrics) == len(input_list)
+        scan_size = self.scan_size.value
+        body = (
+            Search()
+            .filter(self._uuid_filter(uuids))
+            .query(query)
+            .source(excludes=self.metrics_source_excludes)
+            .to_dict()
+        )
+        logger.info(f"Running query for {len(metrics)} UUIDs: {body}")
+        scan_start = time.perf_counter()
+        if self.slice_executor:
+            # Sliced scrolls are consumed in parallel and concatenated in slice order
+            sliced = [dict(body, slice={"id": slice_id, "max": self.slices}) for slice_id in range(self.slices)]
+            parts = list(self.slice_executor.map(self._scan, sliced, [uuids] * self.slices, [scan_size] * self.slices))
+        else:
+            parts = [self._scan(body, uuids, scan_size)]
+        documents, document_bytes = 0, 0
+        uuid_documents = {uuid: 0 for uuid in uuids}
+        uuid_bytes = {uuid: 0 for uuid in uuids}
+        for part_metrics, part_stats in parts:
+            for uuid, run_metrics in part_metrics.items():
+                for metric_name, series in run_metrics.items():
+                    if metric_name in metrics[uuid]:
+                        metrics[uuid][metric_name].extend(series)
+                    else:
+                        metrics[uuid][metric_name] = series
+            documents += part_stats["documents"]
+            document_bytes = document_bytes or part_stats["document_bytes"]
+            for uuid in uuids:
+                uuid_documents[uuid] += part_stats["uuid_documents"].get(uuid, 0)
+                uuid_bytes[uuid] += part_stats["uuid_bytes"].get(uuid, 0)
+        if documents:
+            # Scroll pages aren't visible from scan(), tune the size with the average page of a slice
+            requests = -(-documents // (scan_size * self.slices))
+            latency = (time.perf_counter() - scan_start) / requests
+            self.scan_size.update(latency, document_bytes * min(documents, scan_size))
+        if recorder.enabled:
+            for uuid in uuids:
+                recorder.observe("uuid_documents", uuid_documents[uuid], SIZE_BUCKETS)
+                recorder.observe("uuid_bytes", uuid_bytes[uuid], SIZE_BUCKETS)
+                recorder.incr("documents_fetched", uuid_documents[uuid])
+        return metrics
+
+    def _scan(self, body: dict, uuids: list, size: int) -> Tuple[dict, dict]:
+        """Scrolls through every document matched by a search body, or by one of its slices
+
+        Documents are the raw _source dicts decoded by the client, they're appended to the compact
+        series of their uuid and metric as they arrive, so a run is never held as documents.
+        Returns the series of every uuid and the scroll statistics, where the bytes of a uuid are
+        estimated from the size of its first document.
+        """
+        metrics = {uuid: {} for uuid in uuids}
+        stats = {"documents": 0, "document_bytes": 0, "uuid_documents": {}, "uuid_bytes": {}}
+        with recorder.span("metrics_scan"):
+            for hit in helpers.scan(self.os_client, query=body, index=self.es_index, size=size):
+                datapoint = hit.get("_source", {})
+                if not stats["documents"]:
+                    stats["document_bytes"] = len(json.dumps(datapoint))
+                stats["documents"] += 1
+                uuid = datapoint.get("uuid")
+                run_metrics = metrics.get(uuid)
+                if run_metrics is None:
+                    continue
+                if recorder.enabled:
+                    if uuid not in stats["uuid_documents"]:
+                        # Only the first document of a uuid is serialized, its size stands for the others
+                        stats["uuid_bytes"][uuid] = len(json.dumps(datapoint))
+                    stats["uuid_documents"][uuid] = stats["uuid_documents"].get(uuid, 0) + 1
+                metric_name = datapoint["metricName"]
+                series = run_metrics.get(metric_name)
+                if series is None:
+                    series = run_metrics[metric_name] = MetricSeries(metric_name)
+                series.append(datapoint)
+        for uuid, count in stats["uuid_documents"].items():
+            stats["uuid_bytes"][uuid] *= count
+        return metrics, stats
+
+    def _aggregated_metrics_by_uuids(self, uuids: list) -> dict:
+        """Collects the metrics declared in aggregate_metrics as one datapoint per label combination"""
+        metrics = {uuid: {} for uuid in uuids}
+        # Churn and garbage collection datapoints are filtered out server side, as process_json would do
+        query = Q(
+            "bool",
+            filter=[
+                self._uuid_filter(uuids),
+                Q("terms", **{"metricName.keyword": list(self.aggregate_metrics)}),
+            ],
+            must_not=[
+                # A null churnMetric isn't indexed, it's the only noise is_noise skips and this query keeps
+                Q("exists", field="churnMetric"),
+                # jobName is compared case insensitively, as is_noise does
+                Q("term", **{"jobName.keyword": {"value": "garbage-collection", "case_insensitive": True}}),
+                Q("term", **{"jobConfig.name.keyword": "garbage-collection"}),
+            ],
+        )
+        # Only one bucket per LABELS_LIST label combination is transferred, none of them is folded with another one
+        sources = [{"uuid": {"terms": {"field": "uuid.keyword"}}}, {"metricName": {"terms": {"field": "metricName.keyword"}}}]
+        sources += [{label: {"terms": {"field": f"labels.{label}.keyword", "missing_bucket": True}}} for label in LABELS_LIST]
+        # Every metric can have its own reduction, each one is computed as a sub aggregation, along
+        # with the number of values telling apart the buckets without any
+        reductions = {function: {function: {"field": "value"}} for function in set(self.aggregate_metrics.values())}
+        reductions[VALUE_COUNT] = {"value_count": {"field": "value"}}
+        after_key = None
+        while True:
+            composite = {"sources": sources, "size": AGGREGATION_PAGE_SIZE}
+            if after_key:
+                composite["after"] = after_key
+            s = Search().query(query).extra(size=0)
+            s = s.update_from_dict({"aggs": {"series": {"composite": composite, "aggs": reductions}}})
+            logger.info(f"Running aggregation for {len(uuids)} UUIDs: {s.to_dict()}")
+            with recorder.span("metrics_aggregation"):
+                series = self.os_client.search(index=self.es_index, body=s.to_dict())["aggregations"]["series"]
+            for bucket in series["buckets"]:
+                key = bucket["key"]
+                run_metrics = metrics.get(key["uuid"])
+                if run_metrics is None:
+                    continue
+                metric_name = key["metricName"]
+                function = self.aggregate_metrics[metric_name]
+                if metric_name not in run_metrics:
+                    run_metrics[metric_name] = MetricSeries(metric_name, function)
+                # Buckets without any value are left out, a metric without any, such as a quantile metric,
+                # gets an empty series
+                if not bucket[VALUE_COUNT]["value"]:
+                    continue
+                # Datapoints carry their reduction, the normalization exports it as is instead of halving it
+                value = bucket[function]["value"]
+                datapoint = {"uuid": key["uuid"], "metricName": metric_name, "value": value, AGGREGATION: function}
+                labels = {label: key[label] for label in LABELS_LIST if key.get(label) is not None}
+                if labels:
+                    datapoint["labels"] = labels
+                run_metrics[metric_name].append(datapoint)
+            after_key = series.get("after_key")
+            if not series["buckets"] or not after_key:
+                break
+        return metrics
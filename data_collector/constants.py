@@ -1,3 +1,32 @@
 S3_BUCKET = "kube-burner-ai-s3-bucket"
 CHUNK_SIZE = 10000
-VALID_LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
\ No newline at end of file
+VALID_LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+NORMALIZE_BATCH_SIZE = 16
+S3_PART_SIZE = 8 * 1024 * 1024
+AGGREGATION_PAGE_SIZE = 1000
+# jobSummary page and metrics scroll sizes adapt to the response latency and payload
+PAGE_SIZE = 100
+PAGE_SIZE_RANGE = (10, 1000)
+SCAN_SIZE = 1000
+SCAN_SIZE_RANGE = (250, 10000)
+TARGET_LATENCY = 2.0
+TARGET_BYTES = 16 * 1024 * 1024
+RETRY_ATTEMPTS = 5
+RETRY_BACKOFF = 1.0
+RETRY_STATUSES = (429, 502, 503, 504)
+# Seconds a point in time is kept alive between two jobSummary pages, grown to PIT_KEEP_ALIVE_FACTOR
+# times the longest time a page took to be consumed
+PIT_KEEP_ALIVE = 300
+PIT_KEEP_ALIVE_FACTOR = 2
+SHARD_HISTOGRAM_BUCKETS = 100
+LABEL_CACHE_SIZE = 65536
+MATCHER_CACHE_SIZE = 4096
+# Text read at once from the files of the local source, grown as needed for larger documents
+LOCAL_READ_SIZE = 1024 * 1024
+# Watch mode: polling period, how far back late indexed runs are looked for, flush period of partial chunks,
+# and how many missed polls make the daemon unhealthy, in seconds and polls
+WATCH_INTERVAL = 30
+WATCH_LOOKBACK = 3600
+WATCH_FLUSH_SECONDS = 60
+WATCH_STALE_POLLS = 3
+HEALTH_PORT = 8080
@@ -0,0 +1,93 @@
+"""Fetch helpers: adaptive request sizes, retries with backoff and the response serializer."""
+
+import time
+import random
+import logging
+from typing import Callable
+from opensearchpy.exceptions import ConnectionError, ConnectionTimeout, SerializationError, TransportError
+from opensearchpy.serializer import JSONSerializer
+from data_collector.constants import RETRY_ATTEMPTS, RETRY_BACKOFF, RETRY_STATUSES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveSize:
+    """Request size tuned by the observed response latency and payload
+
+    The size doubles while responses are fast and light, and halves as soon as they
+    get slower than target_latency or heavier than target_bytes.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, target_latency: float, target_bytes: int):
+        """Init method for instance variables"""
+        self.value = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.target_bytes = target_bytes
+
+    def update(self, latency: float, payload_bytes: int) -> None:
+        """Adjusts the size after a response of the current size"""
+        if latency > self.target_latency or payload_bytes > self.target_bytes:
+            size = max(self.minimum, self.value // 2)
+        elif latency < self.target_latency / 2 and payload_bytes < self.target_bytes / 2:
+            size = min(self.maximum, self.value * 2)
+        else:
+            return
+        if size != self.value:
+            logger.debug(f"Adapting request size from {self.value} to {size}, latency={latency:.2f}s bytes={payload_bytes}")
+            self.value = size
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Connection errors, timeouts and overloaded cluster responses are worth retrying"""
+    if isinstance(exc, (ConnectionError, ConnectionTimeout)):
+        return True
+    return isinstance(exc, TransportError) and exc.status_code in RETRY_STATUSES
+
+
+def is_context_missing(exc: Exception) -> bool:
+    """Searches on an expired or released point in time fail with a missing search context"""
+    return isinstance(exc, TransportError) and (exc.status_code == 404 or "search_context_missing" in str(exc))
+
+
+def retry(func: Callable, *args, attempts: int = RETRY_ATTEMPTS, backoff: float = RETRY_BACKOFF, **kwargs):
+    """Calls func, retrying retryable errors with exponential backoff and jitter"""
+    for attempt in range(1, attempts + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts or not is_retryable(e):
+                raise
+            delay = backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            logger.warning(f"Request failed: {e}, retrying in {delay:.1f}s ({attempt}/{attempts})")
+            time.sleep(delay)
+
+
+class OrjsonSerializer(JSONSerializer):
+    """JSON serializer of the OpenSearch client backed by orjson, several times faster than json"""
+
+    def loads(self, s):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError as e:
+            raise SerializationError(s, e)
+
+    def dumps(self, data):
+        # don't serialize strings
+        if isinstance(data, str):
+            return data
+        try:
+            return orjson.dumps(data, default=self.default)
+        except TypeError as e:
+            raise SerializationError(data, e)
+
+
+def get_serializer() -> JSONSerializer:
+    """Returns the orjson serializer when orjson is installed, the standard one otherwise"""
+    return OrjsonSerializer() if orjson is not None else JSONSerializer()
@@ -0,0 +1,148 @@
+"""Single pass normalization engine.
+
+Produces the same columns and values as normalize.normalize, but folds every label set straight
+into its flattened column instead of building, copying and walking the intermediate nested json.
+"""
+
+import logging
+from functools import lru_cache
+from typing import Dict, List, Tuple
+from data_collector.constants import LABEL_CACHE_SIZE
+from data_collector.normalize import (
+    DEFAULT_HASH,
+    NEST_ORDER,
+    MetricSeries,
+    add_metadata,
+    datapoint_value,
+    is_noise,
+    label_identity,
+    normalize_metrics,
+    process_json,
+)
+from data_collector.utils import (
+    should_exclude,
+    compile_exclude_patterns,
+    recursively_flatten_values,
+    flatten_json,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(metrics_data: dict, exclude_metrics: str):
+    """Driver code to triger the execution"""
+    skip_patterns = compile_exclude_patterns(exclude_metrics)
+
+    # Metrics sharing a metricName are merged, in order of appearance, as process_json does
+    sources = {}
+    for metric, entries in metrics_data["metrics"].items():
+        if not entries:
+            continue
+        metric_name = entries[0].get("metricName")
+        if not metric_name:
+            logger.info(f"Warning: 'metricName' missing in first entry of the metric: {metric}")
+            continue
+        if should_exclude(metric_name, skip_patterns):
+            continue
+        sources.setdefault(metric_name, []).append((metric, entries))
+
+    flattened = {}
+    for metric_name, metric_sources in sources.items():
+        if not flatten_metric(metric_name, metric_sources, flattened):
+            # Metrics without value, such as quantiles, and label values that can't be told apart
+            # once flattened go through the reference normalization
+            output = {"metrics": {}}
+            for metric, entries in metric_sources:
+                process_json(metric, entries, skip_patterns, output)
+            flatten_json(flattened, recursively_flatten_values(normalize_metrics(output["metrics"].items())))
+    return add_metadata(flattened, metrics_data)
+
+
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def nest_path(relevant_labels: tuple) -> Tuple[tuple, str]:
+    """Returns the NEST_ORDER path of a label set and the suffix of its column
+
+    Returns None for label values the nested json doesn't flatten to their own column.
+    """
+    labels = dict(relevant_labels)
+    path = tuple((key, labels[key]) for key in NEST_ORDER if key in labels)
+    if any(not isinstance(value, str) or value == "_value" for _, value in path):
+        return None
+    return path, "".join(f"_byLabel{key.capitalize()}_{value}" for key, value in path)
+
+
+def flatten_metric(metric_name: str, sources: List[Tuple[str, List[Dict]]], flattened: Dict) -> bool:
+    """Folds the datapoints of a metric into its flattened columns
+
+    Datapoints are halved and summed per label set, as process_json does, and the label sets sharing
+    a NEST_ORDER path are folded with the running (a + b) / 2 average of normalize_metrics, in the
+    same order. Returns False, leaving flattened untouched, when the metric needs the reference
+    normalization.
+    """
+    paths = {}
+    suffixes = {}
+    for _, entries in sources:
+        groups = series_groups(entries) if isinstance(entries, MetricSeries) else entry_groups(entries)
+        if groups is None:
+            return False
+        for relevant_labels, value in groups:
+            try:
+                nested = nest_path(relevant_labels)
+            except TypeError:
+                # Unhashable label values
+                return False
+            if nested is None:
+                return False
+            path, suffix = nested
+            if path in paths:
+                paths[path] = (paths[path] + value) / 2
+            else:
+                paths[path] = value
+                suffixes[path] = suffix
+
+    # A node holding both a value and nested labels is flattened as <node>__value
+    parents = {path[:depth] for path in paths for depth in range(len(path))}
+    columns = {}
+    for path, value in paths.items():
+        name = metric_name + suffixes[path]
+        columns[f"{name}__value" if path in parents else name] = value
+    if len(columns) != len(paths):
+        # Distinct label values ending up in the same column
+        return False
+    flattened.update(columns)
+    return True
+
+
+def entry_groups(entries: List[Dict]) -> List[Tuple[tuple, float]]:
+    """Sums the halved values of datapoint documents per label set, in order of appearance
+
+    Aggregated values aren't halved. Returns None when a datapoint has no value.
+    """
+    groups = {}
+    for entry in entries:
+        if is_noise(entry):
+            continue
+        if "value" not in entry:
+            return None
+        labels = entry.get("labels")
+        label_hash, relevant_labels = label_identity(labels) if labels else (DEFAULT_HASH, ())
+        group = groups.get(label_hash)
+        if group is None:
+            group = groups[label_hash] = [relevant_labels, 0.0]
+        group[1] += datapoint_value(entry)
+    return [tuple(group) for group in groups.values()]
+
+
+def series_groups(series: MetricSeries) -> List[Tuple[tuple, float]]:
+    """Sums the halved values of a series per label set, its codes already are in order of appearance
+
+    Aggregated values aren't halved. Returns None when a datapoint has no value.
+    """
+    if series.field_sets:
+        return None
+    sums = [0.0] * len(series.label_sets)
+    # Aggregated values are exported as is
+    share = 1.0 if series.reduction else 0.5
+    for code, value in zip(series.codes, series.values):
+        sums[code] += value * share
+    return [(relevant_labels, sums[code]) for code, (_, relevant_labels, _) in enumerate(series.label_sets)]
@@ -0,0 +1,174 @@
+"""Per-stage timings, request histograms and counters of a collection."""
+
+import json
+import time
+import bisect
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, List
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+SIZE_BUCKETS = [10 ** exponent for exponent in range(10)]
+METRIC_PREFIX = "data_collector"
+
+
+class Histogram:
+    def __init__(self, buckets: List[float]):
+        """Init method for instance variables"""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        """Adds a value to its bucket"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "buckets": dict(zip([str(bucket) for bucket in self.buckets] + ["+Inf"], self.counts)),
+        }
+
+
+class Recorder:
+    """Thread safe store of the stage spans, histograms and counters
+
+    Recording is disabled by default, so instrumented code paths only pay for a flag check.
+    """
+
+    def __init__(self):
+        """Init method for instance variables"""
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.spans: Dict[str, Dict] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, stage: str):
+        """Times a stage, nested and concurrent spans are accounted separately"""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(stage, time.perf_counter() - start)
+
+    def add_span(self, stage: str, seconds: float) -> None:
+        """Accounts an already measured stage execution, its latency goes to the <stage>_seconds histogram"""
+        if not self.enabled:
+            return
+        with self.lock:
+            span = self.spans.setdefault(stage, {"count": 0, "seconds": 0.0})
+            span["count"] += 1
+            span["seconds"] += seconds
+            self.histograms.setdefault(f"{stage}_seconds", Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    def observe(self, name: str, value: float, buckets: List[float] = LATENCY_BUCKETS) -> None:
+        """Adds a value to a histogram, buckets are fixed by the first observation"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.histograms.setdefault(name, Histogram(buckets)).observe(value)
+
+    def incr(self, name: str, value: float = 1) -> None:
+        """Increments a counter"""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self) -> Dict:
+        """Returns every recorded value"""
+        with self.lock:
+            return {
+                "elapsed": time.time() - self.started,
+                "spans": {stage: dict(span) for stage, span in self.spans.items()},
+                "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+                "counters": dict(self.counters),
+            }
+
+    def prometheus(self) -> str:
+        """Returns every recorded value in the Prometheus text exposition format"""
+        report = self.report()
+        lines = [
+            f"# TYPE {METRIC_PREFIX}_elapsed_seconds gauge",
+            f"{METRIC_PREFIX}_elapsed_seconds {report['elapsed']}",
+            f"# TYPE {METRIC_PREFIX}_stage_seconds_total counter",
+        ]
+        lines += [f'{METRIC_PREFIX}_stage_seconds_total{{stage="{stage}"}} {span["seconds"]}' for stage, span in report["spans"].items()]
+        lines.append(f"# TYPE {METRIC_PREFIX}_stage_executions_total counter")
+        lines += [f'{METRIC_PREFIX}_stage_executions_total{{stage="{stage}"}} {span["count"]}' for stage, span in report["spans"].items()]
+        for name, histogram in report["histograms"].items():
+            metric = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bucket, count in histogram["buckets"].items():
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bucket}"}} {cumulative}')
+            lines.append(f"{metric}_sum {histogram['sum']}")
+            lines.append(f"{metric}_count {histogram['count']}")
+        for name, value in report["counters"].items():
+            lines.append(f"# TYPE {METRIC_PREFIX}_{name}_total counter")
+            lines.append(f"{METRIC_PREFIX}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Writes the report, as a Prometheus textfile for .prom paths and as JSON otherwise"""
+        with open(path, "w") as f:
+            if path.endswith(".prom"):
+                f.write(self.prometheus())
+            else:
+                json.dump(self.report(), f, indent=2)
+        logger.info(f"Instrumentation report written to {path}")
+
+
+recorder = Recorder()
+
+
+@contextmanager
+def profile(path: str):
+    """Profiles the enclosed code, with pyinstrument for .html paths and cProfile otherwise"""
+    if path.endswith(".html"):
+        if pyinstrument is None:
+            raise ImportError("HTML profiles require pyinstrument, install it with: pip install data_collector[profile]")
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path, "w") as f:
+                f.write(profiler.output_html())
+            logger.info(f"Profile written to {path}")
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        logger.info(f"Profile written to {path}, inspect it with: python -m pstats {path}")
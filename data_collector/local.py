@@ -0,0 +1,412 @@
+"""Offline collection source reading kube-burner local indexer files and _search NDJSON exports."""
+
+import io
+import os
+import bisect
+import re
+import gzip
+import json
+import mmap
+import time
+import calendar
+import logging
+import tempfile
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, TextIO, Tuple
+from data_collector.constants import LOCAL_READ_SIZE
+from data_collector.instrumentation import SIZE_BUCKETS, recorder
+from data_collector.normalize import AGGREGATION, LABELS_LIST, MetricSeries, is_noise
+from data_collector.source import Source
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Extensions of the files holding one document per line, .json files hold any sequence of JSON values and arrays
+NDJSON_EXTENSIONS = (".ndjson", ".jsonl")
+JSON_EXTENSIONS = (".json",) + NDJSON_EXTENSIONS
+COMPRESSIONS = (".gz", ".zst")
+# Whitespace, and the brackets and commas of JSON arrays, between the documents of a file
+SEPARATORS = re.compile(r"[\s,\[\]]*")
+# Fractional seconds beyond microseconds, which datetime doesn't parse
+SUBMICROSECONDS = re.compile(r"(\.\d{6})\d+")
+# Spooled documents all live in the first file
+SPOOL = 0
+
+
+def _loads(data):
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def _dumps(obj) -> bytes:
+    return orjson.dumps(obj) if orjson is not None else json.dumps(obj, separators=(",", ":")).encode()
+
+
+def split_extension(path: str) -> Tuple[str, str]:
+    """Returns the format and the compression extensions of a file name"""
+    base, extension = os.path.splitext(path.lower())
+    if extension in COMPRESSIONS:
+        return os.path.splitext(base)[1], extension
+    return extension, ""
+
+
+def list_files(paths: List[str]) -> List[str]:
+    """Lists the JSON and NDJSON files of the given files and directories, walking directories in name order"""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, directories, names in os.walk(path):
+            directories.sort()
+            files.extend(os.path.join(root, name) for name in sorted(names) if split_extension(name)[0] in JSON_EXTENSIONS)
+    return files
+
+
+def open_text(path: str) -> TextIO:
+    """Opens a file as text, gzip and zstd files are decompressed as they're read"""
+    _, compression = split_extension(path)
+    if compression == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8")
+    if compression == ".zst":
+        if zstandard is None:
+            raise ImportError("Reading zstd compressed files requires zstandard, install it with: pip install data_collector[zstd]")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True), encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def iter_values(text: TextIO, read_size: int = LOCAL_READ_SIZE) -> Iterator:
+    """Parses the top level JSON values of a text stream one at a time
+
+    Arrays are flattened into their elements, so JSON arrays, concatenated values and NDJSON lines
+    are all read alike. Only the value being parsed and the read buffer are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position = "", 0
+    while True:
+        position = SEPARATORS.match(buffer, position).end()
+        if position == len(buffer):
+            buffer, position = text.read(read_size), 0
+            if not buffer:
+                return
+            continue
+        try:
+            value, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The value continues past the buffer, reads grow with it so large values aren't parsed over and over
+            chunk = text.read(max(read_size, len(buffer) - position))
+            if not chunk:
+                raise
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield value
+
+
+def documents(value) -> Iterator[Dict]:
+    """Yields the documents of a parsed value: a document, a search hit or a whole search response"""
+    if not isinstance(value, dict):
+        return
+    hits = value.get("hits")
+    if isinstance(hits, dict):
+        for hit in hits.get("hits", []):
+            yield from documents(hit)
+    elif "_source" in value:
+        yield value["_source"]
+    else:
+        yield value
+
+
+def epoch_millis(timestamp) -> Optional[int]:
+    """Converts a document timestamp, an RFC 3339 string or epoch milliseconds, to the epoch milliseconds OpenSearch sorts on
+
+    Timestamps without time zone are UTC. Returns None for anything else.
+    """
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        return int(timestamp)
+    if not isinstance(timestamp, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(SUBMICROSECONDS.sub(r"\1", timestamp.replace("Z", "+00:00")))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return calendar.timegm(parsed.utctimetuple()) * 1000 + parsed.microsecond // 1000
+
+
+def _job_name(doc: Dict):
+    job_config = doc.get("jobConfig")
+    return job_config.get("name") if isinstance(job_config, dict) else None
+
+
+class LocalSource(Source):
+    """Collects the runs of a benchmark from local files instead of OpenSearch
+
+    Files are kube-burner local indexer output, JSON arrays of documents, and _search exports, one
+    hit or response per line, optionally gzip or zstd compressed. A first pass parses every file as
+    a stream and indexes the runs of the benchmark and the location of the documents of every
+    uuid. Uncompressed NDJSON files are memory-mapped and indexed in place, the collected documents
+    of every other file are written compacted, one per line, to a memory-mapped spool file. Runs are
+    then read document by document from their locations, so no file is ever loaded whole.
+    """
+
+    def __init__(self, paths: List[str], config: dict, skip_excluded: bool = False, spool_dir: str = None):
+        """Init method for instance variables, spool_dir defaults to the system temporary directory"""
+        super().__init__(config, skip_excluded)
+        self.paths = paths
+        self.spool_dir = spool_dir
+        self.indexed = False
+        # Memory maps of the spool and of the uncompressed NDJSON files, by file id
+        self.files = [b""]
+        # (timestamp in epoch milliseconds, uuid, metadata) of every run of the benchmark, in collection order
+        self.runs = []
+        # File ids, offsets and lengths of the metric documents of every uuid, in file order
+        self.locations: Dict[str, Tuple[array, array, array]] = {}
+
+    def index(self) -> None:
+        """Reads every file once, recording the runs of the benchmark and the location of their metric documents"""
+        if self.indexed:
+            return
+        start_time = time.time()
+        files = list_files(self.paths)
+        uuids = set()
+        with tempfile.TemporaryFile(dir=self.spool_dir) as spool:
+            for path in files:
+                logger.debug(f"Indexing {path}")
+                with recorder.span("local_index"):
+                    format_extension, compression = split_extension(path)
+                    if format_extension in NDJSON_EXTENSIONS and not compression:
+                        self._index_ndjson(path, spool, uuids)
+                    else:
+                        with open_text(path) as text:
+                            for value in iter_values(text):
+                                for doc in documents(value):
+                                    self._index_document(doc, spool, uuids)
+            spool.flush()
+            if spool.tell():
+                # The mapping outlives the file, which is deleted on close
+                self.files[SPOOL] = mmap.mmap(spool.fileno(), 0, access=mmap.ACCESS_READ)
+        self.runs.sort(key=lambda run: run[:2])
+        self.indexed = True
+        documents_count = sum(len(offsets) for _, offsets, _ in self.locations.values())
+        logger.info(
+            f"Indexed {len(files)} files in {time.time() - start_time:.2f} seconds: {len(self.runs)} runs, "
+            f"{documents_count} metric documents, {len(self.files[SPOOL])} bytes spooled"
+        )
+
+    def _index_ndjson(self, path: str, spool, uuids: set) -> None:
+        """Indexes an uncompressed NDJSON file in place, documents are read back from its memory map"""
+        if not os.path.getsize(path):
+            return
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        file_id = len(self.files)
+        self.files.append(mapped)
+        while True:
+            offset = mapped.tell()
+            line = mapped.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            value = _loads(line)
+            if isinstance(value, dict) and not isinstance(value.get("hits"), dict):
+                for doc in documents(value):
+                    self._index_document(doc, spool, uuids, (file_id, offset, len(line)))
+                continue
+            # Arrays and whole responses hold several documents, they're spooled one by one
+            for element in value if isinstance(value, list) else [value]:
+                for doc in documents(element):
+                    self._index_document(doc, spool, uuids)
+
+    def _index_document(self, doc: Dict, spool, uuids: set, location: Tuple[int, int, int] = None) -> None:
+        """Records a jobSummary document, or the location of a collected metric document
+
+        Documents matching what the OpenSearch source would query are kept: runs of the benchmark,
+        and the configured metrics outside of garbage collection jobs. Metric documents without a
+        location of their own are spooled.
+        """
+        if not isinstance(doc, dict):
+            return
+        metric_name = doc.get("metricName")
+        if metric_name == "jobSummary":
+            self._index_run(doc, uuids)
+            return
+        uuid = doc.get("uuid")
+        if metric_name not in self.metrics or uuid is None or _job_name(doc) == "garbage-collection":
+            return
+        if location is None:
+            data = _dumps(doc) + b"\n"
+            location = (SPOOL, spool.tell(), len(data))
+            spool.write(data)
+        if uuid not in self.locations:
+            self.locations[uuid] = (array("I"), array("q"), array("I"))
+        for column, value in zip(self.locations[uuid], location):
+            column.append(value)
+
+    def _index_run(self, doc: Dict, uuids: set) -> None:
+        """Records the sort key and metadata of a jobSummary document of the benchmark"""
+        if _job_name(doc) != self.config["benchmark"]:
+            return
+        uuid = doc.get("uuid")
+        if not uuid:
+            logger.warning("Missing UUID in jobSummary, skipping entry.")
+            return
+        timestamp = epoch_millis(doc.get("timestamp"))
+        if timestamp is None:
+            logger.warning(f"Invalid timestamp {doc.get('timestamp')} in jobSummary of UUID {uuid}, skipping entry.")
+            return
+        if uuid in uuids:
+            logger.debug(f"Duplicated jobSummary of UUID {uuid}, skipping.")
+            return
+        uuids.add(uuid)
+        self.runs.append((timestamp, uuid, self._metadata(doc)))
+
+    def _runs(self, from_date: datetime, to: datetime, include_end: bool = True) -> Iterator[Tuple[int, str, Dict]]:
+        """Yields the runs of a time range, bounds have a one second precision as in the OpenSearch queries"""
+        from_ms = calendar.timegm(from_date.utctimetuple()) * 1000
+        to_ms = calendar.timegm(to.utctimetuple()) * 1000
+        for run in self.runs[bisect.bisect_left(self.runs, (from_ms,)):]:
+            if run[0] > to_ms or (run[0] == to_ms and not include_end):
+                break
+            yield run
+
+    def histogram(self, from_date: datetime, to: datetime, interval: int) -> List[Tuple[datetime, int]]:
+        """Counts the runs of a time range in buckets of interval seconds
+
+        Returns the (bucket start, count) pairs of the non empty buckets, in time order.
+        """
+        self.index()
+        counts = {}
+        for timestamp, _, _ in self._runs(from_date, to):
+            start = timestamp // (interval * 1000) * interval
+            counts[start] = counts.get(start, 0) + 1
+        return [(datetime.utcfromtimestamp(start), counts[start]) for start in sorted(counts)]
+
+    def collect(
+        self,
+        from_date: datetime,
+        to: datetime,
+        search_after: list = None,
+        skip_uuids: set = frozenset(),
+        include_end: bool = True,
+    ):
+        """Collects data from the local files, yielding one run at a time
+
+        Runs come in the order of the OpenSearch source and their sort key is the one OpenSearch
+        returns, epoch milliseconds and uuid, so checkpoints of either source can resume the other.
+        """
+        start_time = time.time()
+        self.index()
+        logger.info(f"Local files: {self.paths}, benchmark: {self.config['benchmark']}")
+        search_after = self._resume_key(search_after)
+        total_hits = 0
+        for timestamp, uuid, metadata in self._runs(from_date, to, include_end):
+            if search_after and [timestamp, uuid] <= list(search_after):
+                continue
+            if uuid in skip_uuids:
+                logger.debug(f"UUID {uuid} already exported, skipping.")
+                continue
+            logger.debug(f"Processing UUID: {uuid}")
+            with recorder.span("local_run"):
+                metrics = self._run_metrics(uuid)
+            if len(metrics) != len(self.metrics):
+                logger.debug(f"No verified metrics for UUID {uuid}, skipping.")
+                continue
+            total_hits += 1
+            yield {uuid: {"metadata": metadata, "metrics": metrics, "sort": [timestamp, uuid]}}
+        logger.info(f"Retrieved {total_hits} documents.")
+        logger.info(f"Data collection completed in {time.time() - start_time:.2f} seconds.")
+
+    def _run_metrics(self, uuid: str) -> Dict[str, MetricSeries]:
+        """Reads the metric documents of a run from their locations into series
+
+        Metrics declared in aggregate_metrics are reduced per label combination, as the composite
+        aggregation of the OpenSearch source does, metrics without any value keep their raw datapoints.
+        """
+        metrics = {}
+        groups = {}
+        file_ids, offsets, lengths = self.locations.get(uuid, ((), (), ()))
+        for file_id, offset, length in zip(file_ids, offsets, lengths):
+            datapoint = next(documents(_loads(self.files[file_id][offset:offset + length])))
+            metric_name = datapoint["metricName"]
+            if metric_name in self.aggregate_metrics:
+                self._group(datapoint, groups)
+                continue
+            if metric_name not in metrics:
+                metrics[metric_name] = MetricSeries(metric_name)
+            metrics[metric_name].append(datapoint)
+        # Quantile metrics have no value to reduce, they keep their raw datapoints
+        valued = {metric_name for (metric_name, _), values in groups.items() if values}
+        raw = {metric_name for metric_name, _ in groups if metric_name not in valued}
+        for (metric_name, key), values in sorted(groups.items(), key=_bucket_order):
+            if metric_name in raw:
+                continue
+            function = self.aggregate_metrics[metric_name]
+            if metric_name not in metrics:
+                metrics[metric_name] = MetricSeries(metric_name, function)
+            # Label combinations without any value are left out, as buckets without values are
+            if not values:
+                continue
+            datapoint = {"uuid": uuid, "metricName": metric_name, "value": _reduce(function, values), AGGREGATION: function}
+            labels = {label: label_value for label, label_value in zip(LABELS_LIST, key) if label_value is not None}
+            if labels:
+                datapoint["labels"] = labels
+            metrics[metric_name].append(datapoint)
+        if raw:
+            # Their datapoints are read again, as those of the other metrics
+            metrics.update({metric_name: MetricSeries(metric_name) for metric_name in raw})
+            for file_id, offset, length in zip(file_ids, offsets, lengths):
+                datapoint = next(documents(_loads(self.files[file_id][offset:offset + length])))
+                if datapoint["metricName"] in raw:
+                    metrics[datapoint["metricName"]].append(datapoint)
+        if recorder.enabled:
+            recorder.observe("uuid_documents", len(offsets), SIZE_BUCKETS)
+            recorder.observe("uuid_bytes", sum(lengths), SIZE_BUCKETS)
+            recorder.incr("documents_fetched", len(offsets))
+        return metrics
+
+    @staticmethod
+    def _group(datapoint: Dict, groups: Dict) -> None:
+        """Adds the value of a datapoint to its label combination, churn and garbage collection datapoints are left out"""
+        if is_noise(datapoint):
+            return
+        labels = datapoint.get("labels") if isinstance(datapoint.get("labels"), dict) else {}
+        key = tuple(labels.get(label) for label in LABELS_LIST)
+        values = groups.setdefault((datapoint["metricName"], key), [])
+        if datapoint.get("value") is not None:
+            values.append(datapoint["value"])
+
+    def close(self) -> None:
+        """Unmaps the spool and the indexed files"""
+        for mapped in self.files:
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        self.files = [b""]
+        self.runs = []
+        self.locations = {}
+        self.indexed = False
+
+
+def _bucket_order(group: Tuple) -> list:
+    """Orders label combinations as composite aggregation buckets, missing labels first"""
+    (metric_name, key), _ = group
+    return [metric_name] + [(value is not None, value) for value in key]
+
+
+def _reduce(function: str, values: List[float]) -> float:
+    """Reduces the values of a label combination as the OpenSearch metric aggregations do"""
+    if function == "sum":
+        return float(sum(values))
+    if function == "avg":
+        return sum(values) / len(values)
+    return float(max(values) if function == "max" else min(values))
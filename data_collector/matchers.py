@@ -0,0 +1,57 @@
+"""Precompiled name matchers for the exclusion and key removal patterns."""
+
+import re
+import logging
+from functools import lru_cache
+from typing import Tuple
+from data_collector.constants import MATCHER_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Global flags, such as (?i), are only allowed at the start of a pattern
+GLOBAL_FLAGS = re.compile(r"^\(\?([aiLmsux]+)\)")
+# Group references change meaning once patterns are combined
+GROUP_REFERENCES = re.compile(r"\\\d|\(\?P[<=]")
+
+
+class PatternMatcher:
+    def __init__(self, patterns: Tuple[str, ...], anchored: bool = False):
+        """Compiles the patterns into a single alternation
+
+        anchored matches the patterns at the start of the names, as re.match does, rather than
+        anywhere in them, as re.search does. Decisions are cached per name.
+        """
+        self.patterns = patterns
+        self.anchored = anchored
+        self.regexes = []
+        if patterns and not any(GROUP_REFERENCES.search(pattern) for pattern in patterns):
+            try:
+                self.regexes = [re.compile("|".join(f"(?:{_scope_flags(pattern)})" for pattern in patterns))]
+            except re.error:
+                logger.debug("Patterns can't be combined, matching them one by one")
+        if patterns and not self.regexes:
+            self.regexes = [re.compile(pattern) for pattern in patterns]
+        self.matches = lru_cache(maxsize=MATCHER_CACHE_SIZE)(self._matches)
+
+    def _matches(self, name: str) -> bool:
+        if self.anchored:
+            return any(regex.match(name) for regex in self.regexes)
+        return any(regex.search(name) for regex in self.regexes)
+
+    def __repr__(self) -> str:
+        return f"PatternMatcher({self.patterns!r}, anchored={self.anchored})"
+
+
+def _scope_flags(pattern: str) -> str:
+    """Turns the leading global flags of a pattern into flags scoped to the pattern"""
+    flags = GLOBAL_FLAGS.match(pattern)
+    if not flags:
+        return pattern
+    return f"(?{flags.group(1)}:{pattern[flags.end():]})"
+
+
+@lru_cache(maxsize=None)
+def get_matcher(patterns: Tuple[str, ...], anchored: bool = False) -> PatternMatcher:
+    """Returns the matcher of a set of patterns, compiled once per process and shared by every run"""
+    logger.debug(f"Compiling {len(patterns)} patterns")
+    return PatternMatcher(patterns, anchored)
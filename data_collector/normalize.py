@@ -1,6 +1,10 @@
-import re
+import sys
 import logging
-from typing import Dict, List
+from array import array
+from functools import lru_cache
+from typing import Dict, Iterable, Tuple
+from data_collector.constants import LABEL_CACHE_SIZE
+from data_collector.matchers import PatternMatcher
 from data_collector.utils import (
     strhash,
     should_exclude,
@@ -13,11 +17,181 @@ from data_collector.utils import (
 logger = logging.getLogger(__name__)
 
 DROP_LIST = ['metadata','uuid','metricName','labels','query', 'value', 'jobName', 'timestamp']
+# Fields of DROP_LIST still read by the collector and the normalization, the rest are never fetched
+REQUIRED_FIELDS = ['uuid', 'metricName', 'labels', 'value', 'jobName']
 LABELS_LIST = ["mode", "verb", "namespace", "resource", "container", "component", "endpoint"]
 DEFAULT_HASH = "xyz"
+# Labels precedence order used for nesting
+NEST_ORDER = ["mode", "verb", "namespace", "component", "resource", "container", "endpoint"]
+# Field holding the reduction of the datapoints aggregated by OpenSearch, one per LABELS_LIST combination
+AGGREGATION = "aggregation"
+# Fields of DROP_LIST kept by the datapoints the normalization skips
+NOISE_FIELDS = ['metricName', 'labels', 'value', 'jobName']
 
 
-def process_json(metric: str, entries: dict, skip_patterns: List[re.Pattern], output: Dict) -> None:
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def _canonical_labels(items: tuple) -> Tuple[str, tuple]:
+    """Computes the hash and the LABELS_LIST items of a label set, given as the tuple of its items
+
+    Results are memoized for the whole process, the same label sets repeat across datapoints and runs.
+    Label values are interned, so the groups of every run share a single copy of each of them.
+    """
+    labels = dict(items)
+    relevant = tuple(
+        (k, sys.intern(labels[k]) if isinstance(labels[k], str) else labels[k]) for k in LABELS_LIST if k in labels
+    )
+    return sys.intern(strhash(labels)), relevant
+
+
+def label_identity(labels: dict) -> Tuple[str, tuple]:
+    """Returns the hash identifying a label set, and its LABELS_LIST items
+
+    The hash is the strhash of the labels, whatever the order of their keys. Label values are strings
+    in kube-burner documents, numbers which compare equal but print differently would share an entry.
+    """
+    try:
+        return _canonical_labels(tuple(labels.items()))
+    except TypeError:
+        # Nested label values aren't hashable, they are canonicalized every time
+        return strhash(labels), tuple((k, labels[k]) for k in LABELS_LIST if k in labels)
+
+
+def is_noise(entry: Dict) -> bool:
+    """Datapoints of the churn phase and of garbage collection are skipped by the normalization to avoid noise"""
+    if 'churnMetric' in entry:
+        return True
+    return 'jobName' in entry and entry['jobName'].lower() == 'garbage-collection'
+
+
+def datapoint_value(entry: Dict) -> float:
+    """Returns what a datapoint adds to the value of its label set
+
+    Raw values are halved and summed per label set. Aggregated datapoints already hold the declared
+    reduction of their label combination, which is exported as is.
+    """
+    return entry["value"] if AGGREGATION in entry else entry["value"]/2
+
+
+class MetricSeries:
+    """Datapoints of a metric of one run, stored column-wise"""
+
+    def __init__(self, metric_name: str, reduction: str = None):
+        """Init method for instance variables"""
+        self.metric_name = metric_name
+        # Reduction of aggregated datapoints, their values aren't halved by the normalization
+        self.reduction = reduction
+        # Each datapoint takes a label set code, a value and a row in three arrays instead of a dict
+        self.codes = array("q")
+        self.values = array("d")
+        # Row of the fields of each datapoint without value, -1 for datapoints with a value
+        self.rows = array("q")
+        # (label hash, LABELS_LIST items, labels) of every label set, coded by order of appearance,
+        # which is the order process_json groups them in
+        self.label_sets = []
+        self.label_codes = {}
+        # Names of the fields of each row, and the values of every field by row. Datapoints without
+        # value, such as quantiles, keep the fields process_json doesn't drop, one row per datapoint
+        self.field_sets = []
+        self.columns = {}
+        # Churn and garbage collection datapoints, without the fields the normalization never reads. They
+        # come after the other ones and are only read by what looks at every datapoint, such as the
+        # cluster health score of the alerts
+        self.noise = []
+
+    @classmethod
+    def from_documents(cls, metric_name: str, datapoints: Iterable[Dict]):
+        """Builds a series from datapoint documents"""
+        series = cls(metric_name)
+        for datapoint in datapoints:
+            series.append(datapoint)
+        return series
+
+    def append(self, datapoint: Dict) -> None:
+        """Adds a datapoint document"""
+        if is_noise(datapoint):
+            self.noise.append({k: v for k, v in datapoint.items() if k not in DROP_LIST or k in NOISE_FIELDS})
+            return
+        labels = datapoint.get("labels")
+        if labels:
+            label_hash, relevant_labels = label_identity(labels)
+        else:
+            label_hash, relevant_labels, labels = DEFAULT_HASH, (), None
+        code = self.label_codes.get(label_hash)
+        if code is None:
+            code = self.label_codes[label_hash] = len(self.label_sets)
+            self.label_sets.append((label_hash, relevant_labels, labels))
+        self.codes.append(code)
+        if AGGREGATION in datapoint:
+            self.reduction = datapoint[AGGREGATION]
+        if "value" in datapoint:
+            self.values.append(datapoint["value"])
+            self.rows.append(-1)
+        else:
+            self.values.append(0.0)
+            self.rows.append(self._append_row({k: v for k, v in datapoint.items() if k not in DROP_LIST}))
+
+    def extend(self, other: "MetricSeries") -> None:
+        """Adds the datapoints of another series of the same metric, after the current ones"""
+        self.reduction = self.reduction or other.reduction
+        mapping = []
+        for label_hash, relevant_labels, labels in other.label_sets:
+            code = self.label_codes.get(label_hash)
+            if code is None:
+                code = self.label_codes[label_hash] = len(self.label_sets)
+                self.label_sets.append((label_hash, relevant_labels, labels))
+            mapping.append(code)
+        self.codes.extend(mapping[code] for code in other.codes)
+        self.values.extend(other.values)
+        offset = len(self.field_sets)
+        self.rows.extend(row + offset if row >= 0 else -1 for row in other.rows)
+        for row in range(len(other.field_sets)):
+            self._append_row(other.fields(row))
+        self.noise.extend(other.noise)
+
+    def _append_row(self, fields: Dict) -> int:
+        row = len(self.field_sets)
+        self.field_sets.append(tuple(fields))
+        for field in fields:
+            if field not in self.columns:
+                self.columns[field] = [None] * row
+        for field, column in self.columns.items():
+            column.append(fields.get(field))
+        return row
+
+    def fields(self, row: int) -> Dict:
+        """Returns the fields of a datapoint without value, as process_json keeps them"""
+        return {field: self.columns[field][row] for field in self.field_sets[row]}
+
+    def __len__(self) -> int:
+        return len(self.codes) + len(self.noise)
+
+    def __getitem__(self, idx: int) -> Dict:
+        """Rebuilds a datapoint document, without the fields the normalization drops"""
+        if idx >= len(self.codes):
+            return dict(self.noise[idx - len(self.codes)])
+        _, _, labels = self.label_sets[self.codes[idx]]
+        row = self.rows[idx]
+        datapoint = {"metricName": self.metric_name}
+        if row < 0:
+            datapoint["value"] = self.values[idx]
+        else:
+            datapoint.update(self.fields(row))
+        if labels:
+            datapoint["labels"] = labels
+        if self.reduction:
+            datapoint[AGGREGATION] = self.reduction
+        return datapoint
+
+    def __iter__(self):
+        return (self[idx] for idx in range(len(self)))
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate size of the arrays of the series"""
+        return sum(len(column) * column.itemsize for column in (self.codes, self.values, self.rows))
+
+
+def process_json(metric: str, entries: dict, skip_patterns: PatternMatcher, output: Dict) -> None:
     """Processes JSON and generates a huge json with minimal data"""
     if not entries:
         return
@@ -30,29 +204,63 @@ def process_json(metric: str, entries: dict, skip_patterns: List[re.Pattern], ou
     if should_exclude(metric_name, skip_patterns):
         return
 
+    if isinstance(entries, MetricSeries):
+        grouped_metrics = group_series(entries)
+    else:
+        grouped_metrics = group_entries(entries)
+
+    # Adds up condensed data values to output json
+    if metric_name in output["metrics"]:
+        output["metrics"][metric_name].extend(grouped_metrics.values())
+    else:
+        output["metrics"][metric_name] = list(grouped_metrics.values())
+
+def group_series(series: MetricSeries) -> Dict:
+    """Groups the datapoints of a series by label set, as group_entries does for documents"""
+    grouped_metrics = {}
+    label_sets = series.label_sets
+    # Aggregated values are exported as is
+    share = 1.0 if series.reduction else 0.5
+    for code, value, row in zip(series.codes, series.values, series.rows):
+        label_hash, relevant_labels, labels = label_sets[code]
+        group = grouped_metrics.get(label_hash)
+        if group is None:
+            group = grouped_metrics[label_hash] = {"value": 0.0}
+            if labels:
+                group["labels"] = dict(relevant_labels)
+        if row < 0:
+            # reduces value to average
+            group["value"] += value * share
+        else:
+            entry = series.fields(row)
+            if isinstance(group["value"], (int, float)):
+                group.pop("value", None)
+            if "value" not in group:
+                group["value"] = [entry]
+            else:
+                group["value"].append(entry)
+    return grouped_metrics
+
+def group_entries(entries: list) -> Dict:
+    """Groups datapoint documents by label set, summing their halved values"""
     grouped_metrics = {}
     for entry in entries:
-        # Skip the metircs during churn phase to avoid noise
-        if 'churnMetric' in entry:
-            continue
-        # Skip metrics during garbage collection as well to avoid noise
-        if 'jobName' in entry and entry['jobName'].lower() == 'garbage-collection':
+        if is_noise(entry):
             continue
         label_hash = DEFAULT_HASH
         labels = entry.get("labels")
         if labels:
-            label_hash = strhash(labels)
+            label_hash, relevant_labels = label_identity(labels)
 
         if label_hash not in grouped_metrics:
             grouped_metrics[label_hash] = {"value": 0.0}
             if labels:
-                grouped_metrics[label_hash]["labels"] = {k: labels[k] for k in LABELS_LIST if k in labels}
+                grouped_metrics[label_hash]["labels"] = dict(relevant_labels)
 
         # Drop unneeded fields
         if "value" in entry:
             # reduces value to average
-            entry = {"value": entry["value"]}
-            grouped_metrics[label_hash]["value"] += entry["value"]/2
+            grouped_metrics[label_hash]["value"] += datapoint_value(entry)
         else:
             # handles cases where metrics don't have value. for example, quantiles
             for k in DROP_LIST:
@@ -64,18 +272,11 @@ def process_json(metric: str, entries: dict, skip_patterns: List[re.Pattern], ou
                 grouped_metrics[label_hash]["value"] = [entry]
             else:
                 grouped_metrics[label_hash]["value"].append(entry)
-
-    # Adds up condensed data values to output json
-    if metric_name in output["metrics"]:
-        output["metrics"][metric_name].extend(grouped_metrics.values())
-    else:
-        output["metrics"][metric_name] = list(grouped_metrics.values())
+    return grouped_metrics
 
 def normalize_metrics(metrics: dict) -> dict:
     """Intermidiate normalization step to further reduce the json"""
 
-    # Labels precedence order used for nesting
-    nest_order = ["mode", "verb", "namespace", "component", "resource", "container", "endpoint"]
     nested_metrics = {}
 
     for metric, entries in metrics:
@@ -86,7 +287,7 @@ def normalize_metrics(metrics: dict) -> dict:
             value = entry["value"]
 
             # Get available keys from labels, in nest_order
-            label_keys = [k for k in nest_order if k in labels]
+            label_keys = [k for k in NEST_ORDER if k in labels]
             if not label_keys:
                 # No labels at all, store directly under metric
                 existing = nested_metrics[metric]
@@ -151,6 +352,10 @@ def normalize(metrics_data: dict, exclude_metrics: str):
 
     flattened = {}
     flatten_json(flattened, final_output)
+    return add_metadata(flattened, metrics_data)
+
+def add_metadata(flattened: dict, metrics_data: dict) -> dict:
+    """Adds the run metadata and the cluster health score to the flattened metrics"""
     patterns_to_remove = [r"(?i).*time.*", r"uuid", r"version"]
     metadata = remove_keys_by_patterns(metrics_data["metadata"], patterns_to_remove)
     for key, value in metadata.items():
@@ -0,0 +1,248 @@
+"""Streaming export pipeline."""
+
+import time
+import hashlib
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Tuple
+from data_collector.checkpoint import Checkpoint
+from data_collector.constants import S3_BUCKET, CHUNK_SIZE, NORMALIZE_BATCH_SIZE
+from data_collector.instrumentation import recorder
+from data_collector import fused, normalize, vectorized
+from data_collector.s3 import S3Uploader, UploadQueue
+from data_collector.schema import SchemaRegistry
+from data_collector.shard import merge_manifests
+from data_collector.utils import split_list_into_chunks
+from data_collector.writers import get_writer
+
+logger = logging.getLogger(__name__)
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+DAY_FORMAT = "%Y-%m-%d"
+
+# Normalization engines, every engine produces the same rows
+ENGINES = {
+    "python": normalize.normalize,
+    "numpy": vectorized.normalize,
+    "fused": fused.normalize,
+}
+
+
+def normalize_runs(
+    runs: Iterable[Dict],
+    exclude_metrics: str,
+    workers: int = 1,
+    engine: str = "python",
+    executor: ProcessPoolExecutor = None,
+) -> Iterator[Tuple[str, list, Dict]]:
+    """Lazily normalizes the runs yielded by a collector into (uuid, sort key, row) tuples
+
+    With more than one worker, batches of runs are normalized in a process pool. Only a bounded
+    number of batches is in flight at any time and rows are yielded in the collection order,
+    so the output is the same as the serial one. A long-lived executor of workers processes can
+    be given, so its processes are reused across calls.
+    """
+    if executor is not None:
+        yield from _normalize_pooled(runs, exclude_metrics, workers, engine, executor)
+        return
+    if workers <= 1:
+        normalize_run = ENGINES[engine]
+        for uuid, sort, run_json in _split_runs(runs):
+            with recorder.span("normalize"):
+                row = normalize_run(run_json, exclude_metrics)
+            yield uuid, sort, row
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from _normalize_pooled(runs, exclude_metrics, workers, engine, executor)
+
+
+def _normalize_pooled(
+    runs: Iterable[Dict], exclude_metrics: str, workers: int, engine: str, executor: ProcessPoolExecutor
+) -> Iterator[Tuple[str, list, Dict]]:
+    """Normalizes batches of runs in a process pool, keeping at most two batches per worker in flight"""
+    pending = deque()
+    for batch in split_list_into_chunks(_split_runs(runs), NORMALIZE_BATCH_SIZE):
+        pending.append(executor.submit(_normalize_batch, batch, exclude_metrics, engine))
+        if len(pending) >= 2 * workers:
+            yield from _batch_rows(pending.popleft())
+    while pending:
+        yield from _batch_rows(pending.popleft())
+
+
+def _split_runs(runs: Iterable[Dict]) -> Iterator[Tuple[str, list, Dict]]:
+    """Unpacks the runs yielded by a collector into (uuid, sort key, run) tuples"""
+    for each_run in runs:
+        for uuid, run_json in each_run.items():
+            yield uuid, run_json.get("sort"), run_json
+
+
+def _normalize_batch(
+    batch: List[Tuple[str, list, Dict]], exclude_metrics: str, engine: str
+) -> Tuple[List[Tuple[str, list, Dict]], List[float]]:
+    """Normalizes a batch of runs with the given engine, runs in the worker processes
+
+    Workers can't record in the parent's recorder, so the time spent on each run is returned along with the rows.
+    """
+    normalize_run = ENGINES[engine]
+    rows, durations = [], []
+    for uuid, sort, run_json in batch:
+        start = time.perf_counter()
+        rows.append((uuid, sort, normalize_run(run_json, exclude_metrics)))
+        durations.append(time.perf_counter() - start)
+    return rows, durations
+
+
+def _batch_rows(future) -> List[Tuple[str, list, Dict]]:
+    """Waits for a batch normalized by a worker and accounts its runs"""
+    rows, durations = future.result()
+    for seconds in durations:
+        recorder.add_span("normalize", seconds)
+    return rows
+
+
+def output_prefix(config: dict, from_date: datetime, to: datetime, shard: Tuple[int, int] = None) -> str:
+    """Returns the prefix of the objects exported for a time range, or for one shard of it"""
+    prefix = f"{config['output_prefix']}_{from_date.strftime(TIMESTAMP_FORMAT)}_{to.strftime(TIMESTAMP_FORMAT)}"
+    if shard:
+        index, shards = shard
+        prefix += f"_shard_{index}_of_{shards}"
+    return prefix
+
+
+def watch_prefix(config: dict, from_date: datetime, day: datetime) -> str:
+    """Returns the prefix of the objects a watch collection, which has no end, exports on a day
+
+    The prefix rotates every day so the manifest, uploaded again with every chunk, stays bounded.
+    """
+    return f"{config['output_prefix']}_{from_date.strftime(TIMESTAMP_FORMAT)}_watch_{day.strftime(DAY_FORMAT)}"
+
+
+def header_hash(fieldnames: List[str]) -> str:
+    """Returns a short digest of a chunk header, chunks with the same header have the same digest"""
+    return hashlib.sha1("\n".join(fieldnames).encode()).hexdigest()[:16]
+
+
+def export_rows(
+    rows: Iterable[Tuple[str, list, Dict]],
+    config: dict,
+    from_date: datetime,
+    to: datetime,
+    checkpoint: Checkpoint = None,
+    output_format: str = "csv",
+    uploader: S3Uploader = None,
+    shard: Tuple[int, int] = None,
+    schema: SchemaRegistry = None,
+) -> int:
+    """Uploads the rows in chunks as soon as they are ready and returns the number of chunks in the manifest"""
+    # Shards name their output after the whole time range and their index, so it can be merged afterwards
+    exporter = ChunkExporter(config, output_prefix(config, from_date, to, shard), checkpoint, output_format, uploader, schema)
+    for chunk in split_list_into_chunks(rows, CHUNK_SIZE):
+        exporter.write(chunk)
+    exporter.drain()
+    return len(exporter.manifest["chunks"])
+
+
+class ChunkExporter:
+    """Uploads numbered chunks of rows under a prefix, keeping its manifest and the checkpoint up to date"""
+
+    def __init__(
+        self,
+        config: dict,
+        prefix: str,
+        checkpoint: Checkpoint = None,
+        output_format: str = "csv",
+        uploader: S3Uploader = None,
+        schema: SchemaRegistry = None,
+    ):
+        """Init method for instance variables, the manifest of a resumed collection is read back"""
+        self.uploader = uploader or S3Uploader(S3_BUCKET)
+        self.writer = get_writer(output_format)
+        self.checkpoint = checkpoint
+        self.schema = schema
+        self.foldername = config["benchmark"]
+        # Numbering continues from the checkpoint, so a resumed collection never overwrites an exported chunk
+        self.next_chunk = checkpoint.chunks + 1 if checkpoint else 1
+        # Chunks upload in the background, the manifest and the checkpoint only advance once every
+        # previous chunk is in the bucket
+        self.uploads = UploadQueue(self.uploader.concurrency)
+        self.rotate(prefix)
+
+    def rotate(self, prefix: str) -> None:
+        """Uploads the next chunks under another prefix with its own manifest, once every scheduled upload is drained"""
+        self.prefix = prefix
+        self.manifest_name = f"{prefix}_manifest.json"
+        self.manifest = {"columns": set(), "chunks": []}
+        if self.next_chunk > 1:
+            # Keep listing the chunks uploaded under the prefix before the collection was resumed
+            previous = self.uploader.read_json(self.foldername, self.manifest_name) or {}
+            self.manifest["columns"].update(previous.get("columns", []))
+            self.manifest["chunks"].extend(previous.get("chunks", []))
+
+    def write(self, chunk: List[Tuple[str, list, Dict]]) -> None:
+        """Schedules the upload of a chunk of (uuid, sort key, row) tuples, in collection order"""
+        chunk_rows = [row for _, _, row in chunk]
+        dtypes = None
+        if self.schema:
+            # Registered columns only grow at the end, so chunks concatenate without reconciling their headers
+            self.schema.register(chunk_rows)
+            fieldnames, dtypes = self.schema.fieldnames, dict(self.schema.columns)
+        else:
+            # Each chunk carries the header of its own rows, so no chunk waits for the whole time range
+            fieldnames = sorted(set().union(*chunk_rows))
+        filename = self.uploader.filename(self.writer, f"{self.prefix}_chunk_{self.next_chunk}")
+        self.next_chunk += 1
+        future = self.uploader.upload_chunk(self.writer, chunk_rows, fieldnames, self.foldername, filename, dtypes)
+        # Entries don't repeat the header, the manifest is uploaded again with every chunk
+        entry = {"file": filename, "rows": len(chunk_rows)}
+        if self.schema:
+            entry["schema_version"] = self.schema.version
+        else:
+            entry["header"] = header_hash(fieldnames)
+        # Rows keep the collection order, so the last one holds the furthest sort key
+        uuids, sort = [uuid for uuid, _, _ in chunk], chunk[-1][1]
+        self.uploads.submit(future, lambda: self._uploaded(uuids, sort, entry, fieldnames))
+
+    def drain(self) -> None:
+        """Waits for every scheduled upload"""
+        self.uploads.drain()
+
+    def discard(self) -> None:
+        """Gives up on the scheduled uploads after a failure"""
+        self.uploads.discard()
+        # Their chunks are never recorded, their numbers are given to the next chunks
+        self.next_chunk = (self.checkpoint.chunks if self.checkpoint else len(self.manifest["chunks"])) + 1
+
+    def _uploaded(self, uuids: List[str], sort: list, entry: Dict, fieldnames: List[str]) -> None:
+        self.manifest["columns"].update(fieldnames)
+        self.manifest["chunks"].append(entry)
+        # The manifest is refreshed with every chunk, so it's also complete for interrupted collections
+        self.uploader.upload_json(
+            {"columns": sorted(self.manifest["columns"]), "chunks": self.manifest["chunks"]},
+            self.foldername,
+            self.manifest_name,
+        )
+        if self.checkpoint:
+            self.checkpoint.update(uuids, sort)
+
+
+def merge_shards(config: dict, from_date: datetime, to: datetime, shards: int, uploader: S3Uploader = None) -> int:
+    """Publishes the manifest of a sharded collection from the manifests of its shards
+
+    Returns the number of chunks in the merged manifest, shards without a manifest are reported and skipped.
+    """
+    uploader = uploader or S3Uploader(S3_BUCKET)
+    foldername = config["benchmark"]
+    manifests = []
+    for index in range(shards):
+        name = f"{output_prefix(config, from_date, to, (index, shards))}_manifest.json"
+        manifest = uploader.read_json(foldername, name)
+        if manifest is None:
+            logger.warning(f"Missing manifest {name}, shard {index} is not in the merged manifest")
+            continue
+        manifests.append(manifest)
+    merged = merge_manifests(manifests)
+    uploader.upload_json(merged, foldername, f"{output_prefix(config, from_date, to)}_manifest.json")
+    logger.info(f"Merged {len(manifests)} of {shards} shards: {len(merged['chunks'])} chunks, {len(merged['columns'])} columns")
+    return len(merged["chunks"])
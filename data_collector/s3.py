@@ -1,26 +1,198 @@
-import os
-import csv
+import io
+import gzip
+import json
 import boto3
 import logging
-import tempfile
+from botocore.exceptions import ClientError
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from data_collector.constants import S3_PART_SIZE
+from data_collector.instrumentation import SIZE_BUCKETS, recorder
 
 logger = logging.getLogger(__name__)
 
-def upload_csv_to_s3(chunk_rows, fieldnames, bucket, foldername, filename):
-    """Uploads a CSV file to S3"""
-    tmp = tempfile.NamedTemporaryFile(mode='w+', newline='', delete=False)
-    try:
-        writer = csv.DictWriter(tmp, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(chunk_rows)
-        tmp.flush()
-
-        # Upload to S3
-        s3 = boto3.client("s3")
+
+class MultipartUploadStream(io.RawIOBase):
+    """Write-only file object streaming its content to an S3 object.
+
+    Data is kept in a buffer of at most part_size bytes, each full buffer is sent as a part of a
+    multipart upload. Objects smaller than a single part are sent with a plain put_object.
+    """
+
+    def __init__(self, client, bucket: str, key: str, part_size: int = S3_PART_SIZE):
+        """Init method for instance variables"""
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = None
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def write(self, data) -> int:
+        """Buffers the data and uploads every full part"""
+        self.buffer.extend(data)
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def close(self) -> None:
+        """Uploads the remaining data and completes the object"""
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                with recorder.span("s3_request"):
+                    self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer))
+            else:
+                if self.buffer:
+                    self._upload_part(bytes(self.buffer))
+                with recorder.span("s3_request"):
+                    self.client.complete_multipart_upload(
+                        Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+                    )
+            self.buffer = bytearray()
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            super().close()
+
+    def abort(self) -> None:
+        """Aborts the multipart upload so no orphan parts are left in the bucket"""
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self.buffer = bytearray()
+        super().close()
+
+    def _upload_part(self, data: bytes) -> None:
+        """Uploads a single part, starting the multipart upload on the first one"""
+        if self.upload_id is None:
+            with recorder.span("s3_request"):
+                self.upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)["UploadId"]
+        number = len(self.parts) + 1
+        with recorder.span("s3_request"):
+            response = self.client.upload_part(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=data
+            )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": number})
+
+
+class S3Uploader:
+    """Uploads chunks to a bucket reusing a single client.
+
+    Chunks are serialized straight into a multipart upload without temporary files, and up to
+    concurrency chunks are uploaded in parallel.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: str = None,
+        compress: bool = False,
+        concurrency: int = 1,
+        part_size: int = S3_PART_SIZE,
+    ):
+        """Init method for instance variables"""
+        self.bucket = bucket
+        self.compress = compress
+        self.concurrency = max(1, concurrency)
+        self.part_size = part_size
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def filename(self, writer, name: str) -> str:
+        """Returns the object name of a chunk for the given writer"""
+        if self.compress and writer.compressible:
+            return f"{name}.{writer.extension}.gz"
+        return f"{name}.{writer.extension}"
+
+    def upload_chunk(self, writer, chunk_rows, fieldnames, foldername, filename, dtypes=None) -> Future:
+        """Schedules the upload of a chunk of rows in the writer's output format"""
+        return self.executor.submit(self._upload_chunk, writer, chunk_rows, fieldnames, foldername, filename, dtypes)
+
+    def upload_json(self, obj, foldername, filename) -> None:
+        """Uploads a JSON document"""
+        s3_key = f"{foldername.rstrip('/')}/{filename}"
+        body = json.dumps(obj, indent=2).encode()
+        self.client.put_object(Bucket=self.bucket, Key=s3_key, Body=body, ContentType="application/json")
+        logger.info(f"✅ Uploaded s3://{self.bucket}/{s3_key}")
+
+    def read_json(self, foldername, filename):
+        """Reads a JSON document, returns None when it doesn't exist"""
+        s3_key = f"{foldername.rstrip('/')}/{filename}"
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=s3_key)["Body"].read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(body)
+
+    def close(self) -> None:
+        """Waits for the scheduled uploads and releases the worker threads"""
+        self.executor.shutdown(wait=True)
+
+    def _upload_chunk(self, writer, chunk_rows, fieldnames, foldername, filename, dtypes=None) -> None:
         s3_key = f"{foldername.rstrip('/')}/{filename}"
-        s3.upload_file(tmp.name, bucket, s3_key)
-        logger.info(f"✅ Uploaded chunk to s3://{bucket}/{s3_key}")
-    finally:
-        tmp.close()
-        os.remove(tmp.name)
-        logger.info(f"🧹 Temporary file {tmp.name} deleted")
+        stream = MultipartUploadStream(self.client, self.bucket, s3_key, self.part_size)
+        # Serialization and upload are interleaved, serialization time is chunk_upload minus s3_request
+        with recorder.span("chunk_upload"):
+            try:
+                if self.compress and writer.compressible:
+                    with gzip.GzipFile(fileobj=stream, mode="wb") as compressed:
+                        writer.write(compressed, chunk_rows, fieldnames, dtypes)
+                else:
+                    writer.write(stream, chunk_rows, fieldnames, dtypes)
+            except Exception:
+                stream.abort()
+                raise
+            size = stream.tell()
+            stream.close()
+        recorder.observe("chunk_rows", len(chunk_rows), SIZE_BUCKETS)
+        recorder.observe("chunk_bytes", size, SIZE_BUCKETS)
+        recorder.incr("rows_written", len(chunk_rows))
+        recorder.incr("bytes_written", size)
+        logger.info(f"✅ Uploaded chunk to s3://{self.bucket}/{s3_key}")
+
+
+class UploadQueue:
+    """Keeps track of in-flight chunk uploads and completes them in submission order"""
+
+    def __init__(self, max_pending: int):
+        """Init method for instance variables"""
+        self.max_pending = max(1, max_pending)
+        self.pending = deque()
+
+    def submit(self, future: Future, on_done) -> None:
+        """Adds an upload, blocking while max_pending uploads are in flight"""
+        self.pending.append((future, on_done))
+        while len(self.pending) > self.max_pending or (self.pending and self.pending[0][0].done()):
+            self._complete_oldest()
+
+    def drain(self) -> None:
+        """Waits for every in-flight upload"""
+        while self.pending:
+            self._complete_oldest()
+
+    def discard(self) -> None:
+        """Waits for the in-flight uploads without recording them as done, whether they fail or not"""
+        while self.pending:
+            future, _ = self.pending.popleft()
+            future.exception()
+
+    def _complete_oldest(self) -> None:
+        future, on_done = self.pending.popleft()
+        # result() re-raises upload errors, so a failed chunk is never recorded as done
+        future.result()
+        on_done()
@@ -0,0 +1,99 @@
+"""Append-only registry of the exported columns and their types."""
+
+import logging
+from typing import Dict, Iterable, List, Optional
+from data_collector.storage import read_json, write_json
+
+logger = logging.getLogger(__name__)
+
+# Column types, in widening order
+DTYPES = ["bool", "int64", "float64", "string"]
+
+
+def infer_dtype(values: Iterable) -> Optional[str]:
+    """Returns the type of a column: booleans and numbers keep their type, anything else is a string
+
+    Returns None when the column holds no value.
+    """
+    present = [value for value in values if value is not None]
+    if not present:
+        return None
+    if all(isinstance(value, bool) for value in present):
+        return "bool"
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        if all(isinstance(value, int) for value in present):
+            return "int64"
+        return "float64"
+    return "string"
+
+
+def widen_dtype(current: Optional[str], other: Optional[str]) -> Optional[str]:
+    """Returns the narrowest type holding the values of both types"""
+    if current is None or current == other:
+        return other or current
+    if other is None:
+        return current
+    if {current, other} == {"int64", "float64"}:
+        return "float64"
+    return "string"
+
+
+class SchemaRegistry:
+    """Columns and types shared by every chunk of the collections using the registry
+
+    The registry is saved whole after every change, without any conditional write, so the last
+    writer wins: it must not be shared by concurrent collections, such as the shards of a sharded
+    collection, which would drop each other's columns.
+    """
+
+    def __init__(self, location: str, client=None):
+        """Init method for instance variables, location is a local path or an s3:// URI read and written with client"""
+        self.location = location
+        self.client = client
+        self.version = 0
+        # Column names mapped to their type, in header order
+        self.columns: Dict[str, Optional[str]] = {}
+
+    def load(self):
+        """Loads the persisted schema, an absent registry starts empty"""
+        state = read_json(self.location, self.client)
+        if state:
+            self.version = state.get("version", 0)
+            self.columns = {column["name"]: column.get("dtype") for column in state.get("columns", [])}
+            logger.info(f"Loaded schema version {self.version} from {self.location}: {len(self.columns)} columns")
+        return self
+
+    @property
+    def fieldnames(self) -> List[str]:
+        """Returns the header every chunk is written with"""
+        return list(self.columns)
+
+    def register(self, rows: List[Dict]) -> bool:
+        """Adds the new columns of the rows and widens the types of existing ones
+
+        Columns are never removed or reordered, new ones are appended in sorted order so headers
+        only ever grow at the end. Returns whether the schema changed, in which case it's saved
+        under a new version.
+        """
+        names = set().union(*rows)
+        changed = False
+        for name in sorted(names - self.columns.keys()):
+            self.columns[name] = None
+            changed = True
+        for name in names:
+            dtype = widen_dtype(self.columns[name], infer_dtype(row.get(name) for row in rows))
+            if dtype != self.columns[name]:
+                if self.columns[name] is not None:
+                    logger.warning(f"Column {name} widened from {self.columns[name]} to {dtype}")
+                self.columns[name] = dtype
+                changed = True
+        if changed:
+            self.version += 1
+            self.save()
+        return changed
+
+    def save(self) -> None:
+        """Persists the schema"""
+        columns = [{"name": name, "dtype": dtype} for name, dtype in self.columns.items()]
+        write_json(self.location, {"version": self.version, "columns": columns}, self.client)
+        logger.debug(f"Schema version {self.version} saved to {self.location}")
@@ -0,0 +1,71 @@
+"""Time window sharding of large collections."""
+
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+from data_collector.constants import SHARD_HISTOGRAM_BUCKETS
+from data_collector.source import Source
+
+logger = logging.getLogger(__name__)
+
+SHARD_STRATEGIES = ["time", "count"]
+
+
+def time_windows(from_date: datetime, to: datetime, shards: int) -> List[Tuple[datetime, datetime]]:
+    """Splits a time range into shards windows of the same length, on whole seconds"""
+    step = (to - from_date).total_seconds() / shards
+    bounds = [from_date + timedelta(seconds=int(step * idx)) for idx in range(shards)] + [to]
+    return list(zip(bounds, bounds[1:]))
+
+
+def balanced_windows(
+    source: Source, from_date: datetime, to: datetime, shards: int
+) -> List[Tuple[datetime, datetime]]:
+    """Splits a time range into shards windows holding about the same number of runs
+
+    Boundaries fall on the buckets of a date histogram of the jobSummary documents, so a window
+    may hold more than its share when runs pile up in a single bucket.
+    """
+    interval = max(1, int((to - from_date).total_seconds() // (shards * SHARD_HISTOGRAM_BUCKETS)))
+    histogram = source.histogram(from_date, to, interval)
+    total = sum(count for _, count in histogram)
+    if not total:
+        logger.info("No runs in the time range, falling back to time windows")
+        return time_windows(from_date, to, shards)
+    bounds, seen = [from_date], 0
+    for start, count in histogram:
+        # A window closes at the first bucket that would take it past its share of the runs
+        while len(bounds) < shards and seen + count > total * len(bounds) / shards and start > bounds[-1]:
+            bounds.append(start)
+        seen += count
+    bounds += [to] * (shards + 1 - len(bounds))
+    logger.info(f"Balanced {total} runs over {shards} windows: {[bound.isoformat() for bound in bounds]}")
+    return list(zip(bounds, bounds[1:]))
+
+
+def shard_window(
+    source: Source, from_date: datetime, to: datetime, shards: int, index: int, strategy: str = "time"
+) -> Tuple[datetime, datetime]:
+    """Returns the window of one shard, every shard computes the same windows independently"""
+    if strategy == "count":
+        windows = balanced_windows(source, from_date, to, shards)
+    else:
+        windows = time_windows(from_date, to, shards)
+    return windows[index]
+
+
+def shard_location(location: str, index: int, shards: int) -> str:
+    """Returns the location of the state of one shard, shards sharing a state would overwrite each other's"""
+    root, extension = os.path.splitext(location)
+    return f"{root}_shard_{index}_of_{shards}{extension}"
+
+
+def merge_manifests(manifests: List[Dict]) -> Dict:
+    """Merges the manifests of every shard, in shard order, under the union of their columns"""
+    columns = set()
+    chunks = []
+    for manifest in manifests:
+        columns.update(manifest.get("columns", []))
+        chunks.extend(manifest.get("chunks", []))
+    return {"columns": sorted(columns), "chunks": chunks}
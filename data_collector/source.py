@@ -0,0 +1,84 @@
+"""Sources the benchmark runs are collected from."""
+
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Iterator, List, Tuple
+from data_collector.utils import compile_exclude_patterns, should_exclude
+
+logger = logging.getLogger(__name__)
+
+# Reductions of aggregate_metrics, computed by the OpenSearch metric aggregations of the same name
+REDUCTIONS = ["avg", "max", "min", "sum"]
+
+
+class Source(ABC):
+    """Base class of the collection sources
+
+    A source yields the runs of the configured benchmark within a time range, in (timestamp, uuid)
+    order, as {uuid: {"metadata": ..., "metrics": ..., "sort": ...}} dicts. metrics maps every collected
+    metric to its MetricSeries and sort is the key a collection resumes after, so every source
+    produces the same rows and checkpoints. Sources missing collect or histogram can't be created.
+    """
+
+    def __init__(self, config: dict, skip_excluded: bool = False):
+        """Init method for instance variables"""
+        self.config = config
+        # Metrics excluded from the normalization are never fetched when skip_excluded is set,
+        # alerts are always fetched as the cluster health score is computed from them
+        self.metrics = list(config.get("metrics", []))
+        if skip_excluded:
+            exclude = compile_exclude_patterns(",".join(config.get("exclude_normalization", [])))
+            self.metrics = [metric for metric in self.metrics if metric == "alert" or not should_exclude(metric, exclude)]
+            logger.info(f"Skipping excluded metrics: {sorted(set(config.get('metrics', [])) - set(self.metrics))}")
+        # Metrics reduced per label combination, mapped to their avg, max, min or sum reduction
+        aggregate_metrics = config.get("aggregate_metrics") or {}
+        for metric, function in aggregate_metrics.items():
+            if function not in REDUCTIONS:
+                raise ValueError(f"Unknown reduction {function} of {metric}, valid reductions are: {', '.join(REDUCTIONS)}")
+        self.aggregate_metrics = {metric: function for metric, function in aggregate_metrics.items() if metric in self.metrics}
+
+    @abstractmethod
+    def collect(
+        self,
+        from_date: datetime,
+        to: datetime,
+        search_after: list = None,
+        skip_uuids: set = frozenset(),
+        include_end: bool = True,
+    ) -> Iterator[Dict]:
+        """Yields the runs of a time range, one at a time
+
+        search_after and skip_uuids allow resuming a previous collection from its checkpoint.
+        include_end=False excludes the runs at the end of the range, so adjacent ranges never share a run.
+        """
+
+    @abstractmethod
+    def histogram(self, from_date: datetime, to: datetime, interval: int) -> List[Tuple[datetime, int]]:
+        """Counts the runs of a time range in buckets of interval seconds
+
+        Returns the (bucket start, count) pairs of the non empty buckets, in time order.
+        """
+
+    def close(self) -> None:
+        """Releases the resources held by the source"""
+
+    @staticmethod
+    def _resume_key(search_after: list) -> list:
+        """Returns the (timestamp, uuid) sort key a collection resumes after
+
+        Checkpoints written before the uuid tiebreaker only hold the timestamp, they resume at its first run.
+        """
+        if search_after and len(search_after) < 2:
+            return list(search_after) + [""]
+        return search_after
+
+    def _metadata(self, jobSummary: dict) -> dict:
+        """Extracts the configured metadata fields from a jobSummary document"""
+        metadata = {}
+        for field in self.config["metadata"]:
+            if field in jobSummary:
+                metadata[field] = jobSummary[field]
+            elif "jobConfig" in jobSummary and field in jobSummary["jobConfig"]:
+                metadata.setdefault("jobConfig", {})[field] = jobSummary["jobConfig"][field]
+        return metadata
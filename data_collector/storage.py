@@ -0,0 +1,55 @@
+"""Small JSON state documents stored either locally or in S3."""
+
+import os
+import json
+import boto3
+import logging
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+S3_SCHEME = "s3://"
+
+
+def split_s3_uri(uri: str):
+    """Splits an s3://bucket/key URI into bucket and key"""
+    bucket, _, key = uri[len(S3_SCHEME):].partition("/")
+    return bucket, key
+
+
+def read_json(location: str, client=None):
+    """Reads a JSON document from a local path or an s3:// URI, returns None when it doesn't exist
+
+    S3 documents are read with the given client, a default one is created otherwise.
+    """
+    if location.startswith(S3_SCHEME):
+        bucket, key = split_s3_uri(location)
+        client = client or boto3.client("s3")
+        try:
+            body = client.get_object(Bucket=bucket, Key=key)["Body"].read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        return json.loads(body)
+    if not os.path.exists(location):
+        return None
+    with open(location) as f:
+        return json.load(f)
+
+
+def write_json(location: str, obj, client=None) -> None:
+    """Writes a JSON document to a local path or an s3:// URI
+
+    S3 documents are written with the given client, a default one is created otherwise.
+    """
+    body = json.dumps(obj)
+    if location.startswith(S3_SCHEME):
+        bucket, key = split_s3_uri(location)
+        (client or boto3.client("s3")).put_object(Bucket=bucket, Key=key, Body=body.encode(), ContentType="application/json")
+        return
+    # Write and rename so a crash never leaves a truncated document behind
+    tmp = f"{location}.tmp"
+    with open(tmp, "w") as f:
+        f.write(body)
+    os.replace(tmp, location)
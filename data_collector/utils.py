@@ -1,14 +1,19 @@
-import re
 import logging
 from datetime import datetime
+from itertools import islice
 from typing import Dict, List, Any
+from data_collector.matchers import PatternMatcher, get_matcher
 
 logger = logging.getLogger(__name__)
 
 def split_list_into_chunks(lst, chunk_size):
-    """Splits a list into given chunk sizes"""
-    for idx in range(0, len(lst), chunk_size):
-        yield lst[idx:idx + chunk_size]
+    """Splits a list, or any iterable, into given chunk sizes without consuming it ahead of time"""
+    iterator = iter(lst)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
 
 def strhash(value: Any) -> str:
     """Recursively generate a stable string hash from a nested dict or value"""
@@ -29,22 +34,22 @@ def parse_timerange(from_date_dt: datetime, to_dt: datetime):
         exit(1)
     return from_date, to
 
-def compile_exclude_patterns(patterns_str: str) -> List[re.Pattern]:
-    """Compiles the patterns to be excluded"""
+def compile_exclude_patterns(patterns_str: str) -> PatternMatcher:
+    """Compiles the patterns to be excluded, once per distinct patterns string"""
     if not patterns_str:
-        return []
-    return [re.compile(pattern.strip()) for pattern in patterns_str.split(",")]
+        return get_matcher(())
+    return get_matcher(tuple(pattern.strip() for pattern in patterns_str.split(",")))
 
-def should_exclude(metric_name: str, patterns: List[re.Pattern]) -> bool:
+def should_exclude(metric_name: str, patterns: PatternMatcher) -> bool:
     """Return a boolean on exclusion decision"""
-    return any(p.search(metric_name) for p in patterns)
+    return patterns.matches(metric_name)
 
 def remove_keys_by_patterns(data: Dict, patterns: List[str]) -> Dict:
     """Removes keys in a dict based on regex list"""
-    regexes = [re.compile(p) for p in patterns]
+    matcher = get_matcher(tuple(patterns), anchored=True)
     return {
         k: v for k, v in data.items()
-        if not any(r.match(k) for r in regexes)
+        if not matcher.matches(k)
     }
 
 def recursively_flatten_values(obj: dict) -> dict:
@@ -0,0 +1,139 @@
+"""Vectorized normalization engine built on NumPy.
+
+Produces the same rows as normalize.normalize, but reduces every metric with array operations
+instead of building and walking the intermediate nested json.
+"""
+
+import logging
+from typing import Dict, List, Union
+from data_collector.normalize import (
+    NEST_ORDER,
+    MetricSeries,
+    add_metadata,
+    datapoint_value,
+    is_noise,
+    label_identity,
+    normalize_metrics,
+    process_json,
+)
+from data_collector.utils import (
+    should_exclude,
+    compile_exclude_patterns,
+    recursively_flatten_values,
+    flatten_json,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(metrics_data: dict, exclude_metrics: str):
+    """Driver code to triger the execution"""
+    if np is None:
+        raise ImportError("The numpy normalization engine requires numpy, install it with: pip install data_collector[numpy]")
+    skip_patterns = compile_exclude_patterns(exclude_metrics)
+
+    # Metrics sharing a metricName are merged, in order of appearance, as process_json does
+    sources = {}
+    for metric, entries in metrics_data["metrics"].items():
+        if not entries:
+            continue
+        metric_name = entries[0].get("metricName")
+        if not metric_name:
+            logger.info(f"Warning: 'metricName' missing in first entry of the metric: {metric}")
+            continue
+        if should_exclude(metric_name, skip_patterns):
+            continue
+        sources.setdefault(metric_name, []).append((metric, entries))
+
+    flattened = {}
+    for metric_name, metric_sources in sources.items():
+        values_sources = []
+        for _, entries in metric_sources:
+            if isinstance(entries, MetricSeries):
+                # Series keep churn and garbage collection datapoints aside, they aren't in the columns
+                if entries.field_sets:
+                    break
+            else:
+                entries = [entry for entry in entries if not is_noise(entry)]
+                if not all("value" in entry for entry in entries):
+                    break
+            values_sources.append(entries)
+        else:
+            flatten_values(metric_name, values_sources, flattened)
+            continue
+        # Metrics without value, such as quantiles, are lists of documents rather than numbers
+        output = {"metrics": {}}
+        for metric, entries in metric_sources:
+            process_json(metric, entries, skip_patterns, output)
+        flatten_json(flattened, recursively_flatten_values(normalize_metrics(output["metrics"].items())))
+    return add_metadata(flattened, metrics_data)
+
+
+def flatten_values(metric_name: str, sources: List[Union[List[Dict], MetricSeries]], flattened: Dict) -> None:
+    """Reduces the datapoints of the metrics sharing a metricName to their flattened columns
+
+    Datapoints are first halved and summed per label set, as process_json does, aggregated values
+    are kept whole. Label sets are then nested by the NEST_ORDER labels they have, and the label
+    sets landing in the same node are folded with the running (a + b) / 2 average of normalize_metrics.
+    """
+    # Label columns: every label set is coded by order of appearance, process_json keeps the
+    # label sets of each metric apart, so they're only folded once nested
+    group_labels = []
+    codes = []
+    values = []
+    for entries in sources:
+        offset = len(group_labels)
+        if isinstance(entries, MetricSeries):
+            codes.append(np.array(entries.codes, dtype=np.intp) + offset)
+            group_labels.extend(labels or {} for _, _, labels in entries.label_sets)
+            series_values = np.frombuffer(entries.values, dtype=np.float64)
+            values.append(series_values if entries.reduction else series_values / 2)
+            continue
+        group_index = {}
+        entry_codes = np.empty(len(entries), dtype=np.intp)
+        for idx, entry in enumerate(entries):
+            labels = entry.get("labels")
+            identity = label_identity(labels)[0] if labels else None
+            code = group_index.get(identity)
+            if code is None:
+                code = group_index[identity] = len(group_labels)
+                group_labels.append(labels or {})
+            entry_codes[idx] = code
+        codes.append(entry_codes)
+        values.append(np.fromiter((datapoint_value(entry) for entry in entries), dtype=np.float64, count=len(entries)))
+    if not group_labels:
+        return
+    codes = np.concatenate(codes)
+    group_values = np.bincount(codes, weights=np.concatenate(values), minlength=len(group_labels))
+
+    # Nest the label sets by their NEST_ORDER labels
+    path_index = {}
+    paths = []
+    path_codes = np.empty(len(group_labels), dtype=np.intp)
+    for idx, labels in enumerate(group_labels):
+        path = tuple((key, labels[key]) for key in NEST_ORDER if key in labels)
+        code = path_index.get(path)
+        if code is None:
+            code = path_index[path] = len(paths)
+            paths.append(path)
+        path_codes[idx] = code
+
+    # Folding v1..vn with (a + b) / 2 weights v1 by 2^-(n-1) and vk by 2^-(n-k+1)
+    counts = np.bincount(path_codes)
+    order = np.argsort(path_codes, kind="stable")
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rank = np.empty_like(path_codes)
+    rank[order] = np.arange(len(path_codes)) - starts[path_codes[order]]
+    weights = np.exp2(-(counts[path_codes] - np.maximum(rank, 1)).astype(np.float64))
+    path_values = np.bincount(path_codes, weights=group_values * weights, minlength=len(paths))
+
+    # A node holding both a value and nested labels is flattened as <node>__value
+    parents = {path[:depth] for path in paths for depth in range(len(path))}
+    for code, path in enumerate(paths):
+        name = metric_name + "".join(f"_byLabel{key.capitalize()}_{value}" for key, value in path)
+        flattened[f"{name}__value" if path in parents else name] = float(path_values[code])
@@ -0,0 +1,257 @@
+"""Long-running collection exporting new runs as they're indexed."""
+
+import json
+import time
+import calendar
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+from data_collector.checkpoint import Checkpoint
+from data_collector.constants import CHUNK_SIZE, WATCH_FLUSH_SECONDS, WATCH_INTERVAL, WATCH_LOOKBACK, WATCH_STALE_POLLS
+from data_collector.instrumentation import recorder
+from data_collector.pipeline import ChunkExporter, normalize_runs
+from data_collector.source import Source
+from data_collector.utils import split_list_into_chunks
+
+logger = logging.getLogger(__name__)
+
+
+class Watcher:
+    """Polls a source for new runs and exports them in chunks, until stopped"""
+
+    def __init__(
+        self,
+        source: Source,
+        exporter: ChunkExporter,
+        checkpoint: Checkpoint,
+        exclude_metrics: str,
+        from_date: datetime,
+        interval: float = WATCH_INTERVAL,
+        lookback: float = WATCH_LOOKBACK,
+        flush_rows: int = CHUNK_SIZE,
+        flush_seconds: float = WATCH_FLUSH_SECONDS,
+        workers: int = 1,
+        engine: str = "python",
+        prefix: Callable[[datetime], str] = None,
+    ):
+        """Init method for instance variables"""
+        # The source, its connections and the uploader are created once and reused by every poll
+        self.source = source
+        self.exporter = exporter
+        # Names the prefix of the chunks flushed on a day, so every day has its own manifest
+        self.prefix = prefix
+        self.checkpoint = checkpoint
+        self.exclude_metrics = exclude_metrics
+        self.from_date = calendar.timegm(from_date.utctimetuple())
+        self.interval = interval
+        self.lookback = lookback
+        self.chunk_rows = max(1, min(flush_rows, CHUNK_SIZE))
+        self.flush_seconds = flush_seconds
+        self.workers = workers
+        self.engine = engine
+        # Worker processes are started once and reused by every poll
+        self.executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.stopping = threading.Event()
+        # (uuid, sort key, row) of the collected runs waiting for a flush, and when the oldest one arrived
+        self.pending: List[Tuple[str, list, Dict]] = []
+        self.pending_since: Optional[float] = None
+        # A failed flush is retried one interval later at the earliest
+        self.retry_at = 0.0
+        # End of the last poll, in epoch seconds. The checkpoint watermark is the end of the last poll whose
+        # runs are all uploaded, a restarted watcher exports again the runs it buffered but didn't upload
+        self.polled_until: Optional[float] = checkpoint.watermark
+        # End of the poll that collected each exported UUID, UUIDs of previous executions were collected before it started
+        started = time.time()
+        self.collected = {uuid: started for uuid in checkpoint.uuids}
+        self.started = started
+        self.last_poll: Optional[float] = None
+        self.last_success: Optional[float] = None
+        # Last run collected, chunk uploaded or poll completed, a long poll making progress is healthy
+        self.last_progress: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.failures = 0
+        self.exported_runs = 0
+
+    def run(self) -> None:
+        """Polls and flushes until stopped, the pending rows are flushed before returning"""
+        logger.info(
+            f"Watching for new runs every {self.interval}s, looking back {self.lookback}s, "
+            f"flushing every {self.chunk_rows} rows or {self.flush_seconds}s"
+        )
+        next_poll = time.monotonic()
+        try:
+            while not self.stopping.is_set():
+                if time.monotonic() >= next_poll:
+                    next_poll = time.monotonic() + self.interval
+                    self._guarded(self.poll)
+                if self._flush_due():
+                    self._guarded(self.flush)
+                deadline = next_poll
+                if self.pending_since is not None:
+                    deadline = min(deadline, max(self.pending_since + self.flush_seconds, self.retry_at))
+                self.stopping.wait(max(0.0, deadline - time.monotonic()))
+        finally:
+            try:
+                self.flush(force=True)
+            finally:
+                if self.executor:
+                    self.executor.shutdown()
+        logger.info(f"Stopped watching, {self.exported_runs} runs exported")
+
+    def stop(self) -> None:
+        """Makes run() return after the current poll or flush"""
+        self.stopping.set()
+
+    def _guarded(self, step) -> None:
+        """Runs a poll or a flush, failures are reported and the step is retried later"""
+        try:
+            step()
+            self.failures = 0
+            self.last_error = None
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            recorder.incr("watch_failures")
+            logger.exception(f"Watch {step.__name__} failed ({self.failures} in a row)")
+
+    def poll(self) -> None:
+        """Collects and normalizes the runs indexed since the previous poll"""
+        to = float(int(time.time()))
+        start = self.from_date
+        if self.polled_until is not None:
+            # Runs indexed late with an older timestamp are looked for lookback seconds further back
+            start = max(start, self.polled_until - self.lookback)
+        self.last_poll = time.time()
+        if start < to:
+            skip_uuids = self.checkpoint.uuids | {uuid for uuid, _, _ in self.pending}
+            runs = self.source.collect(
+                datetime.utcfromtimestamp(start), datetime.utcfromtimestamp(to), skip_uuids=skip_uuids
+            )
+            with recorder.span("watch_poll"):
+                for uuid, sort, row in normalize_runs(runs, self.exclude_metrics, self.workers, self.engine, self.executor):
+                    if self.pending_since is None:
+                        self.pending_since = time.monotonic()
+                    self.pending.append((uuid, sort, row))
+                    self.collected[uuid] = to
+                    self.last_progress = time.time()
+                    recorder.incr("watch_runs")
+                    # Full chunks are uploaded while collecting, so a long backfill isn't held in memory
+                    if len(self.pending) >= self.chunk_rows:
+                        self.flush()
+        self.polled_until = to
+        self.last_success = self.last_progress = time.time()
+        recorder.incr("watch_polls")
+        if not self.pending:
+            self._advance()
+
+    def flush(self, force: bool = False) -> None:
+        """Uploads the pending rows in chunks, a partial chunk only once it waited flush_seconds or when forced"""
+        count = len(self.pending) if force or self._flush_due() else len(self.pending) // self.chunk_rows * self.chunk_rows
+        if not count:
+            return
+        batch, self.pending = self.pending[:count], self.pending[count:]
+        try:
+            # No upload is scheduled between flushes, so the exporter can move to the prefix of the day
+            prefix = self.prefix(datetime.utcnow()) if self.prefix else self.exporter.prefix
+            if prefix != self.exporter.prefix:
+                self.exporter.rotate(prefix)
+            for chunk in split_list_into_chunks(batch, self.chunk_rows):
+                self.exporter.write(chunk)
+            self.exporter.drain()
+        except Exception:
+            self.exporter.discard()
+            self.retry_at = time.monotonic() + self.interval
+            # Chunks recorded in the checkpoint are in the bucket, the rows of the others are retried
+            self.pending = [item for item in batch if item[0] not in self.checkpoint.uuids] + self.pending
+            raise
+        self.exported_runs += count
+        self.last_progress = time.time()
+        if not self.pending:
+            self.pending_since = None
+            self._advance()
+
+    def _flush_due(self) -> bool:
+        """Pending rows are flushed once the oldest one waited flush_seconds"""
+        if self.pending_since is None:
+            return False
+        return time.monotonic() >= max(self.pending_since + self.flush_seconds, self.retry_at)
+
+    def _advance(self) -> None:
+        """Moves the watermark to the end of the last poll, every run it collected being uploaded"""
+        if self.polled_until is None:
+            return
+        # A UUID collected before the start of every later poll can't be matched again
+        cutoff = self.polled_until - self.lookback
+        forget = [uuid for uuid, collected in self.collected.items() if collected < cutoff]
+        for uuid in forget:
+            del self.collected[uuid]
+        self.checkpoint.advance(self.polled_until, forget)
+
+    def status(self) -> Dict:
+        """Returns the state of the watcher, unhealthy once it keeps failing or stops making progress"""
+        # No progress or no row uploaded for WATCH_STALE_POLLS intervals past their due time
+        grace = WATCH_STALE_POLLS * self.interval
+        stale_poll = time.time() - (self.last_progress or self.started) > grace
+        stale_rows = self.pending_since is not None and time.monotonic() - self.pending_since > self.flush_seconds + grace
+        return {
+            "healthy": not stale_poll and not stale_rows and self.failures < WATCH_STALE_POLLS,
+            "started": _isoformat(self.started),
+            "last_poll": _isoformat(self.last_poll),
+            "last_success": _isoformat(self.last_success),
+            "last_progress": _isoformat(self.last_progress),
+            "consecutive_failures": self.failures,
+            "last_error": self.last_error,
+            "watermark": _isoformat(self.checkpoint.watermark),
+            "pending_rows": len(self.pending),
+            "exported_runs": self.exported_runs,
+            "chunks": self.checkpoint.chunks,
+        }
+
+
+def _isoformat(epoch: Optional[float]) -> Optional[str]:
+    return datetime.utcfromtimestamp(epoch).strftime("%Y-%m-%dT%H:%M:%SZ") if epoch is not None else None
+
+
+class HealthServer:
+    """Serves the watcher status as JSON on /healthz and the recorded metrics in the Prometheus text format on /metrics"""
+
+    def __init__(self, watcher: Watcher, port: int, host: str = ""):
+        """Init method for instance variables"""
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/healthz":
+                    # 503 while the watcher is unhealthy, so it can back liveness probes
+                    status = watcher.status()
+                    self._reply(200 if status["healthy"] else 503, "application/json", json.dumps(status))
+                elif self.path == "/metrics":
+                    self._reply(200, "text/plain; version=0.0.4", recorder.prometheus())
+                else:
+                    self._reply(404, "text/plain", "Not found\n")
+
+            def _reply(self, code: int, content_type: str, body: str) -> None:
+                data = body.encode()
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logger.debug(f"{self.address_string()} {format % args}")
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="health-server", daemon=True)
+
+    def start(self) -> None:
+        """Serves requests from a background thread"""
+        self.thread.start()
+        logger.info(f"Serving /healthz and /metrics on port {self.server.server_address[1]}")
+
+    def close(self) -> None:
+        """Stops serving requests"""
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,95 @@
+"""Output formats for the exported chunks."""
+
+import io
+import csv
+import json
+import logging
+from typing import BinaryIO, Dict, List
+from data_collector.constants import CHUNK_SIZE
+from data_collector.schema import infer_dtype
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# pyarrow type factories of the schema types
+PYARROW_TYPES = {
+    "bool": "bool_",
+    "int64": "int64",
+    "float64": "float64",
+}
+
+
+class CSVWriter:
+    """Writes rows as a CSV file with the given header"""
+
+    extension = "csv"
+    compressible = True
+
+    def write(self, fileobj: BinaryIO, rows: List[Dict], fieldnames: List[str], dtypes: Dict = None) -> None:
+        """Writes the rows to a binary file object, CSV cells aren't typed"""
+        text = io.TextIOWrapper(fileobj, encoding="utf-8", newline="")
+        writer = csv.DictWriter(text, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+        text.flush()
+        # Detach so closing the wrapper doesn't close the caller's file object
+        text.detach()
+
+
+class ParquetWriter:
+    """Writes rows as a zstd compressed Parquet file with typed columns"""
+
+    extension = "parquet"
+    # Parquet pages are already compressed
+    compressible = False
+
+    def __init__(self):
+        """Init method for instance variables"""
+        if pyarrow is None:
+            raise ImportError("The parquet output format requires pyarrow, install it with: pip install data_collector[parquet]")
+
+    def write(self, fileobj: BinaryIO, rows: List[Dict], fieldnames: List[str], dtypes: Dict = None) -> None:
+        """Writes the rows to a binary file object
+
+        dtypes fixes the type of the columns, as registered in a schema, the others are inferred from the rows.
+        """
+        dtypes = dtypes or {}
+        columns = {name: self._column([row.get(name) for row in rows], dtypes.get(name)) for name in fieldnames}
+        table = pyarrow.table(columns)
+        pyarrow.parquet.write_table(table, fileobj, compression="zstd", row_group_size=CHUNK_SIZE)
+
+    @staticmethod
+    def _column(values: list, dtype: str = None) -> "pyarrow.Array":
+        """Builds a typed column: booleans and numbers keep their type, anything else is a string"""
+        # Columns without any value are float columns of nulls
+        dtype = dtype or infer_dtype(values) or "float64"
+        if dtype == "string":
+            return pyarrow.array([_to_str(value) for value in values], type=pyarrow.string())
+        return pyarrow.array(values, type=getattr(pyarrow, PYARROW_TYPES[dtype])())
+
+
+def _to_str(value) -> str:
+    """Converts a cell to string, nested values are serialized as JSON"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+    return str(value)
+
+
+WRITERS = {
+    "csv": CSVWriter,
+    "parquet": ParquetWriter,
+}
+
+
+def get_writer(output_format: str):
+    """Returns a writer instance for the given output format"""
+    if output_format not in WRITERS:
+        raise ValueError(f"Unknown output format {output_format}, valid formats are: {', '.join(WRITERS)}")
+    return WRITERS[output_format]()
@@ -3,20 +3,111 @@
 import os
 import sys
 import logging
+import signal
 import argparse
+import functools
 import urllib3
-import csv
+from contextlib import nullcontext
 from data_collector import __version__, collector
+from data_collector.cache import MetricCache
+from data_collector.checkpoint import Checkpoint
 from data_collector.config import Config
-from data_collector.normalize import normalize
-from data_collector.s3 import upload_csv_to_s3
-from data_collector.utils import split_list_into_chunks, parse_timerange
-from data_collector.constants import S3_BUCKET, CHUNK_SIZE, VALID_LOG_LEVELS
+from data_collector.instrumentation import profile, recorder
+from data_collector.local import LocalSource
+from data_collector.pipeline import ENGINES, ChunkExporter, normalize_runs, export_rows, merge_shards, watch_prefix
+from data_collector.s3 import S3Uploader
+from data_collector.schema import SchemaRegistry
+from data_collector.shard import SHARD_STRATEGIES, shard_location, shard_window
+from data_collector.utils import parse_timerange
+from data_collector.watch import HealthServer, Watcher
+from data_collector.writers import WRITERS
+from data_collector.constants import (
+    CHUNK_SIZE,
+    HEALTH_PORT,
+    PIT_KEEP_ALIVE,
+    S3_BUCKET,
+    VALID_LOG_LEVELS,
+    WATCH_FLUSH_SECONDS,
+    WATCH_INTERVAL,
+    WATCH_LOOKBACK,
+)
 from data_collector.logging import configure_logging
 import datetime
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+def add_export_arguments(parser):
+    """Adds the fetch, normalization and export options shared by collect and watch"""
+    parser.add_argument("--config", action="store", help="Configuration file")
+    parser.add_argument(
+        "--batch-metrics",
+        action="store_true",
+        help="Fetch the metrics of every jobSummary page with a single query instead of one query per UUID",
+    )
+    parser.add_argument(
+        "--concurrency",
+        action="store",
+        help="Maximum number of metric queries running in parallel",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--slices",
+        action="store",
+        help="Number of slices each metrics scroll is split into, consumed in parallel",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--schema",
+        action="store",
+        help="Schema registry location, a local file or an s3://bucket/key URI, fixing the header and column types of every chunk. "
+        "Concurrent collections, such as shards, can't share a registry",
+    )
+    parser.add_argument(
+        "--skip-excluded-metrics",
+        action="store_true",
+        help="Don't fetch the metrics matching exclude_normalization, they never reach the output",
+    )
+    parser.add_argument(
+        "--workers",
+        action="store",
+        help="Number of processes normalizing runs in parallel",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--engine",
+        action="store",
+        help="Normalization engine, numpy requires the numpy package",
+        choices=list(ENGINES),
+        default="python",
+    )
+    parser.add_argument(
+        "--output-format",
+        action="store",
+        help="Output format of the chunks, overrides the output_format setting of the configuration file (default: csv)",
+        choices=list(WRITERS),
+    )
+    parser.add_argument(
+        "--gzip",
+        action="store_true",
+        help="Gzip the uploaded chunks, formats with built-in compression are left untouched",
+    )
+    parser.add_argument(
+        "--upload-concurrency",
+        action="store",
+        help="Maximum number of chunks uploaded in parallel",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--s3-endpoint",
+        action="store",
+        help="S3 endpoint URL, for S3 compatible stores such as MinIO",
+        default=os.environ.get("S3_ENDPOINT"),
+    )
+
 def main():
     """Console script for data_collector."""
     parser = argparse.ArgumentParser()
@@ -27,11 +118,84 @@ def main():
                         default=os.environ.get("LOG_LEVEL", "INFO").upper(), 
                         help="Logging level (e.g., DEBUG, INFO, WARNING, ERROR, CRITICAL). Can also be set via LOG_LEVEL env var"
     )
+    parser.add_argument(
+        "--report",
+        action="store",
+        help="Write per-stage timings, request histograms and counters at exit, as a Prometheus textfile for .prom paths and JSON otherwise",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store",
+        help="Profile the execution, with pyinstrument for .html paths and cProfile otherwise",
+    )
     sub_parsers = parser.add_subparsers(dest="command")
     collect = sub_parsers.add_parser("collect", help="Collect ES data")
-    collect.add_argument("--es-server", action="store", help="ES Server endpoint", required=True)
-    collect.add_argument("--es-index", action="store", help="ES Index name", required=True)
-    collect.add_argument("--config", action="store", help="Configuration file")
+    collect.add_argument("--es-server", action="store", help="ES Server endpoint")
+    collect.add_argument("--es-index", action="store", help="ES Index name")
+    collect.add_argument(
+        "--source-dir",
+        action="append",
+        help="Collect from local kube-burner metric files and _search NDJSON exports, optionally gzip or zstd compressed, "
+        "instead of OpenSearch. Accepts files and directories and can be repeated",
+    )
+    collect.add_argument(
+        "--spool-dir",
+        action="store",
+        help="Directory of the spool file the documents of compressed and JSON array files are indexed in, "
+        "defaults to the system temporary directory",
+    )
+    add_export_arguments(collect)
+    collect.add_argument(
+        "--pit",
+        action="store_true",
+        help="Page through the jobSummary documents within a point in time, so runs indexed meanwhile don't shift the pages",
+    )
+    collect.add_argument(
+        "--pit-keep-alive",
+        action="store",
+        help="Seconds the point in time is kept alive between two jobSummary pages, grown with the time pages take",
+        type=int,
+        default=PIT_KEEP_ALIVE,
+    )
+    collect.add_argument(
+        "--checkpoint",
+        action="store",
+        help="Checkpoint location, a local file or an s3://bucket/key URI, to resume from and update while exporting, "
+        "suffixed with _shard_<index>_of_<shards> for each shard",
+    )
+    collect.add_argument(
+        "--cache-dir",
+        action="store",
+        help="Directory of the local cache of raw metric documents, disabled by default",
+    )
+    collect.add_argument(
+        "--cache-size",
+        action="store",
+        help="Maximum size of the metric cache, in MiB",
+        type=int,
+        default=1024,
+    )
+    collect.add_argument(
+        "--shards",
+        action="store",
+        help="Number of shards the time range is split into, each one collected by its own process",
+        type=int,
+        default=1,
+    )
+    collect.add_argument(
+        "--shard-index",
+        action="store",
+        help="Index of the shard collected by this process, from 0 to shards - 1",
+        type=int,
+        default=0,
+    )
+    collect.add_argument(
+        "--shard-by",
+        action="store",
+        help="Split the time range in windows of the same length, or holding about the same number of runs",
+        choices=SHARD_STRATEGIES,
+        default="time",
+    )
     collect.add_argument(
         "--from",
         action="store",
@@ -47,29 +211,221 @@ def main():
         type=int,
         default=datetime.datetime.now(datetime.UTC).timestamp(),
     )
+    merge = sub_parsers.add_parser("merge", help="Merge the manifests of a sharded collection")
+    merge.add_argument("--config", action="store", help="Configuration file")
+    merge.add_argument("--shards", action="store", help="Number of shards of the collection", type=int, required=True)
+    merge.add_argument(
+        "--s3-endpoint",
+        action="store",
+        help="S3 endpoint URL, for S3 compatible stores such as MinIO",
+        default=os.environ.get("S3_ENDPOINT"),
+    )
+    merge.add_argument(
+        "--from",
+        action="store",
+        help="Start date of the collection, in epoch seconds",
+        required=True,
+        type=int,
+        dest="from_date",
+    )
+    merge.add_argument(
+        "--to",
+        action="store",
+        help="End date of the collection, in epoch seconds",
+        required=True,
+        type=int,
+    )
+    watch = sub_parsers.add_parser("watch", help="Export new runs continuously, as they're indexed")
+    watch.add_argument("--es-server", action="store", help="ES Server endpoint", required=True)
+    watch.add_argument("--es-index", action="store", help="ES Index name", required=True)
+    add_export_arguments(watch)
+    watch.add_argument(
+        "--checkpoint",
+        action="store",
+        help="Checkpoint location, a local file or an s3://bucket/key URI, holding the watermark and the exported UUIDs",
+        required=True,
+    )
+    watch.add_argument(
+        "--from",
+        action="store",
+        help="Date the watch collection starts at, in epoch seconds, a restarted watch resumes from its watermark",
+        required=True,
+        type=int,
+        dest="from_date",
+    )
+    watch.add_argument(
+        "--interval",
+        action="store",
+        help="Seconds between two polls for new runs",
+        type=float,
+        default=WATCH_INTERVAL,
+    )
+    watch.add_argument(
+        "--lookback",
+        action="store",
+        help="Seconds each poll looks back past the previous one, for runs indexed late with an older timestamp",
+        type=float,
+        default=WATCH_LOOKBACK,
+    )
+    watch.add_argument(
+        "--flush-rows",
+        action="store",
+        help="Rows of a chunk, a chunk is uploaded as soon as it's full",
+        type=int,
+        default=CHUNK_SIZE,
+    )
+    watch.add_argument(
+        "--flush-seconds",
+        action="store",
+        help="Seconds a row waits for its chunk to fill up before a partial chunk is uploaded",
+        type=float,
+        default=WATCH_FLUSH_SECONDS,
+    )
+    watch.add_argument(
+        "--health-port",
+        action="store",
+        help="Port serving /healthz and /metrics, 0 disables it",
+        type=int,
+        default=HEALTH_PORT,
+    )
     args = parser.parse_args()
+    if args.command == "collect" and not 0 <= args.shard_index < args.shards:
+        parser.error("--shard-index must be between 0 and --shards - 1")
+    if args.command == "collect" and not args.source_dir and not (args.es_server and args.es_index):
+        parser.error("--es-server and --es-index are required unless --source-dir is given")
+    if args.command == "collect" and args.schema and args.shards > 1:
+        # Registry saves are last-writer-wins, concurrent shards would drop each other's columns
+        parser.error("--schema can't be shared by the shards of a collection, use it with --shards 1")
     configure_logging(args.log_level)
     logger = logging.getLogger(__name__)
     logger.info(f"CLI args: {args}")
-    from_date, to = parse_timerange(args.from_date, args.to)
-    normalized_rows = []
-    if args.command == "collect":
-        config = Config(args.config)
-        logger.debug(f"Processing input configuration: {config}")
-        input_config = config.parse()
-        collector_instance = collector.Collector(args.es_server, args.es_index, input_config)
-        data = collector_instance.collect(from_date, to)
-        for each_run in data:
-            for _, run_json in each_run.items():
-                normalized_json = normalize(run_json, ",".join(input_config["exclude_normalization"]))
-                normalized_rows.append(normalized_json)
-    # Write to CSV
-    if normalized_rows:
-        fieldnames = sorted(set().union(*normalized_rows))
-        for idx, chunk in enumerate(split_list_into_chunks(normalized_rows, CHUNK_SIZE), start=1):
-            filename = f"{input_config['output_prefix']}_{from_date.strftime('%Y-%m-%dT%H:%M:%SZ')}_{to.strftime('%Y-%m-%dT%H:%M:%SZ')}_chunk_{idx}.csv"
-            upload_csv_to_s3(chunk, fieldnames, S3_BUCKET, input_config["benchmark"], filename)
+    # The watch mode serves the recorded metrics, recording never serializes every document
+    recorder.enabled = bool(args.report) or args.command == "watch"
+    try:
+        with profile(args.profile) if args.profile else nullcontext():
+            if args.command == "collect":
+                run_collect(args, logger)
+            elif args.command == "merge":
+                run_merge(args, logger)
+            elif args.command == "watch":
+                run_watch(args, logger)
+    finally:
+        if args.report:
+            recorder.write(args.report)
     return 0
 
+def run_collect(args, logger):
+    """Collects, normalizes and exports the runs of the requested time range"""
+    from_date, to = parse_timerange(args.from_date, args.to)
+    config = Config(args.config)
+    logger.debug(f"Processing input configuration: {config}")
+    input_config = config.parse()
+    if args.source_dir:
+        collector_instance = LocalSource(
+            args.source_dir, input_config, skip_excluded=args.skip_excluded_metrics, spool_dir=args.spool_dir
+        )
+    else:
+        collector_instance = collector.Collector(
+            args.es_server,
+            args.es_index,
+            input_config,
+            batch_metrics=args.batch_metrics,
+            concurrency=args.concurrency,
+            cache=MetricCache(args.cache_dir, args.cache_size * 1024 * 1024) if args.cache_dir else None,
+            pit=args.pit,
+            slices=args.slices,
+            skip_excluded=args.skip_excluded_metrics,
+            pit_keep_alive=args.pit_keep_alive,
+        )
+    shard = None
+    window_start, window_end = from_date, to
+    if args.shards > 1:
+        shard = (args.shard_index, args.shards)
+        window_start, window_end = shard_window(
+            collector_instance, from_date, to, args.shards, args.shard_index, args.shard_by
+        )
+        logger.info(f"Collecting shard {args.shard_index} of {args.shards}: {window_start} - {window_end}")
+    # Only the last window includes its end, a run on a boundary belongs to the next shard
+    include_end = args.shard_index == args.shards - 1
+    uploader = S3Uploader(S3_BUCKET, args.s3_endpoint, args.gzip, args.upload_concurrency)
+    checkpoint_location = args.checkpoint
+    if checkpoint_location and shard:
+        # Every shard resumes its own window
+        checkpoint_location = shard_location(checkpoint_location, *shard)
+    checkpoint = Checkpoint(checkpoint_location, uploader.client).load() if checkpoint_location else None
+    if checkpoint:
+        runs = collector_instance.collect(
+            window_start, window_end, checkpoint.search_after, checkpoint.uuids, include_end=include_end
+        )
+    else:
+        runs = collector_instance.collect(window_start, window_end, include_end=include_end)
+    # Runs are normalized and written as they stream in, so memory stays bounded by CHUNK_SIZE
+    rows = normalize_runs(runs, ",".join(input_config["exclude_normalization"]), args.workers, args.engine)
+    output_format = args.output_format or input_config.get("output_format", "csv")
+    schema = SchemaRegistry(args.schema, uploader.client).load() if args.schema else None
+    try:
+        with recorder.span("collect"):
+            export_rows(rows, input_config, from_date, to, checkpoint, output_format, uploader, shard, schema)
+    finally:
+        uploader.close()
+        collector_instance.close()
+
+def run_merge(args, logger):
+    """Publishes the merged manifest of a sharded collection"""
+    from_date, to = parse_timerange(args.from_date, args.to)
+    input_config = Config(args.config).parse()
+    uploader = S3Uploader(S3_BUCKET, args.s3_endpoint)
+    try:
+        merge_shards(input_config, from_date, to, args.shards, uploader)
+    finally:
+        uploader.close()
+
+def run_watch(args, logger):
+    """Exports the new runs every poll until interrupted, with the same clients for the whole execution"""
+    from_date = datetime.datetime.utcfromtimestamp(args.from_date)
+    input_config = Config(args.config).parse()
+    collector_instance = collector.Collector(
+        args.es_server,
+        args.es_index,
+        input_config,
+        batch_metrics=args.batch_metrics,
+        concurrency=args.concurrency,
+        slices=args.slices,
+        skip_excluded=args.skip_excluded_metrics,
+    )
+    uploader = S3Uploader(S3_BUCKET, args.s3_endpoint, args.gzip, args.upload_concurrency)
+    checkpoint = Checkpoint(args.checkpoint, uploader.client).load()
+    output_format = args.output_format or input_config.get("output_format", "csv")
+    schema = SchemaRegistry(args.schema, uploader.client).load() if args.schema else None
+    prefix = functools.partial(watch_prefix, input_config, from_date)
+    exporter = ChunkExporter(input_config, prefix(datetime.datetime.utcnow()), checkpoint, output_format, uploader, schema)
+    watcher = Watcher(
+        collector_instance,
+        exporter,
+        checkpoint,
+        ",".join(input_config["exclude_normalization"]),
+        from_date,
+        interval=args.interval,
+        lookback=args.lookback,
+        flush_rows=args.flush_rows,
+        flush_seconds=args.flush_seconds,
+        workers=args.workers,
+        engine=args.engine,
+        prefix=prefix,
+    )
+    server = HealthServer(watcher, args.health_port) if args.health_port else None
+    # Interrupts and the SIGTERM of service managers stop the watcher once the pending rows are uploaded
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: watcher.stop())
+    try:
+        if server:
+            server.start()
+        watcher.run()
+    finally:
+        if server:
+            server.close()
+        uploader.close()
+        collector_instance.close()
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -8,7 +8,18 @@ requirements = []
 
 setup_requirements = []
 
-test_requirements = []
+test_requirements = ["pytest", "moto"]
+
+# Optional features, e.g. pip install data_collector[parquet]
+extras_requirements = {
+    "parquet": ["pyarrow"],
+    "numpy": ["numpy"],
+    "orjson": ["orjson"],
+    "zstd": ["zstandard"],
+    "profile": ["pyinstrument"],
+}
+extras_requirements["all"] = sorted({package for packages in extras_requirements.values() for package in packages})
+extras_requirements["test"] = test_requirements
 
 setup(
     author="Raul Sevilla",
@@ -32,6 +43,7 @@ setup(
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="Apache Software License 2.0",
     include_package_data=True,
     keywords="data_collector",
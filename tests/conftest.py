@@ -0,0 +1,19 @@
+"""Fixtures shared by the tests."""
+
+import boto3
+import pytest
+from moto import mock_aws
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Client of moto's in-memory S3, with an empty bucket"""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
@@ -0,0 +1,108 @@
+"""Aggregated metrics are exported with their declared reduction, on every normalization engine."""
+
+import os
+import json
+import pytest
+from datetime import datetime
+from benchmarks.mock_opensearch import MockOpenSearch
+from data_collector.collector import Collector
+from data_collector.local import LocalSource
+from data_collector.normalize import MetricSeries
+from data_collector.pipeline import ENGINES
+
+BENCHMARK = "cluster-density-v2"
+FROM, TO = datetime(2025, 1, 1), datetime(2025, 1, 2)
+
+
+def config(aggregate_metrics: dict = None) -> dict:
+    return {
+        "benchmark": BENCHMARK,
+        "metadata": ["passed"],
+        "metrics": ["cpu", "podLatency"],
+        "exclude_normalization": [],
+        "output_prefix": "test",
+        "aggregate_metrics": aggregate_metrics,
+    }
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    docs = [{"uuid": "u1", "metricName": "jobSummary", "timestamp": "2025-01-01T10:00:00Z", "passed": True,
+             "jobConfig": {"name": BENCHMARK}}]
+    # Three samples of a series, and two series sharing the system mode
+    docs += [{"uuid": "u1", "metricName": "cpu", "value": 10.0, "labels": {"mode": "user"}} for _ in range(3)]
+    docs += [
+        {"uuid": "u1", "metricName": "cpu", "value": value, "labels": {"mode": "system", "pod": pod}}
+        for value, pod in ((10.0, "a"), (20.0, "b"), (30.0, "a"))
+    ]
+    # Noise, as is_noise tells it
+    docs.append({"uuid": "u1", "metricName": "cpu", "value": 1000.0, "labels": {"mode": "user"}, "churnMetric": True})
+    docs.append({"uuid": "u1", "metricName": "cpu", "value": 1000.0, "labels": {"mode": "user"}, "jobName": "Garbage-Collection"})
+    docs.append({"uuid": "u1", "metricName": "podLatency", "quantileName": "Ready", "P99": 1200})
+    with open(tmp_path / "metrics.ndjson", "w") as f:
+        f.writelines(json.dumps(doc) + "\n" for doc in docs)
+    return str(tmp_path)
+
+
+def collect(source_dir: str, aggregate_metrics: dict = None) -> dict:
+    source = LocalSource([source_dir], config(aggregate_metrics))
+    try:
+        runs = list(source.collect(FROM, TO))
+    finally:
+        source.close()
+    assert len(runs) == 1
+    return runs[0]["u1"]
+
+
+def columns(row: dict) -> dict:
+    return {key: value for key, value in row.items() if key.startswith("cpu")}
+
+
+@pytest.mark.parametrize("engine", list(ENGINES))
+@pytest.mark.parametrize(
+    "function, user, system",
+    [("avg", 10.0, 20.0), ("max", 10.0, 30.0), ("min", 10.0, 10.0), ("sum", 30.0, 60.0)],
+)
+def test_aggregated_values_are_not_halved(source_dir, engine, function, user, system):
+    if engine == "numpy":
+        pytest.importorskip("numpy")
+    run = collect(source_dir, {"cpu": function, "podLatency": "avg"})
+    assert run["metrics"]["cpu"].reduction == function
+    row = ENGINES[engine](run, "")
+    assert columns(row) == {"cpu_byLabelMode_user": user, "cpu_byLabelMode_system": system}
+
+
+@pytest.mark.parametrize("engine", list(ENGINES))
+def test_raw_values_are_halved(source_dir, engine):
+    if engine == "numpy":
+        pytest.importorskip("numpy")
+    row = ENGINES[engine](collect(source_dir), "")
+    # Label sets a and b of the system mode are folded: ((10 + 30) / 2 + 20 / 2) / 2
+    assert columns(row) == {"cpu_byLabelMode_user": 15.0, "cpu_byLabelMode_system": 15.0}
+
+
+def test_metric_without_values_keeps_the_raw_path(source_dir):
+    run = collect(source_dir, {"podLatency": "avg"})
+    assert run["metrics"]["podLatency"].reduction is None
+    assert list(run["metrics"]["podLatency"]) == list(collect(source_dir)["metrics"]["podLatency"])
+    row = ENGINES["python"](run, "")
+    assert {key: value for key, value in row.items() if key.startswith("podLatency")}
+    assert row == ENGINES["python"](collect(source_dir), "")
+
+
+@pytest.mark.parametrize("aggregate_metrics", [{"cpu": "sum", "podLatency": "sum"}, {"podLatency": "max"}])
+def test_opensearch_aggregation_matches_local(source_dir, aggregate_metrics):
+    with open(os.path.join(source_dir, "metrics.ndjson")) as f:
+        docs = [json.loads(line) for line in f]
+    collector = Collector("http://localhost:9200", "kube-burner", config(aggregate_metrics))
+    collector.os_client = MockOpenSearch(docs)
+    runs = list(collector.collect(FROM, TO))
+    assert len(runs) == 1
+    assert ENGINES["python"](runs[0]["u1"], "") == ENGINES["python"](collect(source_dir, aggregate_metrics), "")
+
+
+def test_reduction_survives_documents(source_dir):
+    series = collect(source_dir, {"cpu": "max"})["metrics"]["cpu"]
+    restored = MetricSeries.from_documents("cpu", json.loads(json.dumps(list(series))))
+    assert restored.reduction == "max"
+    assert list(restored) == list(series)
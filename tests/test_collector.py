@@ -0,0 +1,138 @@
+"""Tests of the OpenSearch collector against the benchmark mock cluster."""
+
+import json
+import time
+import pytest
+from datetime import timedelta
+from opensearchpy.exceptions import NotFoundError, RequestError, TransportError
+from benchmarks import synthetic
+from benchmarks.mock_opensearch import MockOpenSearch
+from data_collector import collector as collector_module
+from data_collector.collector import Collector
+from data_collector.instrumentation import recorder
+
+FROM, TO = synthetic.START, synthetic.START + timedelta(days=1)
+
+
+class PitMock(MockOpenSearch):
+    """Records the keep alive of every point in time request, and expires the point in time after expire_after searches"""
+
+    def __init__(self, docs, expire_after: int = None):
+        super().__init__(docs)
+        self.keep_alives = []
+        self.expire_after = expire_after
+
+    def create_pit(self, index=None, params=None, **kwargs):
+        self.keep_alives.append(params["keep_alive"])
+        return super().create_pit(index, params, **kwargs)
+
+    def search(self, index=None, body=None, params=None, **kwargs):
+        if body and body.get("pit"):
+            self.keep_alives.append(body["pit"]["keep_alive"])
+            if self.expire_after is not None and len(self.keep_alives) > self.expire_after:
+                raise NotFoundError(404, "search_phase_execution_exception", {"error": "search_context_missing_exception"})
+        return super().search(index, body, params, **kwargs)
+
+
+def collector(mock: MockOpenSearch, **options) -> Collector:
+    instance = Collector("http://localhost:9200", "kube-burner", synthetic.config(4), pit=True, **options)
+    instance.os_client = mock
+    return instance
+
+
+def test_keep_alive_grows_with_pages():
+    mock = PitMock(synthetic.generate(runs=2, metrics=4, cardinality=2, datapoints=2))
+    runs = []
+    for run in collector(mock, pit_keep_alive=1).collect(FROM, TO):
+        runs.append(run)
+        # Runs consumed slowly hold the next page request back
+        time.sleep(0.6)
+    assert len(runs) == 2
+    assert mock.keep_alives[:2] == ["1s", "1s"]
+    assert int(mock.keep_alives[2].rstrip("s")) >= 3
+    assert mock.pits == {}
+
+
+def test_expired_pit_fails_the_collection():
+    mock = PitMock(synthetic.generate(runs=2, metrics=4, cardinality=2, datapoints=2), expire_after=2)
+    runs = []
+    with pytest.raises(NotFoundError):
+        for run in collector(mock).collect(FROM, TO):
+            runs.append(run)
+    # The runs of the first page were collected before the point in time expired
+    assert len(runs) == 2
+
+
+def test_recording_serializes_one_document_per_uuid(monkeypatch):
+    docs = synthetic.generate(runs=2, metrics=4, cardinality=2, datapoints=5)
+    dumps = []
+
+    def recording_dumps(obj, *args, **kwargs):
+        dumps.append(obj)
+        return json.JSONEncoder().encode(obj)
+
+    monkeypatch.setattr(collector_module.json, "dumps", recording_dumps)
+    monkeypatch.setattr(recorder, "enabled", True)
+    monkeypatch.setattr(recorder, "histograms", {})
+    monkeypatch.setattr(recorder, "counters", {})
+    runs = list(collector(MockOpenSearch(docs)).collect(FROM, TO))
+    assert len(runs) == 2
+    metric_docs = [doc for doc in dumps if isinstance(doc, dict) and "metricName" in doc]
+    # The first document of each uuid, and the first one of each scroll for its size
+    assert len(metric_docs) <= 2 * len(runs) < recorder.report()["counters"]["documents_fetched"]
+    histograms = recorder.report()["histograms"]
+    assert histograms["uuid_documents"]["count"] == 2
+    assert histograms["uuid_bytes"]["sum"] > 0
+
+
+def test_metrics_are_held_for_a_batch_of_runs(monkeypatch):
+    mock = MockOpenSearch(synthetic.generate(runs=30, metrics=4, cardinality=1, datapoints=1))
+    instance = collector(mock, concurrency=4)
+    instance.page_size.value = 20
+    monkeypatch.setattr(instance.page_size, "update", lambda *args: None)
+    batches = []
+    page_metrics = instance._page_metrics
+    monkeypatch.setattr(instance, "_page_metrics", lambda uuids: batches.append(len(uuids)) or page_metrics(uuids))
+    runs = instance.collect(FROM, TO)
+    next(runs)
+    # The first run is yielded once the metrics of its batch are fetched, not those of its page
+    assert batches == [4]
+    list(runs)
+    assert sum(batches) == 30
+    assert max(batches) == 4
+
+
+class FailingMock(MockOpenSearch):
+    """Fails the searches matching a predicate"""
+
+    def __init__(self, docs, error: Exception, failing):
+        super().__init__(docs)
+        self.error = error
+        self.failing = failing
+        self.failures = 0
+
+    def search(self, index=None, body=None, params=None, **kwargs):
+        if self.failing(body or {}):
+            self.failures += 1
+            raise self.error
+        return super().search(index, body, params, **kwargs)
+
+
+def test_failed_aggregation_fails_the_collection():
+    docs = synthetic.generate(runs=2, metrics=4, cardinality=2, datapoints=2)
+    mock = FailingMock(docs, RequestError(400, "search_phase_execution_exception", {}), lambda body: "aggs" in body)
+    config = synthetic.config(4)
+    instance = Collector("http://localhost:9200", "kube-burner", {**config, "aggregate_metrics": {config["metrics"][0]: "avg"}})
+    instance.os_client = mock
+    with pytest.raises(RequestError):
+        list(instance.collect(FROM, TO))
+    # Bad requests aren't retried
+    assert mock.failures == 1
+
+
+def test_exhausted_retries_fail_the_collection(monkeypatch):
+    monkeypatch.setattr("data_collector.fetch.time.sleep", lambda delay: None)
+    mock = FailingMock([], TransportError(503, "unavailable", {}), lambda body: True)
+    with pytest.raises(TransportError):
+        list(collector(mock).collect(FROM, TO))
+    assert mock.failures > 1
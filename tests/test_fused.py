@@ -0,0 +1,46 @@
+"""Golden rows of the fused normalization engine.
+
+tests/data/fused_golden.json holds runs and the rows the reference normalization produces for
+them, including the label values the fused engine hands back to the reference normalization:
+non-string values, a _value label value and label values flattening to the same column.
+"""
+
+import copy
+import json
+import os
+import pytest
+from data_collector import fused, normalize
+from data_collector.normalize import MetricSeries
+
+EXCLUDE = "alert,-start"
+
+with open(os.path.join(os.path.dirname(__file__), "data", "fused_golden.json")) as f:
+    GOLDEN = json.load(f)
+
+
+def as_series(run_json: dict) -> dict:
+    """Stores the metrics of a run as the collector does, series take the name of their datapoints"""
+    run_json = copy.deepcopy(run_json)
+    run_json["metrics"] = {
+        name: MetricSeries.from_documents(docs[0]["metricName"] if docs else name, docs)
+        for name, docs in run_json["metrics"].items()
+    }
+    return run_json
+
+
+@pytest.mark.parametrize("prepare", [copy.deepcopy, as_series], ids=["documents", "series"])
+@pytest.mark.parametrize("engine", [normalize.normalize, fused.normalize], ids=["python", "fused"])
+@pytest.mark.parametrize("case", GOLDEN, ids=[case["name"] for case in GOLDEN])
+def test_golden_rows(case, engine, prepare):
+    row = engine(prepare(case["run"]), EXCLUDE)
+    assert row == case["row"]
+    # Same cells once written: an int must not come out as a float
+    assert json.dumps(row, sort_keys=True) == json.dumps(case["row"], sort_keys=True)
+
+
+@pytest.mark.parametrize("case", ["non_string_labels", "value_label", "column_collision"])
+def test_fallback_cases_are_reference_rows(case):
+    run_json = next(golden["run"] for golden in GOLDEN if golden["name"] == case)
+    (metric_name, entries), = run_json["metrics"].items()
+    # The fused engine can't flatten these label values itself
+    assert not fused.flatten_metric(metric_name, [(metric_name, copy.deepcopy(entries))], {})
@@ -0,0 +1,63 @@
+"""The combined pattern matchers decide as the patterns matched one by one."""
+
+import re
+import pytest
+from data_collector.matchers import PatternMatcher
+from data_collector.utils import compile_exclude_patterns, remove_keys_by_patterns, should_exclude
+
+NAMES = [
+    "", "cpu", "cpu-start", "CPU", "alert", "Alert", "ALERTS", "etcdRequestLatency", "podLatency", "aa", "abab", "xbb",
+    "elapsedTime", "startTime", "uuid", "UUID", "jobUuid", "ocpVersion", "version", "k8sVersion", "passed", "foo|bar",
+]
+
+PATTERNS = [
+    ("cpu",),
+    ("^cpu$", "-start$"),
+    ("(?i)alert", "^cpu"),
+    ("(?i)^alert$", "(?s)etcd.*latency", "Latency$"),
+    ("foo|bar", "pass"),
+    # Back references change meaning once combined, the patterns are matched one by one
+    (r"(a)\1", "cpu"),
+    (r"(?P<x>b)(?P=x)", "(?i)uuid"),
+    # An empty pattern matches every name
+    ("cpu", ""),
+    (r"(?i).*time.*", r"uuid", r"version"),
+]
+
+
+@pytest.mark.parametrize("patterns", PATTERNS, ids=[",".join(patterns) for patterns in PATTERNS])
+@pytest.mark.parametrize("anchored", [False, True], ids=["search", "match"])
+def test_same_decisions_as_every_pattern(patterns, anchored):
+    matcher = PatternMatcher(patterns, anchored)
+    regexes = [re.compile(pattern) for pattern in patterns]
+    for name in NAMES:
+        if anchored:
+            expected = any(regex.match(name) for regex in regexes)
+        else:
+            expected = any(regex.search(name) for regex in regexes)
+        assert matcher.matches(name) == expected, name
+        # Cached decisions are the same
+        assert matcher.matches(name) == expected, name
+
+
+def test_patterns_are_combined_unless_they_hold_group_references():
+    assert len(PatternMatcher(("(?i)alert", "^cpu", "-start$")).regexes) == 1
+    assert len(PatternMatcher((r"(a)\1", "cpu")).regexes) == 2
+    assert len(PatternMatcher((r"(?P<x>b)(?P=x)", "cpu")).regexes) == 2
+    assert not PatternMatcher(()).matches("cpu")
+
+
+def test_exclusion_patterns():
+    patterns = compile_exclude_patterns("alert, -start,(?i)^etcd")
+    assert [name for name in NAMES if should_exclude(name, patterns)] == ["cpu-start", "alert", "etcdRequestLatency"]
+    assert not should_exclude("cpu", compile_exclude_patterns(""))
+    # An empty item of the list excludes every metric, as an empty regex does
+    assert should_exclude("cpu", compile_exclude_patterns("alert,,-start"))
+
+
+def test_key_removal_is_anchored():
+    data = {name: True for name in NAMES}
+    kept = remove_keys_by_patterns(data, [r"(?i).*time.*", r"uuid", r"version"])
+    assert "jobUuid" in kept and "ocpVersion" in kept
+    assert not {"elapsedTime", "startTime", "uuid", "version"} & kept.keys()
+    assert kept == {k: v for k, v in data.items() if not any(re.match(p, k) for p in [r"(?i).*time.*", r"uuid", r"version"])}
@@ -0,0 +1,56 @@
+"""Tests of the chunk exporter manifests against moto's in-memory S3."""
+
+import json
+from datetime import datetime
+from data_collector.checkpoint import Checkpoint
+from data_collector.pipeline import ChunkExporter, header_hash, watch_prefix
+from data_collector.s3 import S3Uploader
+from tests.conftest import BUCKET
+
+CONFIG = {"benchmark": "cluster-density-v2", "output_prefix": "test"}
+
+
+def chunk(*rows: dict) -> list:
+    return [(row["uuid"], [index], row) for index, row in enumerate(rows)]
+
+
+def read_manifest(client, prefix: str) -> dict:
+    key = f"{CONFIG['benchmark']}/{prefix}_manifest.json"
+    return json.loads(client.get_object(Bucket=BUCKET, Key=key)["Body"].read())
+
+
+def test_manifest_entries_hold_a_header_digest(client):
+    exporter = ChunkExporter(CONFIG, "run", uploader=S3Uploader(BUCKET))
+    exporter.write(chunk({"uuid": "u1", "a": 1}, {"uuid": "u2", "b": 2}))
+    exporter.write(chunk({"uuid": "u3", "a": 3}))
+    exporter.drain()
+    manifest = read_manifest(client, "run")
+    assert manifest["columns"] == ["a", "b", "uuid"]
+    assert manifest["chunks"] == [
+        {"file": "run_chunk_1.csv", "rows": 2, "header": header_hash(["a", "b", "uuid"])},
+        {"file": "run_chunk_2.csv", "rows": 1, "header": header_hash(["a", "uuid"])},
+    ]
+
+
+def test_rotated_prefix_has_its_own_manifest(client, tmp_path):
+    from_date = datetime(2025, 1, 1)
+    days = [watch_prefix(CONFIG, from_date, datetime(2025, 1, day)) for day in (1, 2)]
+    assert days == ["test_2025-01-01T00:00:00Z_watch_2025-01-01", "test_2025-01-01T00:00:00Z_watch_2025-01-02"]
+    uploader = S3Uploader(BUCKET)
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+    exporter = ChunkExporter(CONFIG, days[0], checkpoint, uploader=uploader)
+    exporter.write(chunk({"uuid": "u1", "a": 1}))
+    exporter.drain()
+    exporter.rotate(days[1])
+    exporter.write(chunk({"uuid": "u2", "a": 2}))
+    exporter.drain()
+    assert [entry["file"] for entry in read_manifest(client, days[0])["chunks"]] == [f"{days[0]}_chunk_1.csv"]
+    assert [entry["file"] for entry in read_manifest(client, days[1])["chunks"]] == [f"{days[1]}_chunk_2.csv"]
+    # A restarted exporter keeps listing the chunks of the day
+    resumed = ChunkExporter(CONFIG, days[1], Checkpoint(str(tmp_path / "checkpoint.json")).load(), uploader=uploader)
+    resumed.write(chunk({"uuid": "u3", "b": 3}))
+    resumed.drain()
+    manifest = read_manifest(client, days[1])
+    assert [entry["file"] for entry in manifest["chunks"]] == [f"{days[1]}_chunk_2.csv", f"{days[1]}_chunk_3.csv"]
+    assert manifest["columns"] == ["a", "b", "uuid"]
+    uploader.close()
@@ -0,0 +1,117 @@
+"""Tests of the S3 uploader against moto's in-memory S3."""
+
+import io
+import csv
+import gzip
+import os
+import pytest
+from data_collector.s3 import MultipartUploadStream, S3Uploader
+from data_collector.writers import CSVWriter
+from tests.conftest import BUCKET
+
+# Smallest part size S3 accepts for every part but the last one
+PART_SIZE = 5 * 1024 * 1024
+
+
+def large_rows(size: int):
+    """Rows of random hex strings, which gzip can't shrink below half their size"""
+    rows = []
+    while sum(len(row["value"]) for row in rows) < size:
+        rows.append({"uuid": str(len(rows)), "value": os.urandom(512).hex()})
+    return rows
+
+
+def read_object(client, key: str) -> bytes:
+    return client.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+
+def read_csv(data: bytes):
+    return list(csv.DictReader(io.StringIO(data.decode())))
+
+
+def pending_uploads(client):
+    return client.list_multipart_uploads(Bucket=BUCKET).get("Uploads", [])
+
+
+class FailingWriter(CSVWriter):
+    """Writes more than a part before failing"""
+
+    def write(self, fileobj, rows, fieldnames, dtypes=None):
+        fileobj.write(b"x" * (PART_SIZE + 1))
+        raise RuntimeError("serialization failed")
+
+
+class FailingClient:
+    """Client failing the upload of the second part"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def upload_part(self, **kwargs):
+        if kwargs["PartNumber"] == 2:
+            raise RuntimeError("connection reset")
+        return self.client.upload_part(**kwargs)
+
+
+def test_small_object_is_put(client):
+    stream = MultipartUploadStream(client, BUCKET, "small", PART_SIZE)
+    stream.write(b"a,b\n1,2\n")
+    stream.close()
+    assert read_object(client, "small") == b"a,b\n1,2\n"
+    assert stream.upload_id is None
+    assert pending_uploads(client) == []
+
+
+def test_chunk_larger_than_part_size(client):
+    rows = large_rows(2 * PART_SIZE + 1)
+    uploader = S3Uploader(BUCKET, part_size=PART_SIZE)
+    uploader.upload_chunk(CSVWriter(), rows, ["uuid", "value"], "folder", "chunk.csv").result()
+    uploader.close()
+    assert read_csv(read_object(client, "folder/chunk.csv")) == rows
+    # Multipart ETags end with the number of parts
+    assert client.head_object(Bucket=BUCKET, Key="folder/chunk.csv")["ETag"].strip('"').endswith("-3")
+    assert pending_uploads(client) == []
+
+
+def test_gzip_chunk_larger_than_part_size(client):
+    rows = large_rows(3 * PART_SIZE)
+    uploader = S3Uploader(BUCKET, compress=True, part_size=PART_SIZE)
+    filename = uploader.filename(CSVWriter(), "chunk")
+    assert filename == "chunk.csv.gz"
+    uploader.upload_chunk(CSVWriter(), rows, ["uuid", "value"], "folder", filename).result()
+    uploader.close()
+    assert read_csv(gzip.decompress(read_object(client, "folder/chunk.csv.gz"))) == rows
+    assert "-" in client.head_object(Bucket=BUCKET, Key="folder/chunk.csv.gz")["ETag"]
+
+
+def test_serialization_failure_aborts_upload(client):
+    uploader = S3Uploader(BUCKET, part_size=PART_SIZE)
+    future = uploader.upload_chunk(FailingWriter(), [{"uuid": "1"}], ["uuid"], "folder", "chunk.csv")
+    with pytest.raises(RuntimeError, match="serialization failed"):
+        future.result()
+    uploader.close()
+    assert pending_uploads(client) == []
+    assert client.list_objects_v2(Bucket=BUCKET).get("KeyCount") == 0
+
+
+def test_part_upload_failure_aborts_upload(client):
+    stream = MultipartUploadStream(FailingClient(client), BUCKET, "failed", PART_SIZE)
+    stream.write(b"x" * PART_SIZE)
+    assert len(pending_uploads(client)) == 1
+    with pytest.raises(RuntimeError, match="connection reset"):
+        stream.write(b"y" * 10)
+        stream.close()
+    assert stream.closed
+    assert pending_uploads(client) == []
+    assert client.list_objects_v2(Bucket=BUCKET).get("KeyCount") == 0
+
+
+def test_json_documents(client):
+    uploader = S3Uploader(BUCKET)
+    assert uploader.read_json("folder", "missing.json") is None
+    uploader.upload_json({"chunks": [1, 2]}, "folder/", "manifest.json")
+    assert uploader.read_json("folder", "manifest.json") == {"chunks": [1, 2]}
+    uploader.close()
@@ -0,0 +1,20 @@
+"""Tests of the time window sharding helpers."""
+
+from data_collector.shard import merge_manifests, shard_location
+
+
+def test_every_shard_has_its_own_checkpoint():
+    assert shard_location("checkpoint.json", 0, 4) == "checkpoint_shard_0_of_4.json"
+    assert shard_location("s3://bucket.name/state/checkpoint.json", 3, 4) == "s3://bucket.name/state/checkpoint_shard_3_of_4.json"
+    assert shard_location("s3://bucket/checkpoint", 1, 2) == "s3://bucket/checkpoint_shard_1_of_2"
+
+
+def test_merged_manifest_lists_the_chunks_in_shard_order():
+    manifests = [
+        {"columns": ["a", "uuid"], "chunks": [{"file": "shard_0_chunk_1.csv", "rows": 2}]},
+        {"columns": ["b", "uuid"], "chunks": [{"file": "shard_1_chunk_1.csv", "rows": 1}]},
+    ]
+    assert merge_manifests(manifests) == {
+        "columns": ["a", "b", "uuid"],
+        "chunks": [{"file": "shard_0_chunk_1.csv", "rows": 2}, {"file": "shard_1_chunk_1.csv", "rows": 1}],
+    }
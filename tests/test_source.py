@@ -0,0 +1,43 @@
+"""Tests of the collection source base class."""
+
+import json
+import pytest
+from datetime import datetime
+from data_collector.local import LocalSource
+from data_collector.source import Source
+
+CONFIG = {"benchmark": "cluster-density-v2", "metadata": ["passed"], "metrics": ["cpu"], "exclude_normalization": []}
+
+
+def test_incomplete_source_fails_at_construction():
+    class NoHistogram(Source):
+        def collect(self, from_date, to, search_after=None, skip_uuids=frozenset(), include_end=True):
+            return iter(())
+
+    with pytest.raises(TypeError, match="histogram"):
+        NoHistogram(CONFIG)
+
+
+def test_resume_key():
+    assert Source._resume_key(None) is None
+    assert Source._resume_key([1735725600000]) == [1735725600000, ""]
+    assert Source._resume_key([1735725600000, "u1"]) == [1735725600000, "u1"]
+
+
+def test_timestamp_only_checkpoint_resumes_at_its_first_run(tmp_path):
+    docs = []
+    for uuid, timestamp in (("u1", "2025-01-01T10:00:00Z"), ("u2", "2025-01-01T10:00:00Z"), ("u3", "2025-01-01T11:00:00Z")):
+        docs.append({"uuid": uuid, "metricName": "jobSummary", "timestamp": timestamp, "passed": True,
+                     "jobConfig": {"name": "cluster-density-v2"}})
+        docs.append({"uuid": uuid, "metricName": "cpu", "value": 1.0})
+    with open(tmp_path / "metrics.ndjson", "w") as f:
+        f.writelines(json.dumps(doc) + "\n" for doc in docs)
+    source = LocalSource([str(tmp_path)], CONFIG)
+    runs = source.collect(datetime(2025, 1, 1), datetime(2025, 1, 2), search_after=[1735725600000])
+    assert [uuid for run in runs for uuid in run] == ["u1", "u2", "u3"]
+    source.close()
+
+
+def test_unknown_reduction_is_rejected():
+    with pytest.raises(ValueError, match="Unknown reduction mean of cpu"):
+        LocalSource([], {**CONFIG, "aggregate_metrics": {"cpu": "mean"}})
@@ -0,0 +1,45 @@
+"""Checkpoints and schema registries stored in S3 go through the uploader's client."""
+
+import pytest
+from data_collector import storage
+from data_collector.checkpoint import Checkpoint
+from data_collector.s3 import S3Uploader
+from data_collector.schema import SchemaRegistry
+from tests.conftest import BUCKET
+
+
+@pytest.fixture
+def uploader(client, monkeypatch):
+    uploader = S3Uploader(BUCKET)
+    # Documents must never be read or written with a client of their own, it would miss --s3-endpoint
+    monkeypatch.setattr(storage.boto3, "client", pytest.fail)
+    yield uploader
+    uploader.close()
+
+
+def test_checkpoint_uses_the_given_client(uploader):
+    location = f"s3://{BUCKET}/state/checkpoint.json"
+    checkpoint = Checkpoint(location, uploader.client).load()
+    assert checkpoint.uuids == set()
+    checkpoint.update(["u1", "u2"], [1, "u2"])
+    checkpoint.advance(1735689600.0)
+    restored = Checkpoint(location, uploader.client).load()
+    assert (restored.uuids, restored.search_after, restored.chunks, restored.watermark) == (
+        {"u1", "u2"}, [1, "u2"], 1, 1735689600.0
+    )
+
+
+def test_schema_uses_the_given_client(uploader):
+    location = f"s3://{BUCKET}/state/schema.json"
+    schema = SchemaRegistry(location, uploader.client).load()
+    assert schema.register([{"b": 1, "a": "x"}])
+    assert schema.register([{"c": 1.5, "b": 2.5}])
+    restored = SchemaRegistry(location, uploader.client).load()
+    assert restored.version == 2
+    assert restored.columns == {"a": "string", "b": "float64", "c": "float64"}
+
+
+def test_local_documents(tmp_path):
+    location = str(tmp_path / "checkpoint.json")
+    Checkpoint(location).update(["u1"], None)
+    assert Checkpoint(location).load().uuids == {"u1"}
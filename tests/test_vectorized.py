@@ -0,0 +1,134 @@
+"""Conformance of the numpy normalization engine with the reference normalization."""
+
+import os
+import copy
+import json
+import math
+import pytest
+from data_collector import normalize, vectorized
+from data_collector.normalize import MetricSeries
+
+pytest.importorskip("numpy")
+
+EXCLUDE = "jobSummary,alert,-start"
+
+# Runs and reference rows shared with the fused engine tests
+with open(os.path.join(os.path.dirname(__file__), "data", "fused_golden.json")) as f:
+    GOLDEN = json.load(f)
+GOLDEN_EXCLUDE = "alert,-start"
+
+
+def run(metrics: dict) -> dict:
+    return {
+        "metadata": {"passed": True, "ocpVersion": "4.19.0", "uuid": "u1", "jobConfig": {"name": "cluster-density-v2"}},
+        "metrics": metrics,
+    }
+
+
+def datapoint(metric: str, value=None, **labels) -> dict:
+    doc = {"uuid": "u1", "metricName": metric, "timestamp": "2025-01-01T00:00:00Z"}
+    if value is not None:
+        doc["value"] = value
+    if labels:
+        doc["labels"] = labels
+    return doc
+
+
+def as_series(run_json: dict) -> dict:
+    """Stores the metrics of a run as the collector does, series take the name of their datapoints"""
+    run_json = copy.deepcopy(run_json)
+    run_json["metrics"] = {
+        name: MetricSeries.from_documents(docs[0]["metricName"] if docs else name, docs)
+        for name, docs in run_json["metrics"].items()
+    }
+    return run_json
+
+
+def assert_close_rows(row: dict, expected: dict) -> None:
+    """Rows must have the same columns, floats may differ by rounding"""
+    assert row.keys() == expected.keys()
+    for key, value in expected.items():
+        if isinstance(value, float):
+            assert math.isclose(row[key], value, rel_tol=1e-9, abs_tol=1e-12), key
+        else:
+            assert row[key] == value, key
+
+
+def assert_same_row(metrics: dict) -> None:
+    """Rows of both engines must be the same, on documents and on series"""
+    expected = normalize.normalize(copy.deepcopy(run(metrics)), EXCLUDE)
+    for prepare in (copy.deepcopy, as_series):
+        assert_close_rows(vectorized.normalize(prepare(run(metrics)), EXCLUDE), expected)
+
+
+def test_unlabeled_series():
+    assert_same_row({"cpu": [datapoint("cpu", value) for value in (1.0, 2.5, 4.0, 8.25)]})
+
+
+def test_labeled_series():
+    docs = [
+        datapoint("cpu", value, mode=mode, namespace=namespace)
+        for value, (mode, namespace) in enumerate([("user", "a"), ("system", "a"), ("user", "b"), ("user", "a")])
+    ]
+    assert_same_row({"cpu": docs})
+
+
+def test_partially_labeled_series():
+    docs = [
+        datapoint("cpu", 3.0),
+        datapoint("cpu", 5.0, mode="user"),
+        datapoint("cpu", 7.0, mode="user", namespace="a"),
+        datapoint("cpu", 11.0, namespace="b"),
+        datapoint("cpu", 13.0),
+    ]
+    assert_same_row({"cpu": docs})
+
+
+def test_folded_series():
+    # Label sets differing only in labels outside of NEST_ORDER share a column and are folded
+    docs = [
+        datapoint("memory", float(value), mode="user", pod=f"pod-{value % 4}", node=f"node-{value % 3}")
+        for value in range(24)
+    ]
+    docs += [datapoint("memory", float(value), pod=f"pod-{value}") for value in range(5)]
+    assert_same_row({"memory": docs})
+
+
+def test_quantile_fallback():
+    docs = [
+        {**datapoint("podLatency"), "quantileName": name, "P99": p99, "P50": p99 / 2, "avg": p99 / 3}
+        for name, p99 in (("Ready", 1200), ("PodScheduled", 30), ("Ready", 1500))
+    ]
+    docs.append({**datapoint("podLatency", namespace="a"), "quantileName": "Ready", "P99": 900})
+    assert_same_row({"podLatency": docs, "cpu": [datapoint("cpu", 1.0, mode="user")]})
+
+
+def test_noise_is_skipped():
+    docs = [
+        datapoint("cpu", 1.0, mode="user"),
+        {**datapoint("cpu", 100.0, mode="user"), "churnMetric": True},
+        {**datapoint("cpu", 100.0, mode="user"), "jobName": "Garbage-Collection"},
+        datapoint("cpu", 3.0, mode="user"),
+    ]
+    assert_same_row({"cpu": docs})
+
+
+def test_excluded_and_empty_metrics():
+    assert_same_row({
+        "cpu": [datapoint("cpu", 2.0)],
+        "cpu-start": [datapoint("cpu-start", 2.0)],
+        "alert": [{**datapoint("alert"), "severity": "warning"}],
+        "missing": [],
+    })
+
+
+def test_requires_numpy(monkeypatch):
+    monkeypatch.setattr(vectorized, "np", None)
+    with pytest.raises(ImportError, match="numpy"):
+        vectorized.normalize(run({"cpu": [datapoint("cpu", 1.0)]}), EXCLUDE)
+
+
+@pytest.mark.parametrize("prepare", [copy.deepcopy, as_series], ids=["documents", "series"])
+@pytest.mark.parametrize("case", GOLDEN, ids=[case["name"] for case in GOLDEN])
+def test_golden_rows(case, prepare):
+    assert_close_rows(vectorized.normalize(prepare(case["run"]), GOLDEN_EXCLUDE), case["row"])
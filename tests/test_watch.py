@@ -0,0 +1,153 @@
+"""Tests of the watch collection against a fake source and moto's in-memory S3."""
+
+import time
+import calendar
+import pytest
+from botocore.exceptions import ClientError
+from datetime import datetime, timedelta
+from data_collector.checkpoint import Checkpoint
+from data_collector.pipeline import ChunkExporter
+from data_collector.s3 import S3Uploader
+from data_collector.source import Source
+from data_collector.watch import Watcher
+from tests.conftest import BUCKET
+
+CONFIG = {"benchmark": "cluster-density-v2", "metadata": ["passed"], "metrics": ["cpu"], "exclude_normalization": []}
+FROM = datetime(2025, 1, 1)
+
+
+class FakeSource(Source):
+    """Serves runs of the given uuids, one minute apart from FROM unless told, waiting delay seconds before each run"""
+
+    def __init__(self, uuids=(), delay: float = 0.0, on_run=None):
+        super().__init__(CONFIG)
+        self.runs = []
+        self.delay = delay
+        self.on_run = on_run
+        self.add(*uuids)
+
+    def add(self, *uuids: str, timestamp: datetime = None) -> None:
+        for uuid in uuids:
+            self.runs.append((timestamp or FROM + timedelta(minutes=len(self.runs)), uuid))
+
+    def collect(self, from_date, to, search_after=None, skip_uuids=frozenset(), include_end=True):
+        for timestamp, uuid in self.runs:
+            if from_date <= timestamp <= to and uuid not in skip_uuids:
+                time.sleep(self.delay)
+                if self.on_run:
+                    self.on_run()
+                metrics = {"cpu": [{"uuid": uuid, "metricName": "cpu", "value": 2.0, "labels": {"mode": "user"}}]}
+                sort = [calendar.timegm(timestamp.utctimetuple()) * 1000, uuid]
+                yield {uuid: {"metadata": {"passed": True}, "metrics": metrics, "sort": sort}}
+
+    def histogram(self, from_date, to, interval):
+        return []
+
+
+@pytest.fixture
+def uploader(client):
+    uploader = S3Uploader(BUCKET)
+    yield uploader
+    uploader.close()
+
+
+def watcher(source: Source, uploader: S3Uploader, tmp_path, **options) -> Watcher:
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json")).load()
+    exporter = ChunkExporter({**CONFIG, "output_prefix": "test"}, "watch", checkpoint, uploader=uploader)
+    return Watcher(source, exporter, checkpoint, "", FROM, **options)
+
+
+def uploaded(client) -> list:
+    objects = client.list_objects_v2(Bucket=BUCKET).get("Contents", [])
+    return sorted(item["Key"] for item in objects if "_chunk_" in item["Key"])
+
+
+def test_full_chunks_are_flushed_while_polling(client, uploader, tmp_path):
+    instance = watcher(FakeSource(["u1", "u2", "u3", "u4", "u5"]), uploader, tmp_path, flush_rows=2)
+    instance.poll()
+    assert uploaded(client) == ["cluster-density-v2/watch_chunk_1.csv", "cluster-density-v2/watch_chunk_2.csv"]
+    assert [uuid for uuid, _, _ in instance.pending] == ["u5"]
+    # The watermark waits for the pending run
+    assert instance.checkpoint.watermark is None
+    instance.flush(force=True)
+    assert len(uploaded(client)) == 3
+    assert instance.checkpoint.uuids == {"u1", "u2", "u3", "u4", "u5"}
+    assert instance.checkpoint.watermark == instance.polled_until
+    assert instance.exported_runs == 5
+
+
+def test_partial_chunk_waits_for_flush_seconds(client, uploader, tmp_path):
+    instance = watcher(FakeSource(["u1"]), uploader, tmp_path, flush_rows=10, flush_seconds=0.2)
+    instance.poll()
+    instance.flush()
+    assert uploaded(client) == []
+    time.sleep(0.25)
+    instance.flush()
+    assert uploaded(client) == ["cluster-density-v2/watch_chunk_1.csv"]
+    assert not instance.pending and instance.pending_since is None
+
+
+def test_failed_flush_is_retried(client, uploader, tmp_path):
+    instance = watcher(FakeSource(["u1", "u2"]), uploader, tmp_path, interval=0.2, flush_seconds=0)
+    instance.poll()
+    uploader.bucket = "missing-bucket"
+    with pytest.raises(ClientError, match="NoSuchBucket"):
+        instance.flush()
+    # The rows are kept, and retried one interval later at the earliest
+    assert [uuid for uuid, _, _ in instance.pending] == ["u1", "u2"]
+    assert not instance._flush_due()
+    assert instance.checkpoint.watermark is None and instance.checkpoint.chunks == 0
+    uploader.bucket = BUCKET
+    time.sleep(0.25)
+    assert instance._flush_due()
+    instance.flush()
+    # The chunk number of the failed upload is given to the retried one
+    assert uploaded(client) == ["cluster-density-v2/watch_chunk_1.csv"]
+    assert instance.checkpoint.uuids == {"u1", "u2"}
+
+
+def test_watermark_forgets_the_uuids_no_poll_can_match(client, uploader, tmp_path):
+    source = FakeSource(["u1"])
+    instance = watcher(source, uploader, tmp_path, lookback=0, flush_seconds=0)
+    instance.poll()
+    instance.flush()
+    first = instance.checkpoint.watermark
+    assert instance.checkpoint.uuids == {"u1"}
+    time.sleep(1.1)
+    instance.poll()
+    # Polls now start after u1 was collected, so it can be forgotten
+    assert instance.checkpoint.watermark > first
+    assert instance.checkpoint.uuids == set()
+    # A restarted watcher resumes from the persisted watermark
+    restarted = watcher(source, uploader, tmp_path)
+    assert restarted.polled_until == instance.checkpoint.watermark
+
+
+def test_lookback_finds_late_runs_once(client, uploader, tmp_path):
+    source = FakeSource(["u1"])
+    instance = watcher(source, uploader, tmp_path, flush_seconds=0)
+    instance.poll()
+    instance.flush()
+    # Indexed after the poll, with a timestamp the poll already went past
+    source.add("u2", timestamp=datetime.utcfromtimestamp(instance.polled_until - 60))
+    instance.poll()
+    instance.flush()
+    instance.poll()
+    assert not instance.pending
+    assert instance.checkpoint.uuids == {"u1", "u2"}
+    assert instance.exported_runs == 2
+    assert len(uploaded(client)) == 2
+
+
+
+def test_long_poll_making_progress_is_healthy(client, uploader, tmp_path):
+    statuses = []
+    runs = ["u1", "u2", "u3", "u4", "u5"]
+    source = FakeSource(runs, delay=0.1, on_run=lambda: statuses.append(instance.status()["healthy"]))
+    instance = watcher(source, uploader, tmp_path, interval=0.1)
+    instance.poll()
+    # The poll took longer than WATCH_STALE_POLLS intervals, but collected a run every interval
+    assert statuses and all(statuses)
+    assert instance.status()["healthy"]
+    time.sleep(0.4)
+    assert not instance.status()["healthy"]